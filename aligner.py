@@ -0,0 +1,197 @@
+"""Concurrent-safe MUSCLE executor.
+
+Every run gets its own private temp directory, MUSCLE is started without a
+shell, and a semaphore caps how many alignments run at once: a per-process
+one by default, or the one shared by all job workers (share_slots), so the
+cap holds however many worker processes there are.
+The binary is looked up at runtime (GF_MUSCLE_PATH, bin/, then PATH) and the
+command line is adapted to MUSCLE 5 (-align/-output/-threads) or 3.x (-in/-out).
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+from Bio import AlignIO
+
+import metrics
+
+# How often a running MUSCLE is checked for cancellation (s)
+POLL_INTERVAL = 0.5
+
+# Cross-process semaphore handed to job workers by jobs.py, None outside them
+_shared_slots = None
+
+
+class AlignerError(RuntimeError):
+    """MUSCLE is missing, failed, timed out or produced an unreadable alignment"""
+
+
+def share_slots(semaphore):
+    """Makes executors created from now on in this process take their slots from `semaphore`"""
+    global _shared_slots
+    _shared_slots = semaphore
+
+
+def find_muscle(configured=None):
+    """Returns the path of a usable MUSCLE binary or None"""
+    candidates = []
+    if os.environ.get('GF_MUSCLE_PATH'):
+        candidates.append(os.environ['GF_MUSCLE_PATH'])
+    if configured:
+        candidates.append(configured)
+    for path in candidates:
+        # bin/muscle.exe is a Windows build, only usable where it can actually be executed
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            if not path.lower().endswith('.exe') or sys.platform.startswith('win'):
+                return path
+    for name in ('muscle', 'muscle5', 'muscle3'):
+        found = shutil.which(name)
+        if found:
+            return found
+    return None
+
+
+def muscle_major_version(path):
+    """Major version of a MUSCLE binary (5 for 'muscle 5.1...', 3 for 'MUSCLE v3.8...')"""
+    try:
+        result = subprocess.run([path, '-version'], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return 5
+    output = (result.stdout + result.stderr).lower()
+    for token in output.replace('v', ' ').split():
+        if token[:1].isdigit():
+            try:
+                return int(token.split('.')[0])
+            except ValueError:
+                continue
+    return 5
+
+
+class MuscleExecutor:
+    """Runs MUSCLE safely from any number of threads, recording wall time and exit status"""
+
+    def __init__(self, path, max_parallel=None, threads=None, history=100):
+        self.path = path
+        self.max_parallel = max_parallel or os.cpu_count() or 1
+        self.threads = threads
+        # A multiprocessing semaphore is also thread-safe, so it replaces the local one outright
+        self._slots = _shared_slots or threading.BoundedSemaphore(self.max_parallel)
+        self._lock = threading.Lock()
+        self._version = None
+        self.runs = deque(maxlen=history)
+        self.counters = {'runs': 0, 'failures': 0, 'timeouts': 0, 'cancelled': 0, 'seconds': 0.0}
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = muscle_major_version(self.path)
+        return self._version
+
+    def command(self, input_file, output_file):
+        """MUSCLE argument list for this binary's version"""
+        if self.version >= 5:
+            args = [self.path, '-align', input_file, '-output', output_file]
+            if self.threads:
+                args += ['-threads', str(self.threads)]
+            return args
+        return [self.path, '-in', input_file, '-out', output_file, '-quiet']
+
+    def align(self, sequences, timeout=120, check=None):
+        """Aligns [(id, sequence), ...] and returns a MultipleSeqAlignment in input order.
+
+        check is called while MUSCLE runs; if it raises (e.g. a cancelled job) MUSCLE is
+        killed and the exception propagates.
+        """
+        if len(sequences) < 2:
+            raise AlignerError("At least 2 sequences are required")
+
+        with self._slots, tempfile.TemporaryDirectory(prefix='muscle_') as workdir:
+            input_file = os.path.join(workdir, 'input.fasta')
+            output_file = os.path.join(workdir, 'aligned.fasta')
+            # Ids are indexes: MUSCLE reorders its output and can choke on odd titles
+            with open(input_file, 'w') as f:
+                for i, (_, sequence) in enumerate(sequences):
+                    f.write(f">s{i}\n{sequence}\n")
+
+            returncode, stderr, elapsed = self._run(self.command(input_file, output_file), timeout, check)
+            self._record(len(sequences), returncode, elapsed)
+            if returncode is None:
+                raise AlignerError(f"MUSCLE timed out after {timeout} s")
+            if returncode != 0:
+                raise AlignerError(f"MUSCLE exited with code {returncode}: {stderr.strip()[-500:]}")
+            if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+                raise AlignerError("MUSCLE produced no alignment")
+            try:
+                alignment = AlignIO.read(output_file, 'fasta')
+            except Exception as e:
+                raise AlignerError(f"Could not read MUSCLE output: {e}")
+
+        # Put rows back in input order and restore the caller's ids
+        alignment.sort(key=lambda record: int(record.id[1:]))
+        for record in alignment:
+            record.id = sequences[int(record.id[1:])][0]
+            record.name = record.id
+            record.description = ''
+        return alignment
+
+    def _run(self, args, timeout, check):
+        """Runs MUSCLE, returns (returncode or None on timeout, stderr, seconds)"""
+        start = time.perf_counter()
+        with tempfile.TemporaryFile() as stderr_file:
+            proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                    stderr=stderr_file)
+            try:
+                while True:
+                    wait = POLL_INTERVAL
+                    if timeout is not None:
+                        wait = max(0.0, min(wait, timeout - (time.perf_counter() - start)))
+                    try:
+                        proc.wait(timeout=wait)
+                        break
+                    except subprocess.TimeoutExpired:
+                        pass
+                    if timeout is not None and time.perf_counter() - start >= timeout:
+                        proc.kill()
+                        proc.wait()
+                        return None, '', time.perf_counter() - start
+                    if check is not None:
+                        check()
+            except BaseException:
+                proc.kill()
+                proc.wait()
+                with self._lock:
+                    self.counters['cancelled'] += 1
+                metrics.inc('gf_muscle_runs_total', exit_status='cancelled')
+                raise
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode('utf-8', 'replace')
+        return proc.returncode, stderr, time.perf_counter() - start
+
+    def _record(self, n_sequences, returncode, elapsed):
+        status = 'timeout' if returncode is None else returncode
+        with self._lock:
+            self.runs.append({'time': time.time(), 'sequences': n_sequences,
+                              'seconds': round(elapsed, 3), 'exit_status': status})
+            self.counters['runs'] += 1
+            self.counters['seconds'] += elapsed
+            if returncode is None:
+                self.counters['timeouts'] += 1
+            elif returncode != 0:
+                self.counters['failures'] += 1
+        metrics.inc('gf_muscle_runs_total', exit_status=status)
+        print(f"MUSCLE run: {n_sequences} sequences, {elapsed:.2f} s, exit status {status}")
+
+    def stats(self):
+        """Counters plus the most recent runs"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['recent'] = list(self.runs)
+        stats['path'] = self.path
+        stats['max_parallel'] = self.max_parallel
+        stats['threads'] = self.threads
+        return stats
@@ -0,0 +1,209 @@
+"""Column profile of an alignment: consensus, conservation, entropy, gaps, identity.
+
+The aligned rows are turned into an (n, L) matrix of symbol codes once, and a
+(L, 6) counts-per-column matrix (A, C, G, T, any other residue, gap) is built
+from it with a single bincount. Every per-column statistic is then a NumPy
+reduction over that matrix, and the pairwise identity matrix is a few
+matrix products of one-hot rows (matching residues / columns where both rows
+have a residue), so nothing is computed per pair or per column in Python.
+
+Profiles come from the MUSCLE alignment kept with a tree in the tree cache or,
+when there is none, from the dataset's sequences right-padded with gaps (what
+the results page used to build in the browser).
+"""
+import threading
+from collections import OrderedDict
+from io import StringIO
+
+import numpy as np
+from Bio import AlignIO
+
+SYMBOLS = 'ACGTN-'
+RESIDUES = 5  # codes below this are residues, OTHER included
+OTHER, GAP = 4, 5
+# Conservation above this (but below 1) counts as partially conserved
+PARTIAL_CONSERVATION = 0.5
+# Largest padded matrix built from a dataset (bytes, one per cell)
+MAX_CELLS = 64 << 20
+# Rows per block (on both sides) when computing pairwise identities
+IDENTITY_BLOCK = 512
+# Longest alignment whose column counts float32 products hold exactly
+EXACT_FLOAT32 = 1 << 24
+# Profiles kept in memory
+PROFILES = 8
+
+
+def _build_lut():
+    """Byte -> symbol code, case-insensitive, U read as T, '-' and '.' as gaps"""
+    lut = np.full(256, OTHER, dtype=np.uint8)
+    for code, bases in enumerate(('Aa', 'Cc', 'Gg', 'TtUu')):
+        for base in bases:
+            lut[ord(base)] = code
+    lut[ord('-')] = lut[ord('.')] = GAP
+    return lut
+
+
+_LUT = _build_lut()
+
+
+class AlignmentProfile:
+    """Counts-per-column profile of n aligned rows of length L"""
+
+    def __init__(self, names, codes, source):
+        self.names = names
+        self.codes = codes
+        self.source = source
+        n, length = codes.shape
+        flat = (np.arange(length) * len(SYMBOLS))[np.newaxis, :] + codes
+        self.counts = np.bincount(flat.ravel(), minlength=length * len(SYMBOLS)).reshape(length, len(SYMBOLS))
+
+        residues = self.counts[:, :RESIDUES]
+        self.residue_counts = residues.sum(axis=1)
+        top = residues.argmax(axis=1)
+        self.consensus_codes = np.where(self.residue_counts > 0, top, GAP)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Frequency of the consensus residue among the residues of the column
+            self.conservation = np.where(self.residue_counts > 0,
+                                         residues[np.arange(length), top] / self.residue_counts, 0.0)
+            freqs = residues / self.residue_counts[:, np.newaxis]
+            self.entropy = 0.0 - np.nansum(np.where(freqs > 0, freqs * np.log2(freqs), 0.0), axis=1)
+        self.gap_fraction = self.counts[:, GAP] / n if n else np.zeros(length)
+        self.distinct = np.count_nonzero(residues, axis=1)
+        self._average_identity = None
+
+    @classmethod
+    def from_rows(cls, names, rows, source='alignment'):
+        """Profile of equal-length aligned strings"""
+        lengths = {len(row) for row in rows}
+        if len(lengths) > 1:
+            raise ValueError("Aligned rows must all have the same length")
+        length = lengths.pop() if lengths else 0
+        raw = np.frombuffer(''.join(rows).encode('ascii', 'replace'), dtype=np.uint8)
+        return cls(list(names), _LUT[raw].reshape(len(rows), length), source)
+
+    @classmethod
+    def from_alignment(cls, alignment):
+        """Profile of a Bio.Align.MultipleSeqAlignment"""
+        return cls.from_rows([record.id for record in alignment], [str(record.seq) for record in alignment])
+
+    @classmethod
+    def from_fasta(cls, aligned_fasta):
+        return cls.from_alignment(AlignIO.read(StringIO(aligned_fasta), 'fasta'))
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        """Profile of the dataset's sequences right-padded with gaps (no real alignment)"""
+        offsets = np.asarray(dataset.offsets, dtype=np.int64)
+        lengths = np.diff(offsets)
+        length = int(lengths.max()) if len(lengths) else 0
+        if len(lengths) * length > MAX_CELLS:
+            raise ValueError(f"Padded alignment too large ({len(lengths)} x {length})")
+        codes = np.full((len(lengths), length), GAP, dtype=np.uint8)
+        raw = np.frombuffer(dataset._decode(0, dataset.total_bases), dtype=np.uint8)
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        codes[rows, np.arange(len(raw)) - offsets[rows]] = _LUT[raw]
+        return cls(list(dataset.titles), codes, 'padded')
+
+    @property
+    def length(self):
+        return self.codes.shape[1]
+
+    def _identities(self, rows, cols):
+        """(matches, compared) between two row blocks: equal residues, columns where both have one.
+        The masks go through BLAS as float32, exact while the alignment is under EXACT_FLOAT32 columns."""
+        dtype = np.float32 if self.length < EXACT_FLOAT32 else np.float64
+        left, right = self.codes[rows], self.codes[cols]
+        compared = (left < RESIDUES).astype(dtype) @ (right < RESIDUES).astype(dtype).T
+        matches = np.zeros_like(compared)
+        for code in range(RESIDUES):
+            matches += (left == code).astype(dtype) @ (right == code).astype(dtype).T
+        return matches, compared
+
+    def identity_matrix(self, limit=None, row=0, col=0):
+        """Percent identity between `limit` rows from `row` and `limit` rows from `col` (the first ones
+        by default; NaN where two rows share no residue column)"""
+        n = len(self.names)
+        limit = limit or n
+        rows = np.arange(min(row, n), min(row + limit, n))
+        cols = np.arange(min(col, n), min(col + limit, n))
+        matches, compared = self._identities(rows, cols)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(compared > 0, 100.0 * matches.astype(np.float64) / compared, np.nan)
+
+    def average_identity(self):
+        """Mean percent identity over every pair of rows, computed in square blocks and remembered"""
+        if self._average_identity is None:
+            n = len(self.names)
+            total, pairs = 0.0, 0
+            for start in range(0, n, IDENTITY_BLOCK):
+                block = np.arange(start, min(start + IDENTITY_BLOCK, n))
+                for other in range(start, n, IDENTITY_BLOCK):
+                    later = np.arange(other, min(other + IDENTITY_BLOCK, n))
+                    matches, compared = self._identities(block, later)
+                    # Upper triangle only: pairs (i, j) with j > i
+                    valid = (later[np.newaxis, :] > block[:, np.newaxis]) & (compared > 0)
+                    total += float((matches[valid].astype(np.float64) / compared[valid]).sum())
+                    pairs += int(np.count_nonzero(valid))
+            self._average_identity = 100.0 * total / pairs if pairs else None
+        return self._average_identity
+
+    def conservation_line(self, start=0, end=None):
+        """'*' one residue type, ':' at most two, '.' more, per column (the browser's old legend)"""
+        distinct = self.distinct[start:end]
+        return ''.join(np.where(distinct == 1, '*', np.where(distinct <= 2, ':', '.')))
+
+    def summary(self, identity=False):
+        """Alignment-wide statistics; the average identity (quadratic in the rows) only when asked"""
+        fully = self.conservation == 1.0
+        summary = {
+            'source': self.source,
+            'sequences': len(self.names),
+            'names': self.names,
+            'length': self.length,
+            'conserved_positions': int(np.count_nonzero(self.distinct == 1)),
+            'fully_conserved': int(np.count_nonzero(fully)),
+            'partially_conserved': int(np.count_nonzero(~fully & (self.conservation > PARTIAL_CONSERVATION))),
+            'variable': int(np.count_nonzero(self.conservation <= PARTIAL_CONSERVATION)),
+            'gaps': int(self.counts[:, GAP].sum()),
+            'mean_entropy': float(self.entropy.mean()) if self.length else 0.0,
+        }
+        if identity:
+            summary['average_identity'] = self.average_identity()
+        return summary
+
+    def window(self, start=0, end=None, rows=True):
+        """Per-column statistics for columns [start, end), plus the aligned rows' slices"""
+        start, end, _ = slice(start, end).indices(self.length)
+        end = max(start, end)
+        columns = {
+            'start': start,
+            'end': end,
+            'consensus': ''.join(np.array(list(SYMBOLS))[self.consensus_codes[start:end]]),
+            'conservation_line': self.conservation_line(start, end),
+            'conservation': np.round(self.conservation[start:end], 3).tolist(),
+            'entropy': np.round(self.entropy[start:end], 3).tolist(),
+            'gap_fraction': np.round(self.gap_fraction[start:end], 3).tolist(),
+        }
+        if rows:
+            symbols = np.frombuffer(SYMBOLS.encode('ascii'), dtype=np.uint8)
+            columns['rows'] = [symbols[row].tobytes().decode('ascii') for row in self.codes[:, start:end]]
+        return columns
+
+
+_profiles = OrderedDict()
+_lock = threading.Lock()
+
+
+def cached_profile(key, build):
+    """Profile under `key` from a small LRU, calling build() to make it on a miss"""
+    with _lock:
+        profile = _profiles.get(key)
+        if profile is not None:
+            _profiles.move_to_end(key)
+            return profile
+    profile = build()
+    with _lock:
+        _profiles[key] = profile
+        while len(_profiles) > PROFILES:
+            _profiles.popitem(last=False)
+    return profile
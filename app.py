@@ -1,41 +1,100 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, render_template, request, redirect, url_for, jsonify, make_response, g
 #render_template to combine HTML with Python data
 #request to handle HTTP requests, access JSON body, handle GET POST methods, see url parameters
 # redirect to redirect to another route
 #url_for to generate URLs for app routes
 #jsonify to convert Python data to JSON and send as HTTP response
 
-from Bio import SeqIO #read sequences
-from Bio.SeqUtils import gc_fraction
-from io import StringIO
+import cProfile
+import io
 import json
-import matplotlib
-import seaborn as sns
-matplotlib.use('Agg')  # To avoid GUI issues
-import matplotlib.pyplot as plt
+import pstats
+import re
+import time
+from datetime import datetime
 import numpy as np
-import base64
-from io import BytesIO
-from collections import Counter
 import os
-import subprocess
-from Bio import AlignIO, Phylo
-from Bio.Phylo.TreeConstruction import DistanceCalculator, DistanceTreeConstructor
-from Bio.Align import MultipleSeqAlignment
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
+import metrics
+from alignment_profile import AlignmentProfile, cached_profile
+from composition import annotate_sequences
+from dataset_store import DatasetStore
+from export import (DEFAULT_WRAP, FORMATS as EXPORT_FORMATS, aligned_records, blocks, clade_of, consensus_record,
+                    fasta_records, gzipped, newick, tree_tips)
+from ingest import FastaFormatError, FastaLimitError, parse_fasta_stream
+from jobs import JobManager, QueueFullError
+from metrics import input_size, timed
+from motif_index import MAX_MISMATCHES, get_motif_index, parse_motif
+from phylogeny import (DISTANCE_METHODS, cached_extension, cached_phylogeny, distance_index, run_extend_job,
+                       run_phylogeny_job, tree_cache)
+from pipeline import extend_global_statistics, global_statistics
+from render import TREE_STYLES, RenderCache, data_key, histogram_data, render_histogram, render_tree
+from sequence_table import MAX_PAGE_SIZE, PAGE_SIZE, SORT_KEYS, get_sequence_table
+from settings import (DATASET_DIR, DATASET_MAX_BYTES, DATASET_TTL, JOB_QUEUE_SIZE, JOB_RETENTION, JOB_TIMEOUT,
+                      JOB_WORKERS, MAX_FASTA_BYTES, MAX_FASTA_RECORDS, MUSCLE_MAX_PARALLEL, PLOT_DIR, PROFILE_LINES,
+                      PROFILING, RENDER_CACHE_BYTES, RENDER_DISK_BYTES, UPLOAD_FOLDER)
+from windows import DEFAULT_POINTS, window_stats
 
 #Create instance that manages files and routes, manages the web app itself
 app = Flask(__name__)
 
-UPLOAD_FOLDER = 'uploads'
-# Use path relative to app.py
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MUSCLE_PATH = os.path.join(BASE_DIR, 'bin', 'muscle.exe')
 #creates folders if they don't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True) #for files
 os.makedirs('static', exist_ok=True) # for css, js, images
 
+app.config['MAX_FASTA_RECORDS'] = MAX_FASTA_RECORDS
+app.config['MAX_FASTA_BYTES'] = MAX_FASTA_BYTES
+
+# MUSCLE + tree building run here instead of in the request thread
+job_manager = JobManager(max_workers=JOB_WORKERS, max_queue=JOB_QUEUE_SIZE,
+                         timeout=JOB_TIMEOUT, retention=JOB_RETENTION, muscle_parallel=MUSCLE_MAX_PARALLEL)
+
+# Analyzed uploads, so follow-up requests send a dataset id instead of the sequences
+dataset_store = DatasetStore(DATASET_DIR, ttl=DATASET_TTL, max_bytes=DATASET_MAX_BYTES)
+
+# Plots are served from their own URLs, rendered once per input hash
+render_cache = RenderCache(PLOT_DIR, max_bytes=RENDER_CACHE_BYTES, max_disk_bytes=RENDER_DISK_BYTES)
+# Content hashes (SHA-256 hex) are the only keys the plot/tree URLs accept
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+# Images and data are content-addressed, so browsers may keep them and just revalidate the ETag
+PLOT_MAX_AGE = 86400
+# Alignment columns per profile request (default and maximum) and rows in the identity matrix
+PROFILE_WINDOW = 800
+PROFILE_MAX_WINDOW = 5000
+PROFILE_MAX_MATRIX = 200
+# Distance matrix tiles (rows = columns, default and maximum)
+DISTANCE_TILE = 50
+DISTANCE_MAX_TILE = 200
+# Bases of the first sequence shown when the results page opens
+PREVIEW_BASES = 120
+
+# Every request is timed per endpoint; with GF_PROFILING=1, ?profile=1 answers with a cProfile summary instead
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profiler = None
+    if PROFILING and request.args.get('profile') == '1':
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another request is being profiled right now (one profiler per process)
+            return
+        g.profiler = profiler
+
+@app.after_request
+def finish_request_timer(response):
+    elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+    metrics.observe('gf_request_seconds', elapsed, endpoint=request.endpoint or 'unknown',
+                    method=request.method, status=response.status_code)
+    profiler = g.get('profiler')
+    if profiler is None:
+        return response
+    profiler.disable()
+    summary = io.StringIO()
+    summary.write(f"{request.method} {request.path} -> {response.status}, {elapsed:.3f} s\n\n")
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_LINES)
+    return app.response_class(summary.getvalue(), mimetype='text/plain')
+
 #When the user visits the root URL /, executes the function that shows the index html
 #the browser requests, get request, something to show, and the server responds with the content of index.html
 @app.route('/')
@@ -46,524 +105,667 @@ def index():
 #browser sends, post request, data to the flask server, which responds by executing analyze
 @app.route('/analyze', methods=['POST'])
 def analyze():
-    sequences = []
-    #request looks in the body of the post request for the data sent by the user
-    #reads, from the HTML form, all entries whose name are exactly manual_sequences[] and manual_titles[]
-    manual_sequences = request.form.getlist('manual_sequences[]')
-    manual_titles = request.form.getlist('manual_titles[]')
-    
-    for title, seq in zip(manual_titles, manual_sequences):
-        if seq.strip():
-            sequences.append({'title': title, 'sequence': seq})
-    
-    # Process FASTA file
-    fasta_file = request.files.get('fasta_file')
-    if fasta_file and fasta_file.filename != '':
-        fasta_content = fasta_file.read().decode('utf-8')
-        fasta_io = StringIO(fasta_content)
-        for record in SeqIO.parse(fasta_io, "fasta"):
-            sequences.append({'title': record.id, 'sequence': str(record.seq)})
+    sequences, error = read_submitted_sequences()
+    if error is not None:
+        return error
     
     # If there are no sequences, redirect to the main page
     if not sequences:
         return redirect(url_for('index'))
     
-    # Calculate statistics for each sequence
-    for seq_data in sequences:
-        sequence = seq_data['sequence']
-        seq_data['length'] = len(sequence)
-        seq_data['gc'] = 100*gc_fraction(sequence, ambiguous="ignore")
-        
-        # Count bases
-        bases = {'A': 0, 'T': 0, 'C': 0, 'G': 0, 'N': 0}
-        for base in sequence.upper():
-            if base in bases:
-                bases[base] += 1
-            else:
-                bases['N'] += 1  # Unrecognized bases
-        seq_data['bases'] = bases
-    
-    # Generate histogram of lengths
-    histogram_img = generate_histogram([s['length'] for s in sequences])
+    n_sequences, total_bases = input_size(sequences)
+    # Calculate global statistics (kept with the dataset, so adding sequences later only adds to them)
+    with timed('global_stats', n_sequences, total_bases):
+        global_stats = global_statistics(sequences)
     
-    # Calculate global statistics
-    global_stats = {
-        'total_sequences': len(sequences),
-        'total_bases': sum(s['length'] for s in sequences),
-        'avg_gc': np.mean([s['gc'] for s in sequences]),
-        'base_percentages': calculate_base_percentages(sequences)
-    }
-
-    # Generate phylogenetic tree and get real distances
-    phylo_tree_img = None
-    distance_matrix = None
+    # Keep the upload server-side, the page and its follow-up requests only carry its id
+    with timed('dataset_store', n_sequences, total_bases):
+        dataset_id = dataset_store.put(sequences, global_stats)
+
+    # Phylogenetic tree and real distances: straight from the cache if we've seen this input,
+    # otherwise queued as a background job that the results page polls
+    distance_method, cluster = tree_options()
+    phylo_tree = None
+    tree_job_id = None
+    tree_message = None
     if len(sequences) > 1:  # Only if there is more than one sequence
-        print(f"Generating phylogenetic tree for {len(sequences)} sequences...")
-        phylo_tree_img, distance_matrix = generate_phylogenetic_tree_with_distances(sequences)
-        print(f"Result: tree_img={'Generated' if phylo_tree_img else 'None'}, distances={'Generated' if distance_matrix else 'None'}")
-    
-    # Render the results page with the data
-    return render_template('results.html',
-                           sequences=sequences,
-                           global_stats=global_stats,
-                           histogram_img=histogram_img,
-                           phylo_tree_img=phylo_tree_img,
-                           distance_matrix=distance_matrix)
-
-def calculate_base_percentages(sequences):
-    """Calculates the percentage of each base in all sequences"""
-    total_bases = sum(s['length'] for s in sequences)
-    base_counts = Counter()
-    
-    for seq in sequences:
-        for base, count in seq['bases'].items():
-            base_counts[base] += count
+        with timed('tree_cache_lookup', n_sequences, total_bases, method=distance_method):
+            phylo_tree = cached_phylogeny(sequences, method=distance_method, cluster=cluster)
+        if phylo_tree is None:
+            print(f"Queueing phylogenetic tree for {len(sequences)} sequences...")
+            tree_job_id, tree_message = submit_tree_job(run_phylogeny_job, sequences, distance_method, cluster)
     
-    return {base: (count / total_bases) * 100 for base, count in base_counts.items()}
-
-def generate_histogram(lengths):
-    """Generates a histogram of sequence lengths with Seaborn"""
-    import matplotlib.pyplot as plt
-    import seaborn as sns
-    import numpy as np
-    from io import BytesIO
-    import base64
-    
-    # Global style config - NO GRID, TRANSPARENT
-    plt.style.use('dark_background')  # Dark background for contrast
-    plt.rcParams.update({
-        'axes.facecolor': 'none',      # Transparent background for plot area
-        'figure.facecolor': 'none',    # Transparent background for the whole figure
-        'axes.edgecolor': 'white',     # White color for axes
-        'axes.labelcolor': 'white',    # White color for labels
-        'xtick.color': 'white',        # White color for X axis ticks
-        'ytick.color': 'white',        # White color for Y axis ticks
-        'grid.color': 'none'           # No grid
-    })
-    
-    # Create figure with transparent background
-    plt.figure(figsize=(8, 4), facecolor='none')
-    
-    # Create histogram WITHOUT borders and WITHOUT grid
-    ax = sns.histplot(
-        lengths, 
-        bins=15, 
-        color='#e63946', 
-        kde=True,
-        edgecolor='none',  # Remove bar borders
-        line_kws={'color': 'white'}  # KDE line in white
-    )
-    
-    # Remove grid completely
-    ax.grid(False)
+    return results_page(dataset_store.get(dataset_id), global_stats, phylo_tree, tree_job_id, tree_message,
+                        distance_method)
+
+@app.route('/datasets/<dataset_id>/extend', methods=['POST'])
+def extend_dataset(dataset_id):
+    """Adds the submitted sequences to a dataset without analyzing it again: composition is computed
+    for the new sequences only, global stats are added to, and the tree given as ?tree= (or form
+    field) grows by the new sequences (phylogeny.run_extend_job). Renders the new dataset's page."""
+    dataset = dataset_store.get(dataset_id)
+    if dataset is None:
+        return jsonify({'error': 'Unknown or expired dataset'}), 404
+    added, error = read_submitted_sequences()
+    if error is not None:
+        return error
+    if not added:
+        return jsonify({'error': 'No sequences to add'}), 400
     
-    # Customize title and labels
-    plt.title('Sequence Length Distribution', fontsize=14, color='white')
-    plt.xlabel('Length (bp)', fontsize=12, color='white')
-    plt.ylabel('Number of Sequences', fontsize=12, color='white')
+    n_added, added_bases = input_size(added)
+    with timed('global_stats', n_added, added_bases):
+        # Datasets stored before global stats were kept with them get them from their per-sequence stats once
+        global_stats = extend_global_statistics(dataset.global_stats or global_statistics(dataset.stats), added)
+    with timed('dataset_extend', n_added, added_bases):
+        extended = dataset_store.get(dataset_store.extend(dataset, added, global_stats))
     
-    # Customize KDE line
-    if ax.lines:  # If KDE line exists
-        ax.lines[0].set_color('white')
+    distance_method, cluster = tree_options()
+    base_key = request.values.get('tree', '')
+    base_key = base_key if KEY_PATTERN.match(base_key) else None
+    phylo_tree = None
+    tree_job_id = None
+    tree_message = None
+    if len(extended) > 1:
+        if base_key:
+            phylo_tree = cached_extension(base_key, added)
+        if phylo_tree is None:
+            print(f"Queueing tree update for {n_added} sequences added to {len(dataset)}...")
+            tree_job_id, tree_message = submit_tree_job(run_extend_job, extended.records(), distance_method, cluster,
+                                                        added=n_added, base_key=base_key)
     
-    # Add mean line
-    if lengths:
-        mean_length = np.mean(lengths)
-        plt.axvline(
-            mean_length, 
-            color='#2a9d8f', 
-            linestyle='dashed', 
-            linewidth=2
-        )
-        
-        # Well-positioned mean text
-        plt.text(
-            0.98, 
-            0.98,  # 98% of width and height
-            f'Mean: {mean_length:.0f} bp', 
-            color='#2a9d8f', 
-            fontsize=12,
-            transform=plt.gca().transAxes,  # Relative coordinates
-            horizontalalignment='right',    # Align right
-            verticalalignment='top',        # Align top
-            bbox=dict(
-                facecolor='black', 
-                alpha=0.5, 
-                edgecolor='none', 
-                boxstyle='round,pad=0.3'
-            )
-        )
+    return results_page(extended, global_stats, phylo_tree, tree_job_id, tree_message, distance_method)
+
+def read_submitted_sequences():
+    """Manual entries and the FASTA upload of the form, with length/GC/bases filled in.
+    Returns (sequences, None), or (None, error response) when the upload can't be read."""
+    sequences = []
+    #request looks in the body of the post request for the data sent by the user
+    #reads, from the HTML form, all entries whose name are exactly manual_sequences[] and manual_titles[]
+    manual_sequences = request.form.getlist('manual_sequences[]')
+    manual_titles = request.form.getlist('manual_titles[]')
     
-    # Remove unnecessary spines
-    sns.despine(left=True, bottom=True)
+    for title, seq in zip(manual_titles, manual_sequences):
+        if seq.strip():
+            sequences.append({'title': title, 'sequence': seq})
+    # Length, GC and base counts for the manual entries in one vectorized pass
+    if sequences:
+        with timed('composition', *input_size(sequences)):
+            annotate_sequences(sequences)
     
-    # Customize visible spines
-    for spine in ['left', 'bottom']:
-        ax.spines[spine].set_color('white')
-        ax.spines[spine].set_linewidth(0.5)
+    # Process FASTA file, streamed off the upload (plain or gzip/BGZF) with stats computed while parsing
+    fasta_file = request.files.get('fasta_file')
+    if fasta_file and fasta_file.filename != '':
+        try:
+            with timed('parse') as size:
+                parsed = list(parse_fasta_stream(fasta_file.stream,
+                                                 max_records=app.config['MAX_FASTA_RECORDS'],
+                                                 max_bytes=app.config['MAX_FASTA_BYTES']))
+                size['sequences'], size['bases'] = input_size(parsed)
+            sequences.extend(parsed)
+        except FastaLimitError as e:
+            return None, (jsonify({'error': str(e)}), 413)
+        except FastaFormatError as e:
+            return None, (jsonify({'error': str(e)}), 400)
+        except (OSError, EOFError) as e:
+            # Corrupt or truncated gzip
+            return None, (jsonify({'error': f'Could not read FASTA file: {e}'}), 400)
+    return sequences, None
+
+def tree_options():
+    """Distance method and cluster identity from the form"""
+    distance_method = request.form.get('distance_method', 'alignment')
+    if distance_method not in DISTANCE_METHODS:
+        distance_method = 'alignment'
+    return distance_method, parse_cluster_identity(request.form.get('cluster_identity'))
+
+def submit_tree_job(fn, sequences, method, cluster, **kwargs):
+    """Queues a tree job over dicts with only titles and sequences, returns (job id, message for the page)"""
+    job_sequences = [{'title': s['title'], 'sequence': s['sequence']} for s in sequences]
+    try:
+        with timed('job_submit', *input_size(job_sequences), method=method):
+            job_id = job_manager.submit(fn, job_sequences, timeout=JOB_TIMEOUT, method=method, cluster=cluster,
+                                        **kwargs)
+        return job_id, None
+    except QueueFullError as e:
+        print(f"WARNING: {e}")
+        return None, 'The server is busy building other trees, please try again in a few minutes'
+
+def results_page(dataset, global_stats, phylo_tree, tree_job_id, tree_message, distance_method):
+    """The results page. Its size doesn't grow with the dataset: it carries a summary, the first
+    sequence's preview and the first titles, the rest is paged in from /datasets/<id>/stats."""
+    n_sequences = len(dataset)
+    table = get_sequence_table(dataset)
     
-    # Save to buffer with transparent background
-    buffer = BytesIO()
-    plt.savefig(
-        buffer, 
-        format='png', 
-        bbox_inches='tight', 
-        dpi=100, 
-        transparent=True  # Transparent background
-    )
-    plt.close()
+    # Histogram of lengths: only its bins are computed here, the image has its own URL
+    with timed('histogram', n_sequences):
+        histogram_key = store_histogram(table.lengths)
     
-    # Convert to base64 for embedding in HTML
-    img_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    return f"data:image/png;base64,{img_data}"
+    preview = {'title': dataset.titles[0], 'length': dataset.length(0),
+               'sequence': dataset.sequence(0, 0, PREVIEW_BASES)}
+    # Render the results page with the data
+    with timed('render_page', n_sequences):
+        return render_template('results.html',
+                               dataset_id=dataset.id,
+                               summary=table.summary(),
+                               preview=preview,
+                               first_titles=dataset.titles[:2],
+                               global_stats=global_stats,
+                               histogram_key=histogram_key,
+                               phylo_tree=phylo_tree,
+                               tree_job_id=tree_job_id,
+                               tree_message=tree_message,
+                               distance_method=distance_method)
 
-def generate_phylogenetic_tree_with_distances(sequences):
-    """Generates a phylogenetic tree and returns both the image and the distance matrix"""
+def parse_cluster_identity(value):
+    """Identity percentage from the form (e.g. '99') as a 0-1 threshold, None to only collapse exact duplicates"""
     try:
-        print("Starting phylogenetic tree generation...")
-        print(f"Current working directory: {os.getcwd()}")
-        print(f"MUSCLE path: {MUSCLE_PATH}")
-        print(f"Absolute MUSCLE path: {os.path.abspath(MUSCLE_PATH)}")
-        
-        # Validate MUSCLE exists
-        if not os.path.exists(MUSCLE_PATH):
-            print(f"ERROR: MUSCLE not found at {MUSCLE_PATH}")
-            print("Current directory contents:")
-            for item in os.listdir('.'):
-                print(f"  - {item}")
-            if os.path.exists('bin'):
-                print("bin directory contents:")
-                for item in os.listdir('bin'):
-                    print(f"  - bin/{item}")
-            return generate_simple_phylogenetic_tree(sequences)
-        
-        # Create temporary FASTA file
-        input_file = os.path.join(UPLOAD_FOLDER, 'temp_input.fasta')
-        aligned_file = os.path.join(UPLOAD_FOLDER, 'temp_aligned.fasta')
-        
-        print("Writing sequences to temporary file...")
-        # Validate and clean sequences before writing
-        valid_sequences = []
-        for i, seq_data in enumerate(sequences):
-            sequence = seq_data['sequence'].upper().strip()
-            title = seq_data['title'].strip()
-            
-            # Validate sequence is not empty
-            if not sequence:
-                print(f"WARNING: Sequence '{title}' is empty, skipping...")
-                continue
-                
-            # Clean title to avoid MUSCLE issues
-            clean_title = title.replace(' ', '_').replace('|', '_').replace(':', '_').replace(';', '_')
-            if not clean_title:
-                clean_title = f"Seq_{i+1}"
-                
-            valid_sequences.append({'title': clean_title, 'sequence': sequence})
-        
-        if len(valid_sequences) < 2:
-            print("ERROR: At least 2 valid sequences are required")
-            return generate_simple_phylogenetic_tree(sequences)
-        
-        # Write sequences in FASTA format
-        with open(input_file, 'w') as f:
-            for seq_data in valid_sequences:
-                f.write(f">{seq_data['title']}\n{seq_data['sequence']}\n")
-                
-        print(f"FASTA file created with {len(valid_sequences)} valid sequences")
-        
-        print(f"Running MUSCLE: {MUSCLE_PATH}")
-        # MUSCLE 5.3 uses syntax: -align input -output output
-        muscle_cline = f'"{MUSCLE_PATH}" -align "{input_file}" -output "{aligned_file}"'
-        print(f"Full command: {muscle_cline}")
-        
-        result = subprocess.run(muscle_cline, shell=True, capture_output=True, text=True, timeout=120)
-        
-        print(f"MUSCLE return code: {result.returncode}")
-        if result.stderr:
-            print(f"MUSCLE stderr: {result.stderr}")
-        if result.stdout:
-            print(f"MUSCLE stdout: {result.stdout}")
-            
-        # Check if output file was created and has content
-        if os.path.exists(aligned_file):
-            file_size = os.path.getsize(aligned_file)
-            print(f"Aligned file created: {aligned_file} ({file_size} bytes)")
-            if file_size == 0:
-                print("WARNING: Aligned file is empty")
-                return generate_simple_phylogenetic_tree(sequences)
-        else:
-            print(f"ERROR: Aligned file not created: {aligned_file}")
-            return generate_simple_phylogenetic_tree(sequences)
-        
-        if result.returncode != 0:
-            print("MUSCLE ended with error, using alternative method...")
-            return generate_simple_phylogenetic_tree(sequences)
-        
-        print("Reading alignment...")
-        # Read alignment
-        try:
-            alignment = AlignIO.read(aligned_file, 'fasta')
-            print(f"Alignment read: {len(alignment)} sequences")
-        except Exception as e:
-            print(f"Error reading alignment: {e}")
-            return generate_simple_phylogenetic_tree(sequences)
-        
-        # Calculate distances and tree
-        print("Calculating distances...")
-        calculator = DistanceCalculator('identity')
-        dm = calculator.get_distance(alignment)
-        constructor = DistanceTreeConstructor()
-        tree = constructor.nj(dm)
-        
-        # Convert distance matrix to usable format
-        seq_names = [seq['title'] for seq in sequences]
-        distance_dict = {}
-        
-        for i, name1 in enumerate(seq_names):
-            for j, name2 in enumerate(seq_names):
-                if i < j:  # Only calculate unique distances (upper triangle)
-                    distance = dm[i, j]
-                    distance_dict[f"{name1}|{name2}"] = round(distance, 4)
-        
-        print("Generating tree image...")
-        # Generate tree image with themed background
-        fig, ax = plt.subplots(figsize=(10, 6))
-        
-        # Create a gradient background matching the page theme
-        # Using your theme colors: dark tones with red/green accents
-        from matplotlib.colors import LinearSegmentedColormap
-        
-        # Define gradient colors (from your CSS theme)
-        colors = ['#1a1a1a', '#2a2a2a', '#1e1e1e']  # Dark tones
-        n_bins = 100
-        cmap = LinearSegmentedColormap.from_list('custom', colors, N=n_bins)
-        
-        # Create gradient background
-        gradient = np.linspace(0, 1, 256).reshape(1, -1)
-        gradient = np.vstack((gradient, gradient))
-        ax.imshow(gradient, aspect='auto', cmap=cmap, alpha=0.8,
-                 extent=[ax.get_xlim()[0], ax.get_xlim()[1], 
-                        ax.get_ylim()[0], ax.get_ylim()[1]])
-        
-        # Draw the tree (keep default colors)
-        Phylo.draw(tree, do_show=False, axes=ax)
-        
-        # Customize the title
-        plt.title('Phylogenetic Tree', color='white', fontsize=16, 
-                 fontweight='bold', pad=20)
-        
-        # Make axes transparent but keep background
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['bottom'].set_visible(False)
-        ax.spines['left'].set_visible(False)
-        ax.tick_params(left=False, bottom=False, labelleft=False, labelbottom=False)
-        
-        # Adjust margins
-        plt.tight_layout()
-        
-        # Save as base64
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png', bbox_inches='tight', dpi=100, 
-                   facecolor='#1a1a1a', edgecolor='none')
-        plt.close()
-        
-        # Clean up temporary files
-        try:
-            if os.path.exists(input_file):
-                os.remove(input_file)
-            if os.path.exists(aligned_file):
-                os.remove(aligned_file)
-        except:
-            pass
-        
-        img_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        tree_img = f"data:image/png;base64,{img_data}"
-        
-        print("Phylogenetic tree generated successfully!")
-        return tree_img, distance_dict
-        
-    except Exception as e:
-        print(f"Error generating phylogenetic tree: {e}")
-        import traceback
-        traceback.print_exc()
-        return generate_simple_phylogenetic_tree(sequences)
-
-def generate_simple_phylogenetic_tree(sequences):
-    """Generates a simple phylogenetic tree without MUSCLE using Hamming distances"""
+        percent = float(value)
+    except (TypeError, ValueError):
+        return None
+    if 50 <= percent < 100:
+        return percent / 100
+    return None
+
+def store_histogram(lengths):
+    """Stores the bins/KDE of the sequence lengths for the histogram URLs, returns their key"""
+    key = data_key(lengths)
+    if render_cache.get_data('histogram', key) is None:
+        render_cache.put_data('histogram', key, histogram_data(lengths))
+    return key
+
+def cached_response(body, etag, mimetype, public=True):
+    """Response with an ETag and Cache-Control, answered with 304 when the browser already has it"""
+    response = make_response(body)
+    response.mimetype = mimetype
+    response.set_etag(etag)
+    if public:
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+    response.cache_control.max_age = PLOT_MAX_AGE
+    return response.make_conditional(request)
+
+# Plot data and images, addressed by the hash of their inputs
+@app.route('/plots/histogram/<key>.json', methods=['GET'])
+def histogram_json(key):
+    data = render_cache.get_data('histogram', key) if KEY_PATTERN.match(key) else None
+    if data is None:
+        return jsonify({'error': 'Unknown histogram'}), 404
+    return cached_response(json.dumps(data), RenderCache.etag('histogram.json', key), 'application/json')
+
+@app.route('/plots/histogram/<key>.png', methods=['GET'])
+def histogram_image(key):
+    data = render_cache.get_data('histogram', key) if KEY_PATTERN.match(key) else None
+    if data is None:
+        return jsonify({'error': 'Unknown histogram'}), 404
+    etag = RenderCache.etag('histogram', key)
+    if request.if_none_match.contains(etag):
+        return cached_response(b'', etag, 'image/png')
+    png = render_cache.image('histogram', key, lambda: render_histogram(data))
+    return cached_response(png, etag, 'image/png')
+
+@app.route('/trees/<key>.json', methods=['GET'])
+def tree_json(key):
+    entry = tree_cache.get(key) if KEY_PATTERN.match(key) else None
+    if entry is None:
+        return jsonify({'error': 'Unknown tree'}), 404
+    body = json.dumps({'newick': entry['newick'], 'names': entry['names']})
+    return cached_response(body, RenderCache.etag('tree.json', key), 'application/json')
+
+@app.route('/trees/<key>.png', methods=['GET'])
+def tree_image(key):
+    style = request.args.get('style', 'muscle')
+    if style not in TREE_STYLES:
+        return jsonify({'error': f'Unknown style: {style}'}), 400
+    etag = RenderCache.etag('tree', key, style)
+    if KEY_PATTERN.match(key) and request.if_none_match.contains(etag):
+        return cached_response(b'', etag, 'image/png')
+    entry = tree_cache.get(key) if KEY_PATTERN.match(key) else None
+    if entry is None:
+        return jsonify({'error': 'Unknown tree'}), 404
+    png = render_cache.image('tree', key, lambda: render_tree(entry['newick'], style), style)
+    return cached_response(png, etag, 'image/png')
+
+def tree_urls(tree):
+    """Image and Newick URLs of a tree reference from phylogeny.py"""
+    return {'tree_url': url_for('tree_image', key=tree['key'], style=tree['style']),
+            'newick_url': url_for('tree_json', key=tree['key'])}
+
+# Background job endpoints (tree building)
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if status['status'] in ('queued', 'running'):
+        return jsonify(status), 202  # Not ready yet, keep polling
+    result = job_manager.result(job_id)
+    if result is None:
+        return jsonify(status), 409  # Failed, cancelled or timed out
+    return jsonify(dict(result, **tree_urls(result['tree'])))
+
+@app.route('/jobs/<job_id>/tree.png', methods=['GET'])
+def job_tree_image(job_id):
+    result = job_manager.result(job_id)
+    if result is None:
+        return jsonify({'error': 'Tree not available'}), 404
+    return redirect(tree_urls(result['tree'])['tree_url'])
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def job_cancel(job_id):
+    if job_manager.status(job_id) is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    cancelled = job_manager.cancel(job_id)
+    return jsonify({'cancelled': cancelled, 'status': job_manager.status(job_id)['status']})
+
+# Prometheus scrape endpoint: stage/request histograms and counters (job workers included) plus current gauges
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    jobs = job_manager.stats()
+    trees = tree_cache.stats()
+    renders = render_cache.stats()
+    datasets = dataset_store.stats()
+    gauges = [
+        ('gf_jobs', 'Jobs by state', {'state': 'queued'}, jobs['queued']),
+        ('gf_jobs', 'Jobs by state', {'state': 'running'}, jobs['running']),
+        ('gf_job_queue_capacity', 'Jobs that may be queued or running at once', {}, jobs['capacity']),
+        ('gf_job_workers', 'Job worker processes', {}, jobs['workers']),
+    ]
+    for status in ('submitted', 'rejected', 'done', 'failed', 'cancelled', 'timeout'):
+        gauges.append(('gf_job_outcomes', 'Jobs submitted, rejected and finished since start',
+                       {'outcome': status}, jobs[status]))
+    for cache, ratio in metrics.cache_hit_ratios():
+        gauges.append(('gf_cache_hit_ratio', 'Cache hits over lookups since start', {'cache': cache}, ratio))
+    gauges += [
+        ('gf_tree_cache_bytes', 'Tree cache size by tier', {'tier': 'memory'}, trees['memory_bytes']),
+        ('gf_tree_cache_bytes', 'Tree cache size by tier', {'tier': 'disk'}, trees['disk_bytes']),
+        ('gf_render_cache_bytes', 'Rendered PNGs held in memory', {}, renders['bytes']),
+        ('gf_datasets', 'Stored datasets', {}, datasets['datasets']),
+        ('gf_dataset_bytes', 'Disk used by stored datasets', {}, datasets['bytes']),
+    ]
+    return app.response_class(metrics.REGISTRY.render(gauges), mimetype='text/plain; version=0.0.4')
+
+# Stored datasets (see dataset_store.py)
+@app.route('/datasets/<dataset_id>', methods=['GET'])
+def dataset_summary(dataset_id):
+    dataset = dataset_store.get(dataset_id)
+    if dataset is None:
+        return jsonify({'error': 'Unknown or expired dataset'}), 404
+    return jsonify(dict(dataset.summary(), titles=dataset.titles))
+
+@app.route('/datasets/<dataset_id>/sequences', methods=['GET'])
+def dataset_sequences(dataset_id):
+    dataset = dataset_store.get(dataset_id)
+    if dataset is None:
+        return jsonify({'error': 'Unknown or expired dataset'}), 404
+    # Datasets never change, the id is a valid ETag
+    return cached_response(json.dumps(list(dataset.records())), dataset_id, 'application/json', public=False)
+
+@app.route('/datasets/<dataset_id>/stats', methods=['GET'])
+def dataset_stats(dataset_id):
+    """One page of per-sequence stats: ?offset=&limit=, ?sort=index|title|length|gc&order=asc|desc,
+    filtered by ?q= (title contains) and ?min_length=&max_length=&min_gc=&max_gc="""
+    dataset = dataset_store.get(dataset_id)
+    if dataset is None:
+        return jsonify({'error': 'Unknown or expired dataset'}), 404
+    sort = request.args.get('sort', 'index')
+    if sort not in SORT_KEYS:
+        return jsonify({'error': f"sort must be one of {', '.join(SORT_KEYS)}"}), 400
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 0), MAX_PAGE_SIZE)
+    order = request.args.get('order', 'asc')
+    table = get_sequence_table(dataset)
+    matched, items = table.page(offset, limit, sort, descending=order == 'desc',
+                                query=request.args.get('q', '').strip(),
+                                min_length=request.args.get('min_length', type=int),
+                                max_length=request.args.get('max_length', type=int),
+                                min_gc=request.args.get('min_gc', type=float),
+                                max_gc=request.args.get('max_gc', type=float))
+    return jsonify({'sequences': len(table), 'matched': matched, 'offset': offset, 'limit': limit,
+                    'sort': sort, 'order': order, 'items': items})
+
+@app.route('/datasets/<dataset_id>/sequences/<int:index>', methods=['GET'])
+def dataset_sequence(dataset_id, index):
+    dataset = dataset_store.get(dataset_id)
+    if dataset is None:
+        return jsonify({'error': 'Unknown or expired dataset'}), 404
+    if index >= len(dataset):
+        return jsonify({'error': 'Sequence index out of range'}), 404
+    start = request.args.get('start', 0, type=int)
+    end = request.args.get('end', None, type=int)
+    return jsonify({'index': index, 'title': dataset.titles[index], 'length': dataset.length(index),
+                    'start': start, 'sequence': dataset.sequence(index, start, end)})
+
+@app.route('/datasets/<dataset_id>/sequences/<int:index>/windows', methods=['GET'])
+def dataset_sequence_windows(dataset_id, index):
+    """Sliding-window GC%, skews and N density along one sequence (see windows.py)"""
+    dataset = dataset_store.get(dataset_id)
+    if dataset is None:
+        return jsonify({'error': 'Unknown or expired dataset'}), 404
+    if index >= len(dataset):
+        return jsonify({'error': 'Sequence index out of range'}), 404
+    window = request.args.get('window', None, type=int)
+    step = request.args.get('step', None, type=int)
+    points = request.args.get('points', DEFAULT_POINTS, type=int)
+    try:
+        with timed('windows', bases=dataset.length(index)):
+            stats = window_stats(dataset, index, window, step, points)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    etag = f"{dataset_id}-{index}-windows-{stats['window']}-{stats['step']}-{points}"
+    return cached_response(json.dumps(stats), etag, 'application/json', public=False)
+
+@app.route('/datasets/<dataset_id>/motifs', methods=['GET'])
+def dataset_motifs(dataset_id):
+    """Motif hits (IUPAC codes, both strands, optional mismatches) from the dataset's FM-index"""
+    dataset = dataset_store.get(dataset_id)
+    if dataset is None:
+        return jsonify({'error': 'Unknown or expired dataset'}), 404
+    try:
+        motif = parse_motif(request.args.get('q', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    strands = request.args.get('strands', 'both')
+    if strands not in ('both', 'forward', 'reverse'):
+        return jsonify({'error': 'strands must be both, forward or reverse'}), 400
+    mismatches = request.args.get('mismatches', 0, type=int)
+    if not 0 <= mismatches <= min(MAX_MISMATCHES, len(motif) - 1):
+        return jsonify({'error': f'mismatches must be between 0 and {MAX_MISMATCHES} and less than the motif length'}), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+    context = min(max(request.args.get('context', 10, type=int), 0), 100)
+
+    sequence, start, strand, cost, total = get_motif_index(dataset).search(motif, mismatches, strands)
+    hits = []
+    for i in range((page - 1) * per_page, min(page * per_page, len(sequence))):
+        index, hit_start = int(sequence[i]), int(start[i])
+        hit_end = hit_start + len(motif)
+        window = dataset.sequence(index, max(hit_start - context, 0), hit_end + context)
+        before = min(hit_start, context)
+        hits.append({'index': index, 'title': dataset.titles[index], 'start': hit_start, 'end': hit_end,
+                     'strand': '+' if strand[i] > 0 else '-', 'mismatches': int(cost[i]),
+                     'before': window[:before], 'match': window[before:before + len(motif)],
+                     'after': window[before + len(motif):]})
+    return jsonify({'motif': motif, 'strands': strands, 'mismatches': mismatches, 'total': total,
+                    'located': len(sequence), 'sequences': int(len(np.unique(sequence))),
+                    'page': page, 'per_page': per_page, 'hits': hits})
+
+# Alignment profile: the tree's MUSCLE alignment when ?tree= has one, else the padded sequences
+def _dataset_profile(dataset):
+    tree_key = request.args.get('tree', '')
+    if KEY_PATTERN.match(tree_key):
+        entry = tree_cache.get(tree_key)
+        if entry is not None and entry['aligned_fasta']:
+            return cached_profile(('tree', tree_key), lambda: AlignmentProfile.from_fasta(entry['aligned_fasta']))
+    return cached_profile(('dataset', dataset.id), lambda: AlignmentProfile.from_dataset(dataset))
+
+@app.route('/datasets/<dataset_id>/profile', methods=['GET'])
+def dataset_profile(dataset_id):
+    """Profile summary (with the average identity on ?identity=1) plus the per-column statistics
+    (and rows) of ?start=&end= columns"""
+    dataset = dataset_store.get(dataset_id)
+    if dataset is None:
+        return jsonify({'error': 'Unknown or expired dataset'}), 404
+    try:
+        profile = _dataset_profile(dataset)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 413
+    start = max(request.args.get('start', 0, type=int), 0)
+    end = min(request.args.get('end', start + PROFILE_WINDOW, type=int), start + PROFILE_MAX_WINDOW)
+    rows = request.args.get('rows', '1') != '0'
+    # The average identity compares every pair of rows, so it is only computed on ?identity=1
+    identity = request.args.get('identity', '0') == '1'
+    return jsonify(dict(profile.summary(identity), columns=profile.window(start, end, rows=rows)))
+
+@app.route('/datasets/<dataset_id>/profile/identity', methods=['GET'])
+def dataset_profile_identity(dataset_id):
+    """Percent identity matrix between the first ?limit= rows of the profile"""
+    dataset = dataset_store.get(dataset_id)
+    if dataset is None:
+        return jsonify({'error': 'Unknown or expired dataset'}), 404
     try:
-        print("Generating simple phylogenetic tree...")
-        
-        # Calculate simple Hamming distances
-        distance_dict = {}
-        seq_names = [seq['title'] for seq in sequences]
-        
-        # Create distance matrix manually
-        distance_matrix = []
-        for i, seq1 in enumerate(sequences):
-            row = []
-            for j, seq2 in enumerate(sequences):
-                if i == j:
-                    distance = 0.0
-                else:
-                    # Calculate simple Hamming distance
-                    s1, s2 = seq1['sequence'], seq2['sequence']
-                    min_len = min(len(s1), len(s2))
-                    max_len = max(len(s1), len(s2))
-                    
-                    if min_len == 0:
-                        distance = 1.0
-                    else:
-                        differences = sum(1 for k in range(min_len) if s1[k] != s2[k])
-                        differences += abs(len(s1) - len(s2))  # Penalize length differences
-                        distance = differences / max_len
-                
-                row.append(distance)
-                
-                # Save in dict for JavaScript
-                if i < j:
-                    distance_dict[f"{seq1['title']}|{seq2['title']}"] = round(distance, 4)
-            
-            distance_matrix.append(row)
-        
-        # Create simple alignment (without real alignment)
-        from Bio.Align import MultipleSeqAlignment
-        from Bio.SeqRecord import SeqRecord
-        from Bio.Seq import Seq
-        
-        # Create records for BioPython
-        records = []
-        max_length = max(len(seq['sequence']) for seq in sequences)
-        
-        for seq in sequences:
-            # Pad sequences to same length
-            padded_seq = seq['sequence'].ljust(max_length, '-')
-            clean_title = seq['title'].replace(' ', '_').replace('|', '_')
-            record = SeqRecord(Seq(padded_seq), id=clean_title)
-            records.append(record)
-        
-        alignment = MultipleSeqAlignment(records)
-        
-        # Use BioPython to create the tree
-        calculator = DistanceCalculator('identity')
-        dm = calculator.get_distance(alignment)
-        constructor = DistanceTreeConstructor()
-        tree = constructor.nj(dm)
-        
-        # Generate tree image
-        plt.figure(figsize=(10, 6), facecolor='none')
-        plt.style.use('dark_background')
-        
-        # Set all colors to white
-        plt.rcParams.update({
-            'axes.edgecolor': 'white',
-            'axes.labelcolor': 'white', 
-            'xtick.color': 'white',
-            'ytick.color': 'white',
-            'text.color': 'white',
-            'lines.color': 'white',
-            'patch.edgecolor': 'white'
-        })
-        
-        # Draw tree
-        ax = plt.gca()
-        Phylo.draw(tree, do_show=False, axes=ax)
-        
-        # Force all lines to white
-        for line in ax.lines:
-            line.set_color('white')
-            line.set_linewidth(2)
-        
-        # Force all text to white
-        for text in ax.texts:
-            text.set_color('white')
-            text.set_fontsize(10)
-        
-        plt.title('Phylogenetic Tree (Simple Distances)', color='white', fontsize=14, pad=20)
-        
-        # Make background transparent
-        ax.set_facecolor('none')
-        for spine in ax.spines.values():
-            spine.set_visible(False)
-        
-        # Save as base64
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png', bbox_inches='tight', dpi=100, transparent=True)
-        plt.close()
-        
-        img_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        tree_img = f"data:image/png;base64,{img_data}"
-        
-        print("Simple phylogenetic tree generated successfully!")
-        return tree_img, distance_dict
-        
-    except Exception as e:
-        print(f"Error in simple phylogenetic tree: {e}")
-        import traceback
-        traceback.print_exc()
-        return None, None
-
-# New route to get specific distance
+        profile = _dataset_profile(dataset)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 413
+    limit = min(max(request.args.get('limit', 50, type=int), 1), PROFILE_MAX_MATRIX)
+    # ?row=&col= pick a tile further into the matrix
+    row = max(request.args.get('row', 0, type=int), 0)
+    col = max(request.args.get('col', 0, type=int), 0)
+    matrix = np.round(profile.identity_matrix(limit, row, col), 1)
+    return jsonify({'source': profile.source, 'sequences': len(profile.names), 'row': row, 'col': col,
+                    'names': profile.names[row:row + limit], 'columns': profile.names[col:col + limit],
+                    'identity': [[None if np.isnan(v) else float(v) for v in values] for values in matrix]})
+
+# Distance queries on the server-held matrix of a tree (keyed like /trees/<key>)
+def _query_index(key):
+    return distance_index(key) if KEY_PATTERN.match(key) else None
+
+def _query_sequence(index):
+    """Sequence from ?name= or ?index=, None if missing or unknown"""
+    if request.args.get('index') is not None:
+        return index.resolve(request.args.get('index', type=int))
+    return index.resolve(request.args.get('name'))
+
+def _neighbours(index, hits):
+    return [{'index': j, 'name': index.names[j], 'distance': d} for j, d in hits]
+
+@app.route('/distances/<key>', methods=['GET'])
+def distance_names(key):
+    index = _query_index(key)
+    if index is None:
+        return jsonify({'error': 'Unknown distance matrix'}), 404
+    return jsonify({'sequences': index.n, 'names': index.names})
+
+@app.route('/distances/<key>/pairs', methods=['POST'])
+def distance_pairs(key):
+    index = _query_index(key)
+    if index is None:
+        return jsonify({'error': 'Unknown distance matrix'}), 404
+    pairs = (request.get_json(silent=True) or {}).get('pairs')
+    if not isinstance(pairs, list) or not all(isinstance(p, list) and len(p) == 2 for p in pairs):
+        return jsonify({'error': 'Expected {"pairs": [[name_or_index, name_or_index], ...]}'}), 400
+    return jsonify({'distances': index.pairs(pairs)})
+
+@app.route('/distances/<key>/row', methods=['GET'])
+def distance_row(key):
+    index = _query_index(key)
+    if index is None:
+        return jsonify({'error': 'Unknown distance matrix'}), 404
+    i = _query_sequence(index)
+    if i is None:
+        return jsonify({'error': 'Unknown sequence'}), 404
+    return jsonify({'index': i, 'name': index.names[i], 'distances': index.row(i).tolist()})
+
+@app.route('/distances/<key>/tile', methods=['GET'])
+def distance_tile(key):
+    """Block of the matrix: ?size= rows from ?row= by as many columns from ?col="""
+    index = _query_index(key)
+    if index is None:
+        return jsonify({'error': 'Unknown distance matrix'}), 404
+    size = min(max(request.args.get('size', DISTANCE_TILE, type=int), 1), DISTANCE_MAX_TILE)
+    row = max(request.args.get('row', 0, type=int), 0)
+    col = max(request.args.get('col', 0, type=int), 0)
+    rows, cols, block = index.tile(row, col, size)
+    return jsonify({'sequences': index.n, 'row': row, 'col': col,
+                    'names': [index.names[i] for i in rows.tolist()],
+                    'columns': [index.names[j] for j in cols.tolist()],
+                    'distances': block.tolist()})
+
+@app.route('/distances/<key>/nearest', methods=['GET'])
+def distance_nearest(key):
+    index = _query_index(key)
+    if index is None:
+        return jsonify({'error': 'Unknown distance matrix'}), 404
+    i = _query_sequence(index)
+    if i is None:
+        return jsonify({'error': 'Unknown sequence'}), 404
+    k = max(request.args.get('k', 10, type=int), 0)
+    farthest = request.args.get('order', 'nearest') == 'farthest'
+    return jsonify({'index': i, 'name': index.names[i],
+                    'neighbours': _neighbours(index, index.nearest(i, k, farthest=farthest))})
+
+@app.route('/distances/<key>/within', methods=['GET'])
+def distance_within(key):
+    index = _query_index(key)
+    if index is None:
+        return jsonify({'error': 'Unknown distance matrix'}), 404
+    i = _query_sequence(index)
+    if i is None:
+        return jsonify({'error': 'Unknown sequence'}), 404
+    maximum = request.args.get('max', type=float)
+    if maximum is None:
+        return jsonify({'error': 'max is required'}), 400
+    hits = index.within(i, maximum, request.args.get('min', type=float))
+    return jsonify({'index': i, 'name': index.names[i], 'neighbours': _neighbours(index, hits)})
+
+# Single pair lookup, kept for older clients
 @app.route('/get_distance', methods=['POST'])
 def get_distance():
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     seq1 = data.get('seq1')
     seq2 = data.get('seq2')
-    distance_matrix = data.get('distance_matrix', {})
+    if seq1 == seq2:
+        return jsonify({'distance': 0.0})  # Same sequence
+    
+    if data.get('tree_key'):
+        index = _query_index(data['tree_key'])
+        if index is None:
+            return jsonify({'error': 'Unknown distance matrix'}), 404
+        distance = index.pairs([(seq1, seq2)])[0]
+    else:
+        # Look for the distance in both directions (a real 0.0 is a valid distance)
+        distance_matrix = data.get('distance_matrix', {})
+        distance = distance_matrix.get(f"{seq1}|{seq2}")
+        if distance is None:
+            distance = distance_matrix.get(f"{seq2}|{seq1}")
+    
+    if distance is None:
+        return jsonify({'error': 'Unknown sequence'}), 404
+    return jsonify({'distance': distance})
+
+# Streaming exports (see export.py): nothing is built in memory, so there's no Content-Length
+def _export_option(name, type=str, default=None):
+    """Export option from the JSON body, or else the query string"""
+    value = (request.get_json(silent=True) or {}).get(name)
+    if value is None:
+        value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return type(value)
+    except (TypeError, ValueError):
+        return default
+
+def _export_flag(name):
+    return str(_export_option(name, default='0')).lower() in ('1', 'true', 'yes', 'on')
+
+def _export_list(name):
+    """List option: a JSON list, or repeated query arguments"""
+    value = (request.get_json(silent=True) or {}).get(name)
+    if isinstance(value, list):
+        return [str(item) for item in value]
+    return request.args.getlist(name)
+
+def export_response(chunks, filename, mimetype, compress=False):
+    chunks = blocks(chunks)
+    if compress:
+        chunks = gzipped(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    response = app.response_class(chunks, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@app.route('/datasets/<dataset_id>/export', methods=['GET', 'POST'])
+def dataset_export(dataset_id):
+    """Streams ?format=fasta|aligned|consensus|newick (the last three need ?tree=), gzipped with ?gzip=1
+    and wrapped at ?wrap= bases (0 = no wrapping). A subset is picked with ?title= (repeated, or a JSON
+    list), the stats filters ?q=&min_length=&max_length=&min_gc=&max_gc=, and/or ?clade= titles whose
+    common ancestor's tips are exported."""
+    dataset = dataset_store.get(dataset_id)
+    if dataset is None:
+        return jsonify({'error': 'Unknown or expired dataset'}), 404
+    fmt = _export_option('format', default='fasta')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    width = max(_export_option('wrap', int, DEFAULT_WRAP), 0)
+    titles = _export_list('title')
+    clade_titles = _export_list('clade')
+    filters = {'query': _export_option('q', default='').strip(),
+               'min_length': _export_option('min_length', int), 'max_length': _export_option('max_length', int),
+               'min_gc': _export_option('min_gc', float), 'max_gc': _export_option('max_gc', float)}
     
-    # Look for the distance in both directions
-    key1 = f"{seq1}|{seq2}"
-    key2 = f"{seq2}|{seq1}"
+    tree_key = _export_option('tree', default='')
+    entry = tree_cache.get(tree_key) if KEY_PATTERN.match(tree_key) else None
+    if entry is None and (fmt != 'fasta' or clade_titles):
+        return jsonify({'error': 'Unknown tree, the export needs the key of the dataset\'s tree'}), 404
+    if entry is not None and entry['names'] != dataset.titles:
+        return jsonify({'error': 'The tree was not built from this dataset'}), 400
     
-    distance = distance_matrix.get(key1) or distance_matrix.get(key2)
+    table = get_sequence_table(dataset)
+    indices = table.select(**filters)
+    if titles:
+        wanted = set(titles)
+        indices = indices[[dataset.titles[i] in wanted for i in indices.tolist()]]
+    clade = None
+    if clade_titles:
+        members, clade = clade_of(entry, clade_titles)
+        if members is None:
+            return jsonify({'error': 'Unknown sequence in clade'}), 404
+        indices = np.intersect1d(indices, members)
+    filtered = bool(titles) or any(value not in (None, '') for value in filters.values())
+    subset = filtered or bool(clade_titles)
+    if not len(indices):
+        return jsonify({'error': 'No sequences match the selection'}), 400
     
-    if distance is not None:
-        return jsonify({'distance': distance})
-    else:
-        return jsonify({'distance': 0.0})  # Same sequence
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if fmt == 'fasta':
+        return export_response(fasta_records(dataset, indices.tolist(), width),
+                               f"genomics_freedom_export_{timestamp}.fasta", 'text/plain', _export_flag('gzip'))
+    if fmt == 'newick':
+        if filtered:
+            return jsonify({'error': 'A Newick export takes a clade, not a list or filter of sequences'}), 400
+        return export_response(newick(entry, clade), f"genomics_freedom_tree_{timestamp}.nwk", 'text/plain',
+                               _export_flag('gzip'))
+    if not entry['aligned_fasta']:
+        return jsonify({'error': 'This tree has no alignment (alignment-free or fallback distances)'}), 404
+    # Alignment rows are named by their tree tip
+    tips = tree_tips(entry)
+    labels = {tips[i] for i in indices.tolist() if tips[i]} if subset else None
+    if fmt == 'aligned':
+        return export_response(aligned_records(entry['aligned_fasta'], labels, width),
+                               f"genomics_freedom_alignment_{timestamp}.fasta", 'text/plain', _export_flag('gzip'))
+    profile = cached_profile(('tree', tree_key), lambda: AlignmentProfile.from_fasta(entry['aligned_fasta']))
+    rows = [r for r, name in enumerate(profile.names) if name in labels] if subset else None
+    if rows is not None and not rows:
+        return jsonify({'error': 'No aligned sequences match the selection'}), 400
+    return export_response(consensus_record(profile, rows, width),
+                           f"genomics_freedom_consensus_{timestamp}.fasta", 'text/plain', _export_flag('gzip'))
 
-# New route to export FASTA
+# Whole-dataset FASTA export, kept for older clients
 @app.route('/export_fasta', methods=['POST'])
 def export_fasta():
-    from flask import make_response
-    from datetime import datetime
+    data = request.get_json(silent=True) or {}
+    dataset = dataset_store.get(data.get('dataset_id'))
+    if dataset is None:
+        return jsonify({'error': 'Unknown or expired dataset'}), 404
+    if not len(dataset):
+        return jsonify({'error': 'No sequences to export'}), 400
+    if not dataset.total_bases:
+        return jsonify({'error': 'No valid sequences to export'}), 400
     
-    try:
-        data = request.get_json()
-        sequences = data.get('sequences', [])
-        
-        if not sequences:
-            return jsonify({'error': 'No sequences to export'}), 400
-        
-        # Generate FASTA content
-        fasta_content = ""
-        for seq in sequences:
-            title = seq.get('title', 'Unnamed_sequence')
-            sequence = seq.get('sequence', '')
-            
-            if sequence:
-                fasta_content += f">{title}\n{sequence}\n"
-        
-        if not fasta_content:
-            return jsonify({'error': 'No valid sequences to export'}), 400
-        
-        # Create response with file
-        response = make_response(fasta_content)
-        
-        # Generate filename with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"genomics_freedom_export_{timestamp}.fasta"
-        
-        # Set headers for download
-        response.headers['Content-Type'] = 'text/plain'
-        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-        response.headers['Content-Length'] = len(fasta_content)
-        
-        return response
-        
-    except Exception as e:
-        print(f"Error in FASTA export: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+    # Records are streamed off the dataset, one line per sequence as before
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return export_response(fasta_records(dataset, range(len(dataset)), width=0),
+                           f"genomics_freedom_export_{timestamp}.fasta", 'text/plain')
     
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,240 @@
+"""Headless batch analysis: the /analyze pipeline over many FASTA files, one file per worker.
+
+    python batch.py drops/2024-06-01/ extra.fa.gz -o results/ --jobs 8 --plots png,svg
+
+Inputs are files or directories (searched recursively for .fa/.fasta/.fna/...,
+optionally .gz/.bgz). Each input gets its own output directory with:
+
+  stats.json        global and per-sequence statistics, histogram bins, tree summary
+  distances.npz     condensed distance matrix (`condensed`) and its `names`
+  tree.nwk          Newick tree
+  alignment.fasta   the multiple alignment, when the distance method aligns
+  histogram.<fmt>   length histogram and tree images, for each --plots format
+  log.txt           what the pipeline printed while processing the file
+
+manifest.json is written last and records the input's size, mtime and the
+options, so an interrupted run resumes where it stopped and later runs skip
+inputs whose outputs are up to date (--force redoes them).
+
+Alignments and trees are cached like the web app's (tree_cache.py) under
+--cache-dir, by default uploads/cache next to this file whatever the working
+directory, so repeated inputs skip MUSCLE across runs.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from io import BytesIO
+
+import numpy as np
+
+FASTA_SUFFIXES = ('.fa', '.fasta', '.fna', '.fas', '.ffn', '.fsa', '.seq')
+COMPRESSED_SUFFIXES = ('.gz', '.bgz')
+PLOT_FORMATS = ('png', 'svg', 'pdf')
+MANIFEST = 'manifest.json'
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'cache')
+# Bumped when the outputs change, so older results are not taken as up to date
+BATCH_VERSION = 1
+
+
+def strip_suffixes(filename):
+    """'reads.fasta.gz' -> 'reads', or None if the name doesn't look like a FASTA file"""
+    lower = filename.lower()
+    for suffix in COMPRESSED_SUFFIXES:
+        if lower.endswith(suffix):
+            filename, lower = filename[:-len(suffix)], lower[:-len(suffix)]
+            break
+    for suffix in FASTA_SUFFIXES:
+        if lower.endswith(suffix):
+            return filename[:-len(suffix)]
+    return None
+
+
+def find_inputs(paths):
+    """[(input path, output name)] for files and FASTA files found under directories, sorted.
+    Names keep the sub-directories of directory inputs; clashing names get the full file name."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirs, files in os.walk(path):
+                subdirs.sort()
+                for filename in sorted(files):
+                    stem = strip_suffixes(filename)
+                    if stem is not None:
+                        relative = os.path.relpath(os.path.join(directory, stem), path)
+                        found.append((os.path.join(directory, filename), relative))
+        elif os.path.isfile(path):
+            found.append((path, strip_suffixes(os.path.basename(path)) or os.path.basename(path)))
+        else:
+            raise FileNotFoundError(f"No such file or directory: {path}")
+    # A file given directly and also found in a given directory is processed once
+    seen = set()
+    found = [(path, name) for path, name in found
+             if os.path.realpath(path) not in seen and not seen.add(os.path.realpath(path))]
+    names = [name for _, name in found]
+    return [(path, name if names.count(name) == 1 else os.path.join(os.path.dirname(name), os.path.basename(path)))
+            for path, name in found]
+
+
+def input_signature(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def up_to_date(out_dir, signature, options):
+    """True if out_dir holds a finished run over this exact input with the same options"""
+    try:
+        with open(os.path.join(out_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (manifest.get('version') == BATCH_VERSION
+            and manifest.get('input', {}).get('size') == signature['size']
+            and manifest.get('input', {}).get('mtime_ns') == signature['mtime_ns']
+            and manifest.get('options') == options
+            and all(os.path.exists(os.path.join(out_dir, name)) for name in manifest.get('outputs', [])))
+
+
+def _write(out_dir, name, data):
+    """Writes bytes to out_dir/name through a temp file, so a crash never leaves half a file"""
+    path = os.path.join(out_dir, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return name
+
+
+def _npz_bytes(**arrays):
+    buffer = BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def analyze_file(path, out_dir, options):
+    """Runs the pipeline over one FASTA file and writes its outputs, returns a summary dict"""
+    from pipeline import build_phylogeny, global_statistics, read_fasta, sequence_statistics
+    from render import histogram_data, render_histogram, render_tree
+
+    start = time.perf_counter()
+    signature = input_signature(path)
+    os.makedirs(out_dir, exist_ok=True)
+    outputs = []
+    with open(os.path.join(out_dir, 'log.txt'), 'w') as log, redirect_stdout(log):
+        sequences = read_fasta(path)
+        if not sequences:
+            raise ValueError("No FASTA records found")
+        histogram = histogram_data([s['length'] for s in sequences])
+        tree = build_phylogeny(sequences, method=options['method'], cluster=options['cluster'],
+                               timeout=options['timeout'])
+
+        stats = {
+            'input': signature['path'],
+            'global': global_statistics(sequences),
+            'sequences': sequence_statistics(sequences),
+            'histogram': histogram,
+            'tree': None,
+        }
+        if tree is not None:
+            stats['tree'] = {'method': options['method'], 'style': tree['style'], 'key': tree['key'],
+                             'aligned': bool(tree['aligned_fasta'])}
+            outputs.append(_write(out_dir, 'distances.npz',
+                                  _npz_bytes(names=np.array(tree['names']), condensed=tree['condensed'])))
+            outputs.append(_write(out_dir, 'tree.nwk', (tree['newick'] + '\n').encode('utf-8')))
+            if tree['aligned_fasta']:
+                outputs.append(_write(out_dir, 'alignment.fasta', tree['aligned_fasta'].encode('utf-8')))
+        for fmt in options['plots']:
+            outputs.append(_write(out_dir, f'histogram.{fmt}', render_histogram(histogram, fmt)))
+            if tree is not None:
+                outputs.append(_write(out_dir, f'tree.{fmt}', render_tree(tree['newick'], tree['style'], fmt)))
+        outputs.append(_write(out_dir, 'stats.json', json.dumps(stats, indent=2).encode('utf-8')))
+
+    seconds = time.perf_counter() - start
+    manifest = {'version': BATCH_VERSION, 'input': signature, 'options': options, 'outputs': outputs + ['log.txt'],
+                'finished': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'seconds': round(seconds, 3)}
+    _write(out_dir, MANIFEST, json.dumps(manifest, indent=2).encode('utf-8'))
+    return {'sequences': len(sequences), 'bases': stats['global']['total_bases'], 'seconds': seconds}
+
+
+def _run_task(path, out_dir, options):
+    """analyze_file for the pool: errors come back as a result instead of breaking the batch"""
+    try:
+        return dict(analyze_file(path, out_dir, options), status='done')
+    except Exception as e:
+        return {'status': 'failed', 'error': f"{e.__class__.__name__}: {e}"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the GenomicsFreedom analysis over FASTA files or directories")
+    parser.add_argument('inputs', nargs='+', help="FASTA files (plain or gzip) or directories to search")
+    parser.add_argument('-o', '--output', required=True, help="output directory, one sub-directory per input")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="files processed at once")
+    parser.add_argument('--method', default='alignment', choices=('alignment', 'progressive', 'sketch'),
+                        help="distance method, as on the analyze form")
+    parser.add_argument('--cluster', type=float, help="cluster near-identical sequences at this identity (%%), 50-99.9")
+    parser.add_argument('--plots', default='', help=f"comma-separated image formats ({', '.join(PLOT_FORMATS)})")
+    parser.add_argument('--timeout', type=float, help="MUSCLE time limit per file (s)")
+    parser.add_argument('--force', action='store_true', help="redo inputs whose outputs are up to date")
+    parser.add_argument('--cache-dir', default=os.environ.get('GF_CACHE_DIR') or DEFAULT_CACHE_DIR,
+                        help="alignment/tree cache directory (default: GF_CACHE_DIR or uploads/cache next to batch.py)")
+    args = parser.parse_args(argv)
+    # Read by settings.py, which this process and the spawned workers import after this point
+    os.environ['GF_CACHE_DIR'] = os.path.abspath(args.cache_dir)
+
+    plots = [fmt.strip().lower() for fmt in args.plots.split(',') if fmt.strip()]
+    bad = [fmt for fmt in plots if fmt not in PLOT_FORMATS]
+    if bad:
+        parser.error(f"unknown plot formats: {', '.join(bad)}")
+    if args.cluster is not None and not 50 <= args.cluster < 100:
+        parser.error("--cluster must be between 50 and 100 (exclusive)")
+    options = {'method': args.method, 'cluster': args.cluster / 100 if args.cluster is not None else None,
+               'plots': plots, 'timeout': args.timeout}
+    try:
+        inputs = find_inputs(args.inputs)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+
+    tasks, skipped = [], 0
+    for path, name in inputs:
+        out_dir = os.path.join(args.output, name)
+        if not args.force and up_to_date(out_dir, input_signature(path), options):
+            skipped += 1
+            continue
+        tasks.append((path, out_dir))
+    print(f"{len(inputs)} inputs, {skipped} up to date, {len(tasks)} to process with {args.jobs} workers")
+
+    failed = 0
+    start = time.perf_counter()
+    if args.jobs > 1 and len(tasks) > 1:
+        # spawn, like the web app's job pool: workers don't inherit this process's state
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=args.jobs, mp_context=context) as pool:
+            futures = {pool.submit(_run_task, path, out_dir, options): path for path, out_dir in tasks}
+            results = ((futures[future], future.result()) for future in as_completed(futures))
+            failed = _report(results, len(tasks))
+    else:
+        failed = _report(((path, _run_task(path, out_dir, options)) for path, out_dir in tasks), len(tasks))
+    print(f"Finished in {time.perf_counter() - start:.1f} s: {len(tasks) - failed} done, {failed} failed, "
+          f"{skipped} skipped")
+    return 1 if failed else 0
+
+
+def _report(results, total):
+    """Prints one line per finished input, returns how many failed"""
+    failed = 0
+    for done, (path, result) in enumerate(results, start=1):
+        if result['status'] == 'done':
+            print(f"[{done}/{total}] {path}: {result['sequences']} sequences, {result['bases']} bases, "
+                  f"{result['seconds']:.1f} s", flush=True)
+        else:
+            failed += 1
+            print(f"[{done}/{total}] {path}: FAILED {result['error']}", flush=True)
+    return failed
+
+
+if __name__ == '__main__':
+    sys.exit(main())
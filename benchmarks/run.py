@@ -0,0 +1,335 @@
+"""Benchmarks of each pipeline stage over a grid of synthetic dataset sizes.
+
+Every stage runs in isolation on the same synthetic family of sequences
+(benchmarks/synthetic.py) at each size of its grid, `--repeat` times; the
+median, minimum and every run go into a JSON report together with a fitted
+scaling exponent per stage (slope of log time over log n). Given a baseline
+report, any stage/size whose median got slower than `--threshold` (and by
+more than `--min-delta` seconds) is listed and the exit status is 1.
+
+    python -m benchmarks.run --out bench.json
+    python -m benchmarks.run --stages nj,hamming --sizes 500,2000 --baseline bench.json
+
+The run happens in a scratch directory (`--workdir`, a temp dir by default)
+so caches and datasets from earlier runs are never hit.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import synthetic_sequences, to_fasta  # noqa: E402
+
+# Sequence counts per stage: linear stages go further than the quadratic ones
+LINEAR_SIZES = (100, 1000, 10000)
+QUADRATIC_SIZES = (100, 500, 2000)
+ALIGNMENT_SIZES = (20, 100, 300)
+REPORT_VERSION = 1
+
+
+def _titles(records):
+    return [record['title'] for record in records]
+
+
+def _raw(records):
+    return [record['sequence'] for record in records]
+
+
+def stage_parse(records):
+    from ingest import parse_fasta_stream
+    data = to_fasta(records).encode('ascii')
+    return lambda: list(parse_fasta_stream(io.BytesIO(data)))
+
+
+def stage_composition(records):
+    from composition import annotate_sequences
+    manual = [{'title': record['title'], 'sequence': record['sequence']} for record in records]
+    return lambda: annotate_sequences(manual)
+
+
+def stage_base_percentages(records):
+    from composition import annotate_sequences, base_percentages
+    annotated = [dict(record) for record in records]
+    annotate_sequences(annotated)
+    return lambda: base_percentages(annotated)
+
+
+def stage_histogram(records):
+    from render import histogram_data
+    lengths = [len(record['sequence']) for record in records]
+    return lambda: histogram_data(lengths)
+
+
+def stage_render_histogram(records):
+    from render import histogram_data, render_histogram
+    data = histogram_data([len(record['sequence']) for record in records])
+    return lambda: render_histogram(data)
+
+
+def stage_hamming(records):
+    from distances import pairwise_distances
+    raw = _raw(records)
+    return lambda: pairwise_distances(raw, 'hamming')
+
+
+def stage_identity(records):
+    from distances import pairwise_distances
+    raw = _raw(records)
+    return lambda: pairwise_distances(raw, 'identity')
+
+
+def stage_sketch(records):
+    from settings import SKETCH_K, SKETCH_SIZE
+    from sketch import sketch_distances
+    raw = _raw(records)
+    return lambda: sketch_distances(raw, k=SKETCH_K, size=SKETCH_SIZE)
+
+
+def stage_windows(records):
+    from dataset_store import DatasetStore
+    from windows import window_stats
+    # All records joined into one chromosome-like sequence, stored like an upload
+    store = DatasetStore(os.path.join(os.getcwd(), 'datasets'))
+    dataset = store.get(store.put([{'title': 'joined', 'sequence': ''.join(_raw(records))}]))
+    return lambda: window_stats(dataset, 0, window=1000, step=500)
+
+
+def _tree_stage(method):
+    def stage(records):
+        from distances import pairwise_distances
+        from tree_builder import build_tree
+        condensed = pairwise_distances(_raw(records), 'hamming')
+        names = _titles(records)
+        return lambda: build_tree(names, condensed, method)
+    return stage
+
+
+def stage_simple_tree(records):
+    from phylogeny import build_simple_tree
+    return lambda: build_simple_tree(records)
+
+
+def stage_progressive(records):
+    from progressive import align
+    pairs = [(record['title'], record['sequence']) for record in records]
+    return lambda: align(pairs)
+
+
+class AnalyzeClient:
+    """POSTs the records to /analyze through Flask's test client, renaming them on every call
+    so the tree cache never answers for an earlier run"""
+
+    def __init__(self, records, method, wait_for_tree):
+        import app as app_module
+        self.app_module = app_module
+        self.client = app_module.app.test_client()
+        self.records = records
+        self.method = method
+        self.wait_for_tree = wait_for_tree
+        self.calls = 0
+
+    def __call__(self):
+        from jobs import DONE, FINISHED_STATES
+        self.calls += 1
+        renamed = [{'title': f"{record['title']}_{os.getpid()}_{time.time_ns()}_{self.calls}",
+                    'sequence': record['sequence']} for record in self.records]
+        data = {'fasta_file': (io.BytesIO(to_fasta(renamed).encode('ascii')), 'bench.fasta'),
+                'distance_method': self.method}
+        response = self.client.post('/analyze', data=data, content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f"/analyze answered {response.status_code}")
+        if not self.wait_for_tree:
+            return
+        job = re.search(r'data-job-id="([0-9a-f]+)"', response.get_data(as_text=True))
+        if job is None:
+            return
+        job_manager = self.app_module.job_manager
+        while True:
+            status = job_manager.status(job.group(1))
+            if status['status'] in FINISHED_STATES:
+                break
+            time.sleep(0.02)
+        if status['status'] != DONE:
+            raise RuntimeError(f"Tree job ended as {status['status']}: {status['error']}")
+
+
+def _analyze_stage(wait_for_tree):
+    def stage(records, method='alignment'):
+        return AnalyzeClient(records, method, wait_for_tree)
+    return stage
+
+
+# name -> (prepare(records) returning the timed callable, default sizes)
+STAGES = {
+    'parse': (stage_parse, LINEAR_SIZES),
+    'composition': (stage_composition, LINEAR_SIZES),
+    'base_percentages': (stage_base_percentages, LINEAR_SIZES),
+    'histogram': (stage_histogram, LINEAR_SIZES),
+    'render_histogram': (stage_render_histogram, LINEAR_SIZES),
+    'hamming': (stage_hamming, QUADRATIC_SIZES),
+    'identity': (stage_identity, QUADRATIC_SIZES),
+    'sketch': (stage_sketch, QUADRATIC_SIZES),
+    'windows': (stage_windows, LINEAR_SIZES),
+    'nj': (_tree_stage('nj'), QUADRATIC_SIZES),
+    'upgma': (_tree_stage('upgma'), QUADRATIC_SIZES),
+    'simple_tree': (stage_simple_tree, QUADRATIC_SIZES),
+    'progressive': (stage_progressive, ALIGNMENT_SIZES),
+    'analyze': (_analyze_stage(False), ALIGNMENT_SIZES),
+    'analyze_tree': (_analyze_stage(True), ALIGNMENT_SIZES),
+}
+
+
+def time_runs(fn, repeat, warmup):
+    """Wall times (s) of `repeat` calls after `warmup` untimed ones"""
+    for _ in range(warmup):
+        fn()
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def scaling_exponent(results):
+    """Slope of log(median seconds) over log(n), None with fewer than two sizes"""
+    points = [(r['n'], r['median']) for r in results if r['median'] > 0]
+    if len(points) < 2:
+        return None
+    n, seconds = np.log(np.array(points, dtype=np.float64)).T
+    return round(float(np.polyfit(n, seconds, 1)[0]), 2)
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def run(stages, sizes, args):
+    """Report dict for the given stages, each over `sizes` or its default grid"""
+    report = {'version': REPORT_VERSION, 'environment': environment(),
+              'dataset': {'length': args.length, 'length_sd': args.length_sd, 'gc': args.gc,
+                          'mutation_rate': args.mutation_rate, 'seed': args.seed},
+              'results': [], 'scaling': {}}
+    for name in stages:
+        prepare, default_sizes = STAGES[name]
+        stage_results = []
+        for n in sizes or default_sizes:
+            records = synthetic_sequences(n, args.length, args.length_sd, args.gc, args.mutation_rate, args.seed)
+            if name in ('analyze', 'analyze_tree'):
+                fn = prepare(records, method=args.method)
+            else:
+                fn = prepare(records)
+            runs = time_runs(fn, args.repeat, args.warmup)
+            result = {'stage': name, 'n': n, 'length': args.length,
+                      'bases': sum(len(record['sequence']) for record in records),
+                      'median': float(np.median(runs)), 'min': min(runs), 'runs': runs}
+            stage_results.append(result)
+            print(f"{name:<18} n={n:<7} median {result['median'] * 1000:10.2f} ms   min {result['min'] * 1000:10.2f} ms",
+                  flush=True)
+        report['results'].extend(stage_results)
+        report['scaling'][name] = scaling_exponent(stage_results)
+        if report['scaling'][name] is not None:
+            print(f"{name:<18} scaling ~ n^{report['scaling'][name]}", flush=True)
+    return report
+
+
+def compare(report, baseline, threshold, min_delta):
+    """Results slower than the baseline's by more than threshold (relative) and min_delta (s)"""
+    previous = {(r['stage'], r['n'], r['length']): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in report['results']:
+        base = previous.get((result['stage'], result['n'], result['length']))
+        if base is None:
+            continue
+        ratio = result['median'] / base['median'] if base['median'] else float('inf')
+        result['baseline_median'] = base['median']
+        result['ratio'] = round(ratio, 3)
+        if ratio > 1 + threshold and result['median'] - base['median'] > min_delta:
+            regressions.append(result)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Times each pipeline stage over synthetic datasets")
+    parser.add_argument('--stages', default=','.join(STAGES), help="comma-separated stages (default: all)")
+    parser.add_argument('--sizes', help="comma-separated sequence counts, instead of each stage's default grid")
+    parser.add_argument('--length', type=int, default=1000, help="mean sequence length")
+    parser.add_argument('--length-sd', type=float, default=0.1, help="length standard deviation, as a fraction of --length")
+    parser.add_argument('--gc', type=float, default=0.5)
+    parser.add_argument('--mutation-rate', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--method', default='alignment', help="distance method for the analyze stages")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage and size")
+    parser.add_argument('--warmup', type=int, default=1, help="untimed runs before those (pool start-up, imports)")
+    parser.add_argument('--out', help="JSON report path")
+    parser.add_argument('--baseline', help="earlier JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed slowdown over the baseline (0.25 = 25%%)")
+    parser.add_argument('--min-delta', type=float, default=0.01, help="slowdowns below this many seconds are noise")
+    parser.add_argument('--workdir', help="scratch directory for uploads/caches (default: a new temp dir)")
+    args = parser.parse_args(argv)
+
+    stages = [name.strip() for name in args.stages.split(',') if name.strip()]
+    unknown = [name for name in stages if name not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)} (choose from {', '.join(STAGES)})")
+    sizes = [int(size) for size in args.sizes.split(',')] if args.sizes else None
+    out = os.path.abspath(args.out) if args.out else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # Project modules create uploads/ and the caches relative to the working directory
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix='gf_bench_'))
+    os.environ.setdefault('GF_STAGE_LOG', '0')
+    try:
+        report = run(stages, sizes, args)
+    finally:
+        if 'app' in sys.modules:
+            sys.modules['app'].job_manager.shutdown()
+
+    status = 0
+    if baseline is not None:
+        regressions = compare(report, baseline, args.threshold, args.min_delta)
+        report['regressions'] = [{key: r[key] for key in ('stage', 'n', 'median', 'baseline_median', 'ratio')}
+                                 for r in regressions]
+        for r in regressions:
+            print(f"REGRESSION {r['stage']} n={r['n']}: {r['median'] * 1000:.2f} ms vs "
+                  f"{r['baseline_median'] * 1000:.2f} ms baseline (x{r['ratio']})")
+        if regressions:
+            status = 1
+        else:
+            print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    if out:
+        with open(out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {out}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
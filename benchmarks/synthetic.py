@@ -0,0 +1,97 @@
+"""Synthetic FASTA datasets for the benchmarks.
+
+A random ancestor with the requested GC content is drawn once, and every
+sequence is a window of it (length drawn around `length`) with substitutions
+and short indels at `mutation_rate`, so the sequences look like a family of
+related reads: alignable, with realistic duplicates of k-mers, and with a
+length spread the histogram and padding-based distances actually see.
+
+    python -m benchmarks.synthetic -n 500 --length 1500 --gc 0.6 -o reads.fa.gz
+"""
+import argparse
+import gzip
+import sys
+
+import numpy as np
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+# Share of mutations that are indels rather than substitutions
+INDEL_SHARE = 0.1
+LINE_WIDTH = 70
+
+
+def random_bases(rng, length, gc=0.5):
+    """uint8 array of ACGT with P(G or C) = gc"""
+    at, cg = (1 - gc) / 2, gc / 2
+    return rng.choice(BASES, size=length, p=(at, cg, cg, at))
+
+
+def mutate(rng, codes, rate, gc=0.5):
+    """Copy of codes with substitutions at `rate` and single-base indels at rate * INDEL_SHARE"""
+    codes = codes.copy()
+    hit = np.flatnonzero(rng.random(len(codes)) < rate * (1 - INDEL_SHARE))
+    # Shift by 1-3 places in ACGT so a substitution always changes the base
+    index = np.searchsorted(BASES, codes[hit])
+    codes[hit] = BASES[(index + rng.integers(1, 4, size=len(hit))) % 4]
+    n_indels = rng.binomial(len(codes), rate * INDEL_SHARE) if len(codes) else 0
+    if n_indels:
+        positions = np.sort(rng.integers(0, len(codes), size=n_indels))
+        insert = rng.random(n_indels) < 0.5
+        codes = np.insert(codes, positions[insert], random_bases(rng, int(insert.sum()), gc))
+        # Deletions are applied after the insertions, at positions shifted by them
+        deleted = positions[~insert] + np.searchsorted(positions[insert], positions[~insert], side='right')
+        codes = np.delete(codes, deleted[deleted < len(codes)])
+    return codes
+
+
+def synthetic_sequences(n, length=1000, length_sd=0.1, gc=0.5, mutation_rate=0.02, seed=0):
+    """n records [{'title', 'sequence'}]: windows of one ancestor, lengths ~ Normal(length, length_sd * length)"""
+    rng = np.random.default_rng(seed)
+    lengths = np.maximum(1, np.round(rng.normal(length, length_sd * length, size=n))).astype(np.int64)
+    ancestor = random_bases(rng, int(lengths.max()) + length // 10 + 1, gc)
+    records = []
+    for i, size in enumerate(lengths):
+        start = int(rng.integers(0, len(ancestor) - size + 1))
+        codes = mutate(rng, ancestor[start:start + size], mutation_rate, gc)
+        records.append({'title': f"syn{i + 1}", 'sequence': codes.tobytes().decode('ascii')})
+    return records
+
+
+def to_fasta(records, width=LINE_WIDTH):
+    """FASTA text of [{'title', 'sequence'}], sequences wrapped at `width`"""
+    parts = []
+    for record in records:
+        sequence = record['sequence']
+        parts.append(f">{record['title']}\n")
+        parts.extend(f"{sequence[i:i + width]}\n" for i in range(0, len(sequence), width))
+    return ''.join(parts)
+
+
+def write_fasta(path, records, compress=None):
+    """Writes the records to path, gzip-compressed when compress is True or path ends in .gz"""
+    if compress is None:
+        compress = path.endswith('.gz')
+    data = to_fasta(records).encode('ascii')
+    with (gzip.open(path, 'wb') if compress else open(path, 'wb')) as f:
+        f.write(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Writes a synthetic FASTA dataset")
+    parser.add_argument('-n', type=int, default=100, help="number of sequences")
+    parser.add_argument('--length', type=int, default=1000, help="mean sequence length")
+    parser.add_argument('--length-sd', type=float, default=0.1, help="length standard deviation, as a fraction of --length")
+    parser.add_argument('--gc', type=float, default=0.5, help="GC fraction of the ancestor")
+    parser.add_argument('--mutation-rate', type=float, default=0.02, help="mutations per base (10%% of them indels)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help="output file (.gz is compressed), stdout if omitted")
+    args = parser.parse_args(argv)
+    records = synthetic_sequences(args.n, args.length, args.length_sd, args.gc, args.mutation_rate, args.seed)
+    if args.output:
+        write_fasta(args.output, records)
+    else:
+        sys.stdout.write(to_fasta(records))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Vectorized base composition and GC kernel for batches of sequences"""
+import numpy as np
+
+# Column order of the count matrix: the four bases, N, the IUPAC ambiguity codes,
+# gaps and anything else (digits, '*', non-ASCII...)
+CLASSES = ['A', 'C', 'G', 'T', 'U', 'N', 'R', 'Y', 'S', 'W', 'K', 'M', 'B', 'D', 'H', 'V', '-', 'other']
+CLASS_INDEX = {name: i for i, name in enumerate(CLASSES)}
+N_CLASSES = len(CLASSES)
+
+# Bases reported in the per-sequence 'bases' dict, everything else is folded into N
+REPORTED_BASES = ['A', 'T', 'C', 'G']
+
+# Max bases per bincount call, keeps the per-base id array around 32 MB
+BATCH_BASES = 1 << 22
+
+
+def _build_lut():
+    """256-entry byte -> class lookup table (case-insensitive)"""
+    lut = np.full(256, CLASS_INDEX['other'], dtype=np.uint8)
+    for name, i in CLASS_INDEX.items():
+        if len(name) == 1:
+            lut[ord(name)] = i
+            lut[ord(name.lower())] = i
+    lut[ord('.')] = CLASS_INDEX['-']
+    return lut
+
+
+_LUT = _build_lut()
+_AT = [CLASS_INDEX[b] for b in 'ATUW']
+_GC = [CLASS_INDEX[b] for b in 'GCS']  # S is G or C, same as gc_fraction
+
+
+def as_bytes(sequence):
+    """ASCII bytes for a sequence, one byte per character so lengths match len(str)"""
+    if isinstance(sequence, str):
+        return sequence.encode('ascii', 'replace')
+    return bytes(sequence)
+
+
+def as_uint8(sequence):
+    """Zero-copy uint8 view of a sequence"""
+    return np.frombuffer(as_bytes(sequence), dtype=np.uint8)
+
+
+def count_classes(sequences):
+    """Returns an (n, N_CLASSES) matrix of per-sequence class counts"""
+    raw = [as_bytes(s) for s in sequences]
+    counts = np.zeros((len(raw), N_CLASSES), dtype=np.int64)
+
+    start = 0
+    while start < len(raw):
+        # Long sequences (chromosomes) are counted alone, no per-base id array needed
+        if len(raw[start]) >= BATCH_BASES:
+            view = np.frombuffer(raw[start], dtype=np.uint8)
+            for offset in range(0, len(view), BATCH_BASES):
+                counts[start] += np.bincount(_LUT[view[offset:offset + BATCH_BASES]], minlength=N_CLASSES)
+            start += 1
+            continue
+
+        # Pack short sequences together until the batch is full
+        end, size = start, 0
+        while end < len(raw) and len(raw[end]) < BATCH_BASES and size + len(raw[end]) <= BATCH_BASES:
+            size += len(raw[end])
+            end += 1
+        batch = raw[start:end]
+        classes = _LUT[np.frombuffer(b''.join(batch), dtype=np.uint8)]
+        lengths = np.fromiter((len(s) for s in batch), dtype=np.intp, count=len(batch))
+        ids = np.repeat(np.arange(len(batch), dtype=np.intp), lengths)
+        flat = np.bincount(ids * N_CLASSES + classes, minlength=len(batch) * N_CLASSES)
+        counts[start:end] = flat.reshape(len(batch), N_CLASSES)
+        start = end
+
+    return counts
+
+
+class BatchComposition:
+    """Composition of a batch of sequences, computed in one vectorized pass"""
+
+    def __init__(self, sequences):
+        self.counts = count_classes(sequences)
+        self.lengths = self.counts.sum(axis=1)
+        safe = np.maximum(self.lengths, 1)
+        # Fractions over the full length, matching gc_fraction(..., ambiguous="ignore")
+        self.gc = self.counts[:, _GC].sum(axis=1) / safe
+        self.at = self.counts[:, _AT].sum(axis=1) / safe
+
+    def base_table(self):
+        """(n, 5) matrix of A, T, C, G and N counts (N = everything that isn't ACGT)"""
+        table = np.empty((len(self.counts), len(REPORTED_BASES) + 1), dtype=np.int64)
+        table[:, :-1] = self.counts[:, [CLASS_INDEX[b] for b in REPORTED_BASES]]
+        table[:, -1] = self.lengths - table[:, :-1].sum(axis=1)
+        return table
+
+    def totals(self):
+        """Per-class totals over the whole batch"""
+        return dict(zip(CLASSES, self.counts.sum(axis=0).tolist()))
+
+    def per_sequence(self):
+        """Stats dicts in the shape the templates expect (length, gc %, bases)"""
+        names = REPORTED_BASES + ['N']
+        rows = self.base_table().tolist()
+        return [
+            {'length': length, 'gc': 100 * gc, 'bases': dict(zip(names, row))}
+            for length, gc, row in zip(self.lengths.tolist(), self.gc.tolist(), rows)
+        ]
+
+
+def annotate_sequences(sequences):
+    """Fills length/gc/bases on a list of {'title', 'sequence'} dicts, returns the batch"""
+    batch = BatchComposition([s['sequence'] for s in sequences])
+    for seq_data, stats in zip(sequences, batch.per_sequence()):
+        seq_data.update(stats)
+    return batch
+
+
+def base_counts(sequences):
+    """Total A/T/C/G/N counts over all sequences, from their per-sequence 'bases' dicts"""
+    names = REPORTED_BASES + ['N']
+    table = np.array([[s['bases'][b] for b in names] for s in sequences], dtype=np.int64).reshape(-1, len(names))
+    return dict(zip(names, table.sum(axis=0).tolist()))
+
+
+def percentages(counts):
+    """{base: count} as percentages of their total"""
+    total_bases = sum(counts.values())
+    if not total_bases:
+        return {base: 0.0 for base in counts}
+    return {base: 100 * count / total_bases for base, count in counts.items()}
+
+
+def base_percentages(sequences):
+    """Percentage of A/T/C/G/N over all sequences, from their per-sequence 'bases' dicts"""
+    return percentages(base_counts(sequences))
@@ -0,0 +1,328 @@
+"""Server-side store of analyzed uploads, referenced by an opaque dataset id.
+
+The results page and its follow-up requests (export, sequence views, ...)
+pass the dataset id instead of shipping the sequences back and forth. Each
+dataset is a directory of .npy files that are memory-mapped on load:
+
+  packed.npy      2-bit codes (A=0, C=1, G=2, T=3), four bases per byte
+  offsets.npy     start of each sequence in the concatenation (n + 1 entries)
+  exc_*.npy       runs of anything that isn't ACGT (N, IUPAC codes, gaps...):
+                  start, length and the byte repeated over the run
+  lower_*.npy     [start, end) intervals of soft-masked (lower case) acgt
+  meta.json       titles, per-sequence and global stats
+
+Decoding a range reads only the packed bytes and the runs that overlap it.
+Adding sequences stores a new dataset that copies the existing arrays and
+only encodes the new bases.
+Datasets expire after a TTL since their last access, and the least recently
+used ones are deleted when the store goes over its size budget.
+"""
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from composition import as_bytes
+
+_ARRAYS = ('packed', 'offsets', 'exc_starts', 'exc_lengths', 'exc_bytes', 'lower_starts', 'lower_ends')
+# Open (memory-mapped) datasets kept around between requests
+OPEN_DATASETS = 32
+# Last-access times are written to disk at most this often (s)
+TOUCH_INTERVAL = 60
+
+
+def _build_code_lut():
+    """Byte -> 2-bit code for ACGT/acgt, 255 for everything else"""
+    lut = np.full(256, 255, dtype=np.uint8)
+    for code, base in enumerate('ACGT'):
+        lut[ord(base)] = code
+        lut[ord(base.lower())] = code
+    return lut
+
+
+_CODES = _build_code_lut()
+# Packed byte -> its four bases, low bits first
+_UNPACK = np.array([[ord('ACGT'[(byte >> shift) & 3]) for shift in (0, 2, 4, 6)] for byte in range(256)],
+                   dtype=np.uint8)
+
+
+def _runs(mask):
+    """[start, end) intervals where a boolean array is True"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], mask, [False])).astype(np.int8)))
+    return edges[0::2], edges[1::2]
+
+
+def _positions(starts, ends):
+    """Every index covered by the [start, end) intervals, concatenated"""
+    lengths = ends - starts
+    return np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+
+def encode(raw):
+    """Arrays for one concatenated byte string: packed codes, exception runs, lower-case intervals"""
+    data = np.frombuffer(raw, dtype=np.uint8)
+    codes = _CODES[data]
+    exceptional = codes == 255
+
+    # Runs of the same exceptional byte, so NNNN... blocks become a single entry
+    same_as_previous = np.concatenate(([False], exceptional[:-1] & (data[1:] == data[:-1])))
+    same_as_next = np.concatenate((same_as_previous[1:], [False]))
+    exc_starts = np.flatnonzero(exceptional & ~same_as_previous)
+    exc_ends = np.flatnonzero(exceptional & ~same_as_next) + 1
+
+    lower_starts, lower_ends = _runs(~exceptional & (data >= ord('a')))
+
+    codes = np.where(exceptional, 0, codes)
+    codes = np.concatenate((codes, np.zeros(-len(codes) % 4, dtype=np.uint8))).reshape(-1, 4)
+    packed = codes[:, 0] | (codes[:, 1] << 2) | (codes[:, 2] << 4) | (codes[:, 3] << 6)
+    return {
+        'packed': packed.astype(np.uint8),
+        'exc_starts': exc_starts.astype(np.int64),
+        'exc_lengths': (exc_ends - exc_starts).astype(np.int64),
+        'exc_bytes': data[exc_starts],
+        'lower_starts': lower_starts.astype(np.int64),
+        'lower_ends': lower_ends.astype(np.int64),
+    }
+
+
+def _meta(sequences, global_stats=None):
+    return {
+        'titles': [s['title'] for s in sequences],
+        'stats': [{key: s[key] for key in ('length', 'gc', 'bases') if key in s} for s in sequences],
+        'global': global_stats,
+        'created': time.time(),
+    }
+
+
+def _append_runs(starts, ends, values, more_starts, more_ends, more_values, cut):
+    """Runs of an encoding cut at `cut` followed by the runs of one that starts there, joined
+    where a run continues across the cut (with the same byte, when runs have values)"""
+    keep = np.asarray(starts) < cut
+    starts, ends = np.asarray(starts)[keep], np.minimum(np.asarray(ends)[keep], cut)
+    more_starts, more_ends = more_starts + cut, more_ends + cut
+    if values is not None:
+        values = np.asarray(values)[keep]
+    if (len(starts) and len(more_starts) and ends[-1] == more_starts[0]
+            and (values is None or values[-1] == more_values[0])):
+        more_starts = more_starts.copy()
+        more_starts[0] = starts[-1]
+        starts, ends = starts[:-1], ends[:-1]
+        if values is not None:
+            values = values[:-1]
+    if values is not None:
+        values = np.concatenate((values, more_values)).astype(np.uint8)
+    return (np.concatenate((starts, more_starts)).astype(np.int64),
+            np.concatenate((ends, more_ends)).astype(np.int64), values)
+
+
+class Dataset:
+    """Read-only view of a stored dataset (arrays are memory-mapped)"""
+
+    def __init__(self, dataset_id, directory):
+        self.id = dataset_id
+        self.directory = directory
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r'))
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        self.titles = meta['titles']
+        self.stats = meta['stats']
+        # Totals from pipeline.global_statistics, None for datasets stored without them
+        self.global_stats = meta.get('global')
+        self.created = meta['created']
+
+    def __len__(self):
+        return len(self.titles)
+
+    @property
+    def total_bases(self):
+        return int(self.offsets[-1])
+
+    def length(self, index):
+        return int(self.offsets[index + 1] - self.offsets[index])
+
+    def _decode(self, start, end):
+        """Bytes [start, end) of the concatenated sequences"""
+        if end <= start:
+            return b''
+        out = _UNPACK[self.packed[start // 4:(end + 3) // 4]].reshape(-1)[start % 4:start % 4 + end - start]
+
+        # Lower-case intervals and exception runs overlapping the range, clipped to it
+        first = np.searchsorted(self.lower_ends, start, side='right')
+        last = np.searchsorted(self.lower_starts, end, side='left')
+        lower_starts = np.maximum(self.lower_starts[first:last], start) - start
+        lower_ends = np.minimum(self.lower_ends[first:last], end) - start
+        out[_positions(lower_starts, lower_ends)] |= 0x20
+
+        first = max(np.searchsorted(self.exc_starts, start, side='right') - 1, 0)
+        last = np.searchsorted(self.exc_starts, end, side='left')
+        exc_starts = self.exc_starts[first:last]
+        exc_ends = exc_starts + self.exc_lengths[first:last]
+        keep = exc_ends > start
+        exc_starts = np.maximum(exc_starts[keep], start) - start
+        exc_ends = np.minimum(exc_ends[keep], end) - start
+        out[_positions(exc_starts, exc_ends)] = np.repeat(self.exc_bytes[first:last][keep], exc_ends - exc_starts)
+        return out.tobytes()
+
+    def sequence(self, index, start=0, end=None):
+        """Sequence `index` (or its [start, end) slice) as a str"""
+        offset = int(self.offsets[index])
+        length = self.length(index)
+        start, end, _ = slice(start, end).indices(length)
+        return self._decode(offset + start, offset + max(start, end)).decode('ascii')
+
+    def records(self):
+        """Yields {'title', 'sequence'} dicts in upload order"""
+        for index, title in enumerate(self.titles):
+            yield {'title': title, 'sequence': self.sequence(index)}
+
+    def summary(self):
+        return {'id': self.id, 'sequences': len(self), 'total_bases': self.total_bases,
+                'created': self.created}
+
+
+class DatasetStore:
+    """Datasets on disk under `directory`, expired by TTL since last access and LRU by size"""
+
+    def __init__(self, directory, ttl=86400, max_bytes=2 << 30):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._open = OrderedDict()
+        self._touched = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, dataset_id):
+        return os.path.join(self.directory, dataset_id)
+
+    def put(self, sequences, global_stats=None):
+        """Stores a list of {'title', 'sequence', ...stats} dicts, returns the new dataset id"""
+        raws = [as_bytes(s['sequence']) for s in sequences]
+        arrays = encode(b''.join(raws))
+        arrays['offsets'] = np.concatenate(([0], np.cumsum([len(raw) for raw in raws]))).astype(np.int64)
+        return self._save(arrays, _meta(sequences, global_stats))
+
+    def extend(self, dataset, sequences, global_stats=None):
+        """Stores a dataset plus more sequences as a new dataset, returns its id.
+        Only the new sequences are encoded, the existing arrays are copied."""
+        raws = [as_bytes(s['sequence']) for s in sequences]
+        total = dataset.total_bases
+        # The last, partly filled byte of packed codes is encoded again together with the new bases
+        cut = total - total % 4
+        added = encode(dataset._decode(cut, total) + b''.join(raws))
+        arrays = {'packed': np.concatenate((dataset.packed[:cut // 4], added['packed']))}
+        arrays['offsets'] = np.concatenate(
+            (dataset.offsets, total + np.cumsum([len(raw) for raw in raws], dtype=np.int64))).astype(np.int64)
+        starts, ends, values = _append_runs(
+            dataset.exc_starts, dataset.exc_starts + dataset.exc_lengths, dataset.exc_bytes,
+            added['exc_starts'], added['exc_starts'] + added['exc_lengths'], added['exc_bytes'], cut)
+        arrays.update(exc_starts=starts, exc_lengths=ends - starts, exc_bytes=values)
+        arrays['lower_starts'], arrays['lower_ends'], _ = _append_runs(
+            dataset.lower_starts, dataset.lower_ends, None, added['lower_starts'], added['lower_ends'], None, cut)
+        meta = _meta(sequences, global_stats)
+        meta['titles'] = dataset.titles + meta['titles']
+        meta['stats'] = dataset.stats + meta['stats']
+        meta['parent'] = dataset.id
+        return self._save(arrays, meta)
+
+    def _save(self, arrays, meta):
+        dataset_id = secrets.token_hex(16)
+        # Built in a temp dir and renamed into place, so readers never see half a dataset
+        tmp_dir = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        try:
+            for name in _ARRAYS:
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), arrays[name])
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_dir, self._path(dataset_id))
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self.expire()
+        return dataset_id
+
+    def get(self, dataset_id):
+        """The Dataset for an id, or None if it is unknown or expired"""
+        if not isinstance(dataset_id, str) or not dataset_id or not all(c in '0123456789abcdef' for c in dataset_id):
+            return None
+        path = self._path(dataset_id)
+        with self._lock:
+            dataset = self._open.get(dataset_id)
+            if dataset is not None:
+                self._open.move_to_end(dataset_id)
+        if dataset is None:
+            try:
+                dataset = Dataset(dataset_id, path)
+            except (OSError, ValueError, KeyError):
+                return None
+            with self._lock:
+                self._open[dataset_id] = dataset
+                while len(self._open) > OPEN_DATASETS:
+                    self._open.popitem(last=False)
+        self._touch(dataset_id, path)
+        return dataset
+
+    def _touch(self, dataset_id, path):
+        """Directory mtime is the last-access clock for TTL and LRU eviction"""
+        now = time.time()
+        with self._lock:
+            if now - self._touched.get(dataset_id, 0) < TOUCH_INTERVAL:
+                return
+            self._touched[dataset_id] = now
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def delete(self, dataset_id):
+        with self._lock:
+            self._open.pop(dataset_id, None)
+            self._touched.pop(dataset_id, None)
+        shutil.rmtree(self._path(dataset_id), ignore_errors=True)
+
+    def _datasets(self):
+        """(id, size in bytes, last access) of every stored dataset"""
+        datasets = []
+        try:
+            with os.scandir(self.directory) as it:
+                for item in it:
+                    if item.name.startswith('.') or not item.is_dir():
+                        continue
+                    try:
+                        size = sum(entry.stat().st_size for entry in os.scandir(item.path))
+                        datasets.append((item.name, size, item.stat().st_mtime))
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return datasets
+
+    def expire(self):
+        """Deletes datasets past their TTL, then the least recently used until under max_bytes"""
+        now = time.time()
+        datasets = []
+        for dataset_id, size, accessed in self._datasets():
+            if now - accessed > self.ttl:
+                self.delete(dataset_id)
+            else:
+                datasets.append((dataset_id, size, accessed))
+        total = sum(size for _, size, _ in datasets)
+        for dataset_id, size, _ in sorted(datasets, key=lambda d: d[2]):
+            if total <= self.max_bytes:
+                break
+            self.delete(dataset_id)
+            total -= size
+
+    def stats(self):
+        datasets = self._datasets()
+        with self._lock:
+            open_count = len(self._open)
+        return {'datasets': len(datasets), 'bytes': sum(size for _, size, _ in datasets),
+                'open': open_count}
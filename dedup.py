@@ -0,0 +1,208 @@
+"""Pre-alignment reduction: exact duplicates and near-identical clusters.
+
+Uploads often hold many identical or ~99% identical reads. Exact duplicates
+are collapsed by hashing the normalised sequence (keeping their counts), and
+optionally the unique sequences are greedy-clustered at an identity threshold
+(CD-HIT/UCLUST style: most abundant first, each one joins the first center it
+matches or becomes a center). Candidate centers come from a k-mer prefilter
+on the sketches in sketch.py and are confirmed with a real identity (identical
+columns of the best global alignment / shorter length).
+
+The prefilter never drops a pair that could reach the threshold: identity t
+over the shorter length s leaves at most D = s + l - 2ts unmatched bases and
+gaps, each of which breaks at most k of either sequence's k-mers, which bounds
+the k-mer Jaccard from below. A center is skipped only when the sketches share
+PREFILTER_SIGMAS standard deviations fewer bins than that bound predicts. At
+low thresholds the bound is vacuous and every center passes to the
+verification step, which tries at most MAX_VERIFY of them.
+
+Alignment, distances and the tree are then computed on the representatives
+only and mapped back to every original title with Reduction.expand().
+"""
+import hashlib
+
+import numpy as np
+from Bio.Align import PairwiseAligner
+
+from composition import as_uint8
+from distances import condensed_to_square
+from sketch import distinct_kmers, sketch_matches, sketch_sequences
+
+# Sampling noise allowed below the lowest sketch overlap a pair at the threshold can have
+PREFILTER_SIGMAS = 4.0
+# Candidate centers checked per sequence, closest (by k-mer estimate) first
+MAX_VERIFY = 5
+# k-mer length for the prefilter sketches; shorter than Mash's 21 so short reads still share k-mers
+PREFILTER_K = 15
+PREFILTER_SIZE = 256
+# Same-length pairs at least this identical ungapped skip the alignment
+IDENTITY_FAST = 0.995
+
+_aligner = None
+
+
+def normalize(sequence):
+    """Sequence without whitespace, upper case (what makes two uploads 'the same sequence')"""
+    return ''.join(sequence.split()).upper()
+
+
+def _get_aligner():
+    global _aligner
+    if _aligner is None:
+        # Match 1, everything else 0: the global score is the most identical columns any
+        # alignment can have (the longest common subsequence), no traceback needed
+        _aligner = PairwiseAligner(mode='global', match_score=1, mismatch_score=0, gap_score=0)
+    return _aligner
+
+
+def identity(a, b):
+    """Identical columns of the best alignment over the length of the shorter sequence
+    (CD-HIT's denominator)"""
+    shorter = min(len(a), len(b))
+    if not shorter:
+        return 0.0
+    if len(a) == len(b):
+        same = np.count_nonzero(as_uint8(a) == as_uint8(b))
+        # Only a few substitutions: the ungapped identity (a lower bound) is within a few
+        # columns of the best one, skip the O(L^2) alignment
+        if same >= IDENTITY_FAST * shorter:
+            return same / shorter
+    return _get_aligner().score(a, b) / shorter
+
+
+class Reduction:
+    """Maps the original sequences onto a smaller set of representatives.
+
+    assignment[i] is the representative of original sequence i (-1 for empty ones),
+    offsets[i] its distance (1 - identity) to that representative, 0 for exact copies.
+    """
+
+    def __init__(self, sequences, representatives, assignment, offsets, counts):
+        self.sequences = sequences
+        self.representatives = representatives
+        self.assignment = assignment
+        self.offsets = offsets
+        self.counts = counts
+
+    @property
+    def reduced(self):
+        """True when there is anything to gain from working on the representatives"""
+        return len(self.representatives) < len(self.sequences)
+
+    def stats(self):
+        return {
+            'sequences': len(self.sequences),
+            'representatives': len(self.representatives),
+            'duplicates': len(self.sequences) - len(self.representatives),
+            'largest_group': int(self.counts.max()) if len(self.counts) else 0,
+        }
+
+    def expand(self, condensed):
+        """Condensed distances between every original sequence from the representatives' ones.
+
+        Sequences sharing a representative get the sum of their offsets (0 for exact copies),
+        the others their representatives' distance; empty sequences are 1 from everything.
+        """
+        n = len(self.sequences)
+        square = condensed_to_square(condensed)
+        rows, cols = np.triu_indices(n, k=1)
+        rep_rows, rep_cols = self.assignment[rows], self.assignment[cols]
+        expanded = square[np.maximum(rep_rows, 0), np.maximum(rep_cols, 0)]
+        same = rep_rows == rep_cols
+        expanded[same] = self.offsets[rows[same]] + self.offsets[cols[same]]
+        expanded[(rep_rows < 0) | (rep_cols < 0)] = 1.0
+        return expanded
+
+
+def reduce_sequences(sequences, threshold=None):
+    """Collapses exact duplicates and, with a threshold in (0, 1), clusters near-identical
+    sequences. Representatives are {'title', 'sequence'} dicts whose title carries the
+    group size (e.g. 'seq1_x12') so it shows up on the tree."""
+    n = len(sequences)
+    assignment = np.full(n, -1, dtype=np.intp)
+    offsets = np.zeros(n, dtype=np.float64)
+
+    # Exact duplicates: one hash per normalised sequence, first occurrence is the representative
+    groups = {}
+    unique = []
+    for i, seq_data in enumerate(sequences):
+        sequence = normalize(seq_data['sequence'])
+        if not sequence:
+            continue
+        digest = hashlib.blake2b(sequence.encode('ascii', 'replace'), digest_size=16).digest()
+        group = groups.get(digest)
+        if group is None:
+            group = groups[digest] = len(unique)
+            unique.append({'index': i, 'sequence': sequence, 'members': []})
+        unique[group]['members'].append(i)
+
+    centers = list(range(len(unique)))
+    center_of = np.arange(len(unique))
+    unique_offsets = np.zeros(len(unique))
+    if threshold and 0 < threshold < 1 and len(unique) > 1:
+        centers, center_of, unique_offsets = _greedy_cluster(unique, threshold)
+
+    # Representatives in the order of their first sequence, so output follows the upload
+    centers = sorted(centers, key=lambda c: unique[c]['index'])
+    rep_of_center = {c: r for r, c in enumerate(centers)}
+    counts = np.zeros(len(centers), dtype=np.int64)
+    for u, group in enumerate(unique):
+        rep = rep_of_center[center_of[u]]
+        for i in group['members']:
+            assignment[i] = rep
+            offsets[i] = unique_offsets[u]
+        counts[rep] += len(group['members'])
+
+    representatives = []
+    for rep, c in enumerate(centers):
+        title = sequences[unique[c]['index']]['title']
+        if counts[rep] > 1:
+            title = f"{title}_x{counts[rep]}"
+        representatives.append({'title': title, 'sequence': unique[c]['sequence']})
+    return Reduction(sequences, representatives, assignment, offsets, counts)
+
+
+def _greedy_cluster(unique, threshold):
+    """Greedy clustering of unique sequences, most abundant (then longest) first.
+    Returns (center ids, center of each unique sequence, its 1 - identity to the center)"""
+    order = sorted(range(len(unique)),
+                   key=lambda u: (-len(unique[u]['members']), -len(unique[u]['sequence']), u))
+    sequences = [unique[u]['sequence'] for u in range(len(unique))]
+    minima = sketch_sequences(sequences, k=PREFILTER_K, size=PREFILTER_SIZE)
+    kmers = distinct_kmers(sequences, k=PREFILTER_K)
+    lengths = np.array([len(s) for s in sequences], dtype=np.float64)
+    center_of = np.arange(len(unique))
+    offsets = np.zeros(len(unique))
+    centers = []
+    # Center sketches in a preallocated buffer so the prefilter is one vectorized call
+    center_sketches = np.empty_like(minima)
+    center_ids = np.empty(len(unique), dtype=np.intp)
+
+    for u in order:
+        joined = False
+        if centers:
+            ids = center_ids[:len(centers)]
+            matches, compared = sketch_matches(minima[u], center_sketches[:len(centers)])
+            # k-mers of either sequence broken by the unmatched bases a pair at the threshold can have
+            broken = PREFILTER_K * (lengths[u] + lengths[ids]
+                                    - 2 * threshold * np.minimum(lengths[u], lengths[ids]))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                floor = np.maximum((kmers[u] - broken) / (kmers[ids] + broken),
+                                   (kmers[ids] - broken) / (kmers[u] + broken))
+            floor = np.clip(np.nan_to_num(floor), 0.0, 1.0)
+            expected = compared * floor
+            noise = PREFILTER_SIGMAS * np.sqrt(expected * (1.0 - floor)) + 1.0
+            close = np.flatnonzero(matches + noise >= expected)
+            estimate = matches / np.maximum(compared, 1)
+            for c in close[np.argsort(-estimate[close], kind='stable')][:MAX_VERIFY]:
+                ident = identity(unique[u]['sequence'], unique[centers[c]]['sequence'])
+                if ident >= threshold:
+                    center_of[u] = centers[c]
+                    offsets[u] = 1.0 - ident
+                    joined = True
+                    break
+        if not joined:
+            center_sketches[len(centers)] = minima[u]
+            center_ids[len(centers)] = u
+            centers.append(u)
+    return centers, center_of, offsets
@@ -0,0 +1,424 @@
+"""Condensed distance matrix helpers shared by the tree, cache and query code"""
+import numpy as np
+from Bio.Phylo.TreeConstruction import DistanceMatrix
+
+
+def condensed_size(n):
+    """Number of entries in the condensed (upper triangle) matrix of n sequences"""
+    return n * (n - 1) // 2
+
+
+def n_from_condensed(condensed):
+    """Recovers n from the length of a condensed matrix"""
+    n = int(round((1 + np.sqrt(1 + 8 * len(condensed))) / 2))
+    if condensed_size(n) != len(condensed):
+        raise ValueError(f"{len(condensed)} is not a valid condensed matrix length")
+    return n
+
+
+def condensed_index(n, i, j):
+    """Position of pair (i, j), i != j, in the condensed matrix (same layout as scipy)"""
+    if i > j:
+        i, j = j, i
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+
+def square_to_condensed(matrix):
+    """Upper triangle of a square matrix as a flat float64 array"""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    rows, cols = np.triu_indices(len(matrix), k=1)
+    return matrix[rows, cols]
+
+
+def condensed_to_square(condensed):
+    """Symmetric square matrix (zero diagonal) from a condensed one"""
+    condensed = np.asarray(condensed, dtype=np.float64)
+    n = n_from_condensed(condensed)
+    matrix = np.zeros((n, n), dtype=np.float64)
+    rows, cols = np.triu_indices(n, k=1)
+    matrix[rows, cols] = condensed
+    matrix[cols, rows] = condensed
+    return matrix
+
+
+def condensed_from_biopython(dm):
+    """Condensed array from a Bio.Phylo DistanceMatrix (stored lower triangular)"""
+    n = len(dm.names)
+    matrix = np.zeros((n, n), dtype=np.float64)
+    for i, row in enumerate(dm.matrix):
+        matrix[i, :len(row)] = row
+    return square_to_condensed(matrix.T)
+
+
+def biopython_from_condensed(names, condensed):
+    """Bio.Phylo DistanceMatrix from names and a condensed array"""
+    square = condensed_to_square(condensed)
+    lower = [square[i, :i + 1].tolist() for i in range(len(names))]
+    return DistanceMatrix(list(names), lower)
+
+
+def condensed_row(condensed, n, i):
+    """Distances from sequence i to every sequence (0 for itself), O(n) on the condensed array"""
+    row = np.zeros(n, dtype=np.float64)
+    before = np.arange(i)
+    # Pairs (j, i) with j < i live in earlier rows, pairs (i, j) with j > i are contiguous
+    row[:i] = condensed[n * before - before * (before + 1) // 2 + (i - before - 1)]
+    start = n * i - i * (i + 1) // 2
+    row[i + 1:] = condensed[start:start + n - i - 1]
+    return row
+
+
+class DistanceIndex:
+    """Name/index lookups on a condensed distance matrix.
+
+    Every query is O(1) (a pair) or O(n) (one row), nothing is expanded to n x n.
+    Duplicate names resolve to their first occurrence, indices can be used instead.
+    """
+
+    def __init__(self, names, condensed):
+        self.names = list(names)
+        self.condensed = np.asarray(condensed, dtype=np.float64)
+        self.n = len(self.names)
+        if len(self.condensed) != condensed_size(self.n):
+            raise ValueError(f"{len(self.condensed)} distances do not match {self.n} names")
+        self.index = {}
+        for i, name in enumerate(self.names):
+            self.index.setdefault(name, i)
+
+    def resolve(self, item):
+        """Index of a name or an int index, None when unknown"""
+        if isinstance(item, bool):
+            return None
+        if isinstance(item, int):
+            return item if 0 <= item < self.n else None
+        return self.index.get(item)
+
+    def distance(self, i, j):
+        if i == j:
+            return 0.0
+        return float(self.condensed[condensed_index(self.n, i, j)])
+
+    def pairs(self, items):
+        """Distances for [(a, b), ...] of names or indices, None where either is unknown"""
+        return [None if i is None or j is None else self.distance(i, j)
+                for i, j in ((self.resolve(a), self.resolve(b)) for a, b in items)]
+
+    def row(self, i):
+        return condensed_row(self.condensed, self.n, i)
+
+    def tile(self, row, col, size):
+        """Block of distances rows [row, row + size) x columns [col, col + size), read off the
+        condensed array (0 on the diagonal)"""
+        rows = np.arange(row, min(row + size, self.n))
+        cols = np.arange(col, min(col + size, self.n))
+        i = np.minimum(rows[:, np.newaxis], cols[np.newaxis, :])
+        j = np.maximum(rows[:, np.newaxis], cols[np.newaxis, :])
+        block = np.zeros((len(rows), len(cols)), dtype=np.float64)
+        off = i != j
+        block[off] = self.condensed[self.n * i[off] - i[off] * (i[off] + 1) // 2 + (j[off] - i[off] - 1)]
+        return rows, cols, block
+
+    def nearest(self, i, k=10, farthest=False):
+        """[(index, distance)] of the k closest (or farthest) other sequences, sorted"""
+        row = self.row(i)
+        others = np.delete(np.arange(self.n), i)
+        values = row[others] if not farthest else -row[others]
+        k = min(k, len(others))
+        if k <= 0:
+            return []
+        # argpartition is O(n), only the k selected are sorted
+        top = np.argpartition(values, k - 1)[:k]
+        top = top[np.argsort(values[top], kind='stable')]
+        return [(int(others[t]), float(row[others[t]])) for t in top]
+
+    def within(self, i, maximum, minimum=None):
+        """[(index, distance)] of other sequences with minimum <= distance <= maximum, closest first"""
+        row = self.row(i)
+        mask = row <= maximum
+        if minimum is not None:
+            mask &= row >= minimum
+        mask[i] = False
+        hits = np.flatnonzero(mask)
+        hits = hits[np.argsort(row[hits], kind='stable')]
+        return [(int(j), float(row[j])) for j in hits]
+
+
+# ---------------------------------------------------------------------------
+# Vectorized pairwise distance engine
+#
+# Sequences are packed into a zero-padded uint8 matrix and viewed as uint64
+# words, so one XOR compares 8 positions. Differing bytes per word are counted
+# SWAR-style (fold each byte onto its low bit, then sum the bytes with a
+# multiply), and pairs are processed in blocks so the broadcast temporaries
+# stay bounded. Row blocks can optionally be spread over a process pool.
+# ---------------------------------------------------------------------------
+
+METRICS = ('hamming', 'identity', 'p', 'jc69')
+# Metrics computed from arrays encoded elsewhere (sketch.py) with distances_from_encoded()
+ENCODED_METRICS = ('mash',)
+
+# Max elements in a (rows, cols, words) broadcast block; 512 KB temporaries stay in cache,
+# which is 2-4x faster than bigger blocks
+BLOCK_ELEMENTS = 1 << 16
+
+# Sentinels that never match anything: left rows use one, right rows the other
+_LEFT_SENTINEL = 1
+_RIGHT_SENTINEL = 2
+
+# p-distances at or above 0.75 have no Jukes-Cantor correction, they are clipped here
+JC_MAX_P = 0.7499
+
+_LOW_BITS = np.uint64(0x0101010101010101)
+_LOW_HALF = np.uint64(0xFFFFFFFF)
+# Sketch match counts this many standard deviations or less above chance count as no match
+MASH_CHANCE_SIGMAS = 4.0
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _to_bytes(sequence):
+    return sequence.encode('ascii', 'replace') if isinstance(sequence, str) else bytes(sequence)
+
+
+def encode_padded(sequences, fill=0, upper=False):
+    """(n, L) uint8 matrix padded with fill up to a multiple of 8 columns, plus the lengths"""
+    raw = [_to_bytes(s) for s in sequences]
+    if upper:
+        raw = [s.upper() for s in raw]
+    lengths = np.fromiter((len(s) for s in raw), dtype=np.int64, count=len(raw))
+    width = int(lengths.max()) if len(raw) else 0
+    width = max(8, -(-width // 8) * 8)
+    matrix = np.full((len(raw), width), fill, dtype=np.uint8)
+    for i, s in enumerate(raw):
+        matrix[i, :len(s)] = np.frombuffer(s, dtype=np.uint8)
+    return matrix, lengths
+
+
+def _as_words(matrix):
+    return np.ascontiguousarray(matrix).view(np.uint64)
+
+
+def _popcount(words):
+    """Set bits per uint64 word"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return _POPCOUNT8[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def _diff_counts(left, right):
+    """Number of differing bytes between every left row and every right row (uint64 words)"""
+    x = left[:, None, :] ^ right[None, :, :]
+    x |= x >> np.uint64(4)
+    x |= x >> np.uint64(2)
+    x |= x >> np.uint64(1)
+    x &= _LOW_BITS
+    # The multiply sums the 8 low bits into the top byte
+    x *= _LOW_BITS
+    x >>= np.uint64(56)
+    return x.sum(axis=-1)
+
+
+def _diff_counts32(left, right):
+    """Number of differing 32-bit halves between every left row and every right row (uint64 words)"""
+    x = left[:, None, :] ^ right[None, :, :]
+    return (np.count_nonzero(x & _LOW_HALF, axis=-1)
+            + np.count_nonzero(x >> np.uint64(32), axis=-1))
+
+
+def _and_counts(left, right):
+    """Set bits in common between every left row and every right row (packed bit masks)"""
+    return _popcount(left[:, None, :] & right[None, :, :]).sum(axis=-1)
+
+
+def _prepare(sequences, metric):
+    """Encodes the sequences once into the arrays the block kernel for metric needs"""
+    if metric == 'hamming':
+        # Zero padding makes positions past the shorter sequence count as differences,
+        # which is exactly the old "+ abs(len1 - len2)" length penalty
+        matrix, lengths = encode_padded(sequences, fill=0)
+        words = _as_words(matrix)
+        return {'left': words, 'right': words, 'lengths': lengths}
+    if metric == 'identity':
+        # Like Bio, shorter rows are padded with '-' (which matches '-'); the columns
+        # past the longest row get a different sentinel on each side so they never match
+        matrix, lengths = encode_padded(sequences, fill=ord('-'))
+        length = int(lengths.max())
+        left, right = matrix, matrix.copy()
+        left[:, length:] = _LEFT_SENTINEL
+        right[:, length:] = _RIGHT_SENTINEL
+        return {'left': _as_words(left), 'right': _as_words(right), 'lengths': lengths}
+    if metric in ('p', 'jc69'):
+        # Only positions where both sequences have A, C, G or T are compared
+        matrix, lengths = encode_padded(sequences, fill=0, upper=True)
+        valid = np.isin(matrix, np.frombuffer(b'ACGT', dtype=np.uint8))
+        left = np.where(valid, matrix, _LEFT_SENTINEL).astype(np.uint8)
+        right = np.where(valid, matrix, _RIGHT_SENTINEL).astype(np.uint8)
+        bits = np.packbits(valid, axis=1)
+        bits = np.pad(bits, ((0, 0), (0, (-bits.shape[1]) % 8)))
+        return {'left': _as_words(left), 'right': _as_words(right), 'lengths': lengths,
+                'valid': _as_words(bits)}
+    raise ValueError(f"Unknown distance metric '{metric}', expected one of {METRICS}")
+
+
+def _block_distances(data, metric, rows, cols):
+    """(len(rows), len(cols)) distance block"""
+    if metric == 'mash':
+        # Equal bins over the bins that aren't empty in both sketches estimate the Jaccard index.
+        # Bins hold 32-bit values (2 per word), so the matches
+        # expected by chance between two filled bins (1 in data['values']) are taken out first,
+        # and counts that chance alone explains are no matches at all.
+        diff = _diff_counts32(data['left'][rows], data['right'][cols]).astype(np.float64)
+        bins, chance = data['bins'], 1.0 / data['values']
+        both_empty = _and_counts(data['empty'][rows], data['empty'][cols])
+        both_filled = bins - data['empty_counts'][rows][:, None] - data['empty_counts'][cols][None, :] + both_empty
+        raw = bins - diff
+        expected = chance * both_filled
+        noise = MASH_CHANCE_SIGMAS * np.sqrt(both_filled * chance * (1 - chance))
+        matches = np.where(raw > expected + noise, np.maximum((raw - expected) / (1 - chance), 0.0), 0.0)
+        compared = bins - both_empty
+        with np.errstate(divide='ignore', invalid='ignore'):
+            jaccard = np.where(compared > 0, matches / compared, 0.0)
+            dist = -np.log(2 * jaccard / (1 + jaccard)) / data['k']
+        return np.where(jaccard > 0, np.minimum(dist, 1.0), 1.0) + 0.0
+    diff = _diff_counts(data['left'][rows], data['right'][cols]).astype(np.float64)
+    lengths = data['lengths']
+    if metric == 'hamming':
+        max_len = np.maximum(lengths[rows][:, None], lengths[cols][None, :])
+        min_len = np.minimum(lengths[rows][:, None], lengths[cols][None, :])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dist = diff / max_len
+        return np.where(min_len == 0, 1.0, dist)
+    if metric == 'identity':
+        # Sentinel columns never match, so matches = width - differing bytes
+        length = int(lengths.max())
+        if length == 0:
+            return np.ones_like(diff)
+        return 1.0 - (data['left'].shape[1] * 8 - diff) / length
+    compared = _and_counts(data['valid'][rows], data['valid'][cols]).astype(np.float64)
+    # Matching bytes among the compared positions (invalid ones never match)
+    matches = data['left'].shape[1] * 8 - diff
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = np.where(compared > 0, (compared - matches) / compared, 1.0)
+    if metric == 'p':
+        return p
+    p = np.minimum(p, JC_MAX_P)
+    return 0.0 - 0.75 * np.log(1.0 - 4.0 * p / 3.0)
+
+
+def _block_size(n, words):
+    """Rows (and columns) per block so a block's broadcast stays under BLOCK_ELEMENTS"""
+    return max(1, min(n, int(np.sqrt(BLOCK_ELEMENTS / max(words, 1)))))
+
+
+def _row_block(data, metric, n, start, stop, block):
+    """Condensed indices and values for rows [start, stop) against every later column"""
+    indices, values = [], []
+    rows = np.arange(start, stop)
+    for col_start in range(start, n, block):
+        cols = np.arange(col_start, min(col_start + block, n))
+        dist = _block_distances(data, metric, rows, cols)
+        r, c = np.nonzero(cols[None, :] > rows[:, None])
+        i, j = rows[r], cols[c]
+        indices.append(n * i - i * (i + 1) // 2 + (j - i - 1))
+        values.append(dist[r, c])
+    if not indices:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    return np.concatenate(indices), np.concatenate(values)
+
+
+# Worker-side copy of the encoded sequences, set once per pool process
+_worker_data = None
+
+
+def _init_distance_worker(data, metric, n, block):
+    global _worker_data
+    _worker_data = (data, metric, n, block)
+
+
+def _worker_row_block(start, stop):
+    data, metric, n, block = _worker_data
+    return _row_block(data, metric, n, start, stop, block)
+
+
+def pairwise_distances(sequences, metric='hamming', processes=None):
+    """Condensed pairwise distances between sequences (strings or bytes).
+
+    Metrics:
+      hamming  - mismatches over the shorter length plus the length difference,
+                 divided by the longer length (the original fallback distance)
+      identity - same as Bio's DistanceCalculator('identity') on rows right-padded
+                 with '-' (use it on aligned rows to replace that calculator)
+      p        - mismatch fraction over positions where both have A/C/G/T
+      jc69     - Jukes-Cantor corrected p-distance
+    processes > 1 spreads row blocks over a process pool.
+    """
+    if len(sequences) < 2:
+        return np.zeros(condensed_size(len(sequences)), dtype=np.float64)
+    return distances_from_encoded(_prepare(sequences, metric), metric, processes=processes)
+
+
+def distances_from_encoded(data, metric, processes=None):
+    """Condensed distances from rows already encoded as uint64 words ('left'/'right' plus
+    whatever the metric needs), computed block by block"""
+    if metric not in METRICS and metric not in ENCODED_METRICS:
+        raise ValueError(f"Unknown distance metric '{metric}'")
+    n = data['left'].shape[0]
+    condensed = np.zeros(condensed_size(n), dtype=np.float64)
+    if n < 2:
+        return condensed
+    block = _block_size(n, data['left'].shape[1])
+    starts = list(range(0, n, block))
+
+    if processes and processes > 1 and len(starts) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_distance_worker,
+                                 initargs=(data, metric, n, block)) as pool:
+            results = pool.map(_worker_row_block, starts, [min(s + block, n) for s in starts])
+            for indices, values in results:
+                condensed[indices] = values
+    else:
+        for start in starts:
+            indices, values = _row_block(data, metric, n, start, min(start + block, n), block)
+            condensed[indices] = values
+    return condensed
+
+
+def rows_from_encoded(data, metric, queries):
+    """(len(queries), n) distances from each query row to every encoded row, so adding k
+    sequences to n costs k * n pairs instead of all of them"""
+    n = data['left'].shape[0]
+    queries = np.asarray(queries, dtype=np.intp)
+    out = np.zeros((len(queries), n), dtype=np.float64)
+    block = _block_size(max(n, 1), data['left'].shape[1])
+    for start in range(0, len(queries), block):
+        rows = queries[start:start + block]
+        for col_start in range(0, n, block):
+            cols = np.arange(col_start, min(col_start + block, n))
+            out[start:start + len(rows), col_start:col_start + len(cols)] = _block_distances(data, metric, rows, cols)
+    # A sequence is 0 from itself whatever the metric gives (e.g. empty ones)
+    out[np.arange(len(queries)), queries] = 0.0
+    return out
+
+
+def query_distances(sequences, queries, metric='hamming'):
+    """Distances from sequences[q], for each index q in queries, to every sequence (see pairwise_distances)"""
+    return rows_from_encoded(_prepare(sequences, metric), metric, queries)
+
+
+def append_condensed(condensed, cross, within):
+    """Condensed matrix of n + k sequences from the n x n one, the (k, n) distances from the new
+    sequences to the old ones and their own (k, k) square matrix; copies, computes nothing"""
+    cross = np.asarray(cross, dtype=np.float64)
+    k, n = cross.shape
+    total = n + k
+    out = np.empty(condensed_size(total), dtype=np.float64)
+    # Row i of the condensed layout: pairs (i, j) for j > i, the k new columns go at its end
+    for i in range(n):
+        start, new_start = n * i - i * (i + 1) // 2, total * i - i * (i + 1) // 2
+        width = n - i - 1
+        out[new_start:new_start + width] = condensed[start:start + width]
+        out[new_start + width:new_start + width + k] = cross[:, i]
+    for a in range(k):
+        i = n + a
+        new_start = total * i - i * (i + 1) // 2
+        out[new_start:new_start + k - a - 1] = within[a, a + 1:]
+    return out
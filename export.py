@@ -0,0 +1,142 @@
+"""Streaming exports of a stored dataset and of its tree.
+
+Every export is a generator of byte chunks that the web layer hands to the
+response as is, so nothing is ever assembled in full: sequences are decoded
+from the dataset (dataset_store.py) a CHUNK of bases at a time, wrapped with
+one NumPy reshape per chunk, gathered into blocks of about BLOCK bytes and,
+when asked for, gzipped on the fly with a zlib stream. Memory stays flat
+however many sequences or bases are exported.
+
+Subsets are sequence indices of the dataset, picked by title, by the
+length/GC/title filters of sequence_table.py, or as the tips under the most
+recent common ancestor of a few sequences in the tree (a clade). The aligned
+FASTA, the consensus and the Newick come from the tree's cache entry.
+"""
+import zlib
+
+import numpy as np
+
+from alignment_profile import GAP, SYMBOLS, AlignmentProfile
+from phylogeny import tree_from_newick
+from tree_builder import to_newick
+
+# Bases decoded at a time, and bytes gathered before a chunk is handed on
+CHUNK = 1 << 20
+BLOCK = 1 << 16
+# Default line width of exported sequences (0 = one line per sequence)
+DEFAULT_WRAP = 60
+GZIP_LEVEL = 6
+FORMATS = ('fasta', 'aligned', 'consensus', 'newick')
+
+
+def wrap(data, width):
+    """bytes cut into lines of `width`, each followed by a newline (the last one too)"""
+    if not width:
+        return data + b'\n'
+    full = len(data) // width * width
+    lines = np.frombuffer(data, dtype=np.uint8, count=full).reshape(-1, width)
+    out = np.hstack((lines, np.full((len(lines), 1), ord('\n'), dtype=np.uint8))).tobytes()
+    return out + data[full:] + b'\n' if full < len(data) else out
+
+
+def _sequence_chunks(read, length, width):
+    """Lines of a sequence of `length` bases, read(start, end) giving bytes of it"""
+    # Chunks hold whole lines, so each one starts at the beginning of a line
+    step = max(CHUNK // width, 1) * width if width else CHUNK
+    for start in range(0, length, step):
+        data = read(start, min(start + step, length))
+        if width:
+            yield wrap(data, width)
+        else:
+            yield data
+    if not width:
+        yield b'\n'
+
+
+def _header(title):
+    return b'>' + title.encode('utf-8') + b'\n'
+
+
+def fasta_records(dataset, indices, width=DEFAULT_WRAP):
+    """FASTA of the dataset's sequences `indices` (empty sequences have no record)"""
+    for index in indices:
+        length = dataset.length(index)
+        if not length:
+            continue
+        yield _header(dataset.titles[index])
+        yield from _sequence_chunks(lambda start, end: dataset.sequence(index, start, end).encode('ascii'),
+                                    length, width)
+
+
+def aligned_records(aligned_fasta, names=None, width=DEFAULT_WRAP):
+    """Records of an aligned FASTA text re-wrapped to `width`, only those named in `names` if given"""
+    position = aligned_fasta.find('>')
+    while position >= 0:
+        end = aligned_fasta.find('\n>', position)
+        end = len(aligned_fasta) if end < 0 else end + 1
+        header, _, body = aligned_fasta[position + 1:end].partition('\n')
+        name = header.split(None, 1)[0] if header.strip() else ''
+        if names is None or name in names:
+            row = body.replace('\n', '').replace('\r', '').encode('ascii')
+            yield _header(header.rstrip())
+            yield from _sequence_chunks(lambda start, stop: row[start:stop], len(row), width)
+        position = end if end < len(aligned_fasta) else -1
+
+
+def consensus_record(profile, rows=None, width=DEFAULT_WRAP, title='consensus'):
+    """Consensus (gap columns dropped) of the profile's `rows`, all of them by default"""
+    if rows is not None:
+        profile = AlignmentProfile([profile.names[r] for r in rows], profile.codes[rows], profile.source)
+    codes = profile.consensus_codes[profile.consensus_codes != GAP]
+    symbols = np.frombuffer(SYMBOLS.encode('ascii'), dtype=np.uint8)
+    yield _header(f"{title} {profile.source} n={len(profile.names)}")
+    yield from _sequence_chunks(lambda start, end: symbols[codes[start:end]].tobytes(), len(codes), width)
+
+
+def newick(entry, clade=None):
+    """Newick of the whole tree, or of one clade of it"""
+    yield (to_newick(clade) if clade is not None else entry['newick']).encode('utf-8') + b'\n'
+
+
+def tree_tips(entry):
+    """Tip label of each sequence of a tree entry ('' for sequences left out of the tree)"""
+    return entry['info'].get('tips') or entry['names']
+
+
+def clade_of(entry, titles):
+    """(indices of the sequences under the most recent common ancestor of `titles`, that clade),
+    or (None, None) when a title isn't in the tree"""
+    tips = tree_tips(entry)
+    label_of = dict(zip(entry['names'], tips))
+    labels = [label_of.get(title) for title in titles]
+    if not labels or not all(labels):
+        return None, None
+    tree = tree_from_newick(entry['newick'])
+    clade = tree.common_ancestor(*labels) if len(labels) > 1 else tree.find_any(name=labels[0])
+    if clade is None:
+        return None, None
+    members = {tip.name for tip in clade.get_terminals()}
+    return np.array([i for i, tip in enumerate(tips) if tip in members], dtype=np.int64), clade
+
+
+def blocks(chunks, size=BLOCK):
+    """Small chunks (headers, short sequences) gathered into pieces of about `size` bytes"""
+    pending, pending_size = [], 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= size:
+            yield b''.join(pending)
+            pending, pending_size = [], 0
+    if pending:
+        yield b''.join(pending)
+
+
+def gzipped(chunks, level=GZIP_LEVEL):
+    """The chunks as one gzip stream"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
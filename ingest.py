@@ -0,0 +1,161 @@
+"""Streaming FASTA ingest for uploads (plain text, gzip or BGZF)"""
+import gzip
+
+from composition import BatchComposition
+
+CHUNK_SIZE = 1 << 20  # 1 MB reads off the upload stream
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Default caps, app.py overrides them from its config
+DEFAULT_MAX_RECORDS = 100000
+DEFAULT_MAX_BYTES = 1 << 30
+
+# Parsed records are sent to the composition kernel in batches of about this many bases
+BATCH_BASES = 1 << 22
+
+# Bytes we drop from sequence lines (line endings and stray whitespace)
+_WHITESPACE = b' \t\r\n\v\f'
+
+
+class FastaLimitError(ValueError):
+    """Raised when an upload goes over the configured record or byte caps"""
+
+
+class FastaFormatError(ValueError):
+    """Raised when a sequence line has bytes that aren't ASCII (SeqIO refuses them too)"""
+
+
+class _Rewound:
+    """Puts the sniffed magic bytes back in front of a non-seekable stream"""
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data = self.head + self.stream.read()
+            self.head = b''
+            return data
+        data = self.head[:size]
+        self.head = self.head[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+
+
+def open_fasta_stream(stream):
+    """Returns a binary file-like object, transparently gunzipping .gz/.bgz uploads"""
+    head = stream.read(2)
+    try:
+        stream.seek(0)
+    except (AttributeError, OSError, ValueError):
+        stream = _Rewound(head, stream)
+    if head == GZIP_MAGIC:
+        # BGZF is a chain of gzip members, GzipFile already reads them back to back
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    return stream
+
+
+def iter_chunks(stream, chunk_size=CHUNK_SIZE, max_bytes=None):
+    """Yields decompressed chunks of the upload, enforcing the byte cap as it goes"""
+    handle = open_fasta_stream(stream)
+    total = 0
+    while True:
+        chunk = handle.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if max_bytes is not None and total > max_bytes:
+            raise FastaLimitError(f"FASTA upload exceeds the {max_bytes} byte limit")
+        yield chunk
+
+
+def _make_records(headers, raws):
+    """Builds the sequence dicts used across the app, with stats from one batched composition pass"""
+    stats = BatchComposition(raws).per_sequence()
+    records = []
+    for header, raw, seq_stats in zip(headers, raws, stats):
+        if not raw.isascii():
+            raise FastaFormatError(f"Sequence '{header.decode('utf-8', 'replace').strip()}' has non-ASCII characters")
+        fields = header.decode('utf-8', 'replace').split(None, 1)
+        record = {'title': fields[0] if fields else '', 'sequence': raw.decode('ascii', 'replace')}
+        record.update(seq_stats)
+        records.append(record)
+    return records
+
+
+def parse_fasta_stream(stream, max_records=DEFAULT_MAX_RECORDS, max_bytes=DEFAULT_MAX_BYTES,
+                       chunk_size=CHUNK_SIZE):
+    """Parses FASTA records straight off a binary stream in a single pass.
+
+    Yields dicts with title, sequence, length, gc and bases, so the raw upload never
+    has to be held in memory as a whole. Records match SeqIO's 'fasta' format (title =
+    first word of the header, spaces and line ends dropped from the sequence, a '>' only
+    starts a header at the beginning of a line), except that:
+      - lines before the first header (blank lines, ';' comments, junk) are skipped, as
+        Biopython 1.81 and the 'fasta-pearson' format do, where newer SeqIO raises
+      - tabs and other ASCII whitespace are dropped from sequences too, not just spaces
+      - a sequence with non-ASCII bytes raises FastaFormatError
+    """
+    header = None  # header of the record being filled, None before the first '>'
+    parts = []
+    count = 0
+    buf = b''
+    in_header = False
+    line_start = True  # pos is at the beginning of a line
+    # Finished records waiting for the batched stats pass
+    headers, raws, pending_bases = [], [], 0
+
+    def finish_record():
+        nonlocal count, pending_bases
+        count += 1
+        if max_records is not None and count > max_records:
+            raise FastaLimitError(f"FASTA upload exceeds the {max_records} record limit")
+        raw = b''.join(parts)
+        headers.append(header)
+        raws.append(raw)
+        pending_bases += len(raw)
+
+    for chunk in iter_chunks(stream, chunk_size, max_bytes):
+        buf = buf + chunk if buf else chunk
+        pos = 0
+        while pos < len(buf):
+            if in_header:
+                newline = buf.find(b'\n', pos)
+                if newline == -1:
+                    break  # header continues in the next chunk
+                if header is not None:
+                    finish_record()
+                header = buf[pos + 1:newline]
+                parts = []
+                in_header = False
+                line_start = True
+                pos = newline + 1
+            elif line_start and buf[pos] == 0x3e:  # '>'
+                in_header = True
+            else:
+                # Everything up to the next line that starts with '>' is sequence
+                start = buf.find(b'\n>', pos)
+                end = len(buf) if start == -1 else start + 1
+                if header is not None:
+                    parts.append(buf[pos:end].translate(None, _WHITESPACE))
+                line_start = buf[end - 1] == 0x0a  # '\n'
+                pos = end
+        buf = buf[pos:]
+
+        if pending_bases >= BATCH_BASES:
+            yield from _make_records(headers, raws)
+            headers, raws, pending_bases = [], [], 0
+
+    if in_header and buf:
+        # Header on the last line without a trailing newline
+        if header is not None:
+            finish_record()
+        header, parts = buf[1:], []
+    if header is not None:
+        finish_record()
+    if headers:
+        yield from _make_records(headers, raws)
@@ -0,0 +1,259 @@
+"""Background job queue backed by a process pool.
+
+Long tasks (MUSCLE, tree building, rendering) run in worker processes so the
+request thread can answer right away with a job id. The queue is bounded: once
+max_queue jobs are queued or running, submit() raises QueueFullError and the
+caller can degrade gracefully instead of piling up work.
+
+Workers report progress through a multiprocessing queue, which also carries
+the metric observations of each job back to the web process (metrics.py).
+Cancellation and timeouts are cooperative: each job gets a slot in a shared
+flag array, and the progress callback raises JobCancelled in the worker once
+its flag is set.
+
+MUSCLE runs are capped across all workers by one semaphore created here and
+handed to each worker (aligner.share_slots), so GF_MUSCLE_MAX_PARALLEL bounds
+the whole server rather than each process.
+"""
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+import aligner
+import metrics
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TIMEOUT = 'timeout'
+FINISHED_STATES = (DONE, FAILED, CANCELLED, TIMEOUT)
+
+# Values of the per-slot cancel flags
+_FLAG_CLEAR = 0
+_FLAG_CANCEL = 1
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker when its job was cancelled or ran out of time"""
+
+
+class QueueFullError(RuntimeError):
+    """Raised by submit() when the bounded queue has no free slot"""
+
+
+# Worker-side globals, set by the pool initializer
+_progress_queue = None
+_cancel_flags = None
+
+
+def _init_worker(progress_queue, cancel_flags, muscle_slots):
+    global _progress_queue, _cancel_flags
+    _progress_queue = progress_queue
+    _cancel_flags = cancel_flags
+    if muscle_slots is not None:
+        aligner.share_slots(muscle_slots)
+
+
+def _run_in_worker(job_id, slot, fn, args, kwargs):
+    """Runs fn in a worker process with a progress callback that also checks for cancellation"""
+    def progress(fraction, message=''):
+        if _cancel_flags[slot] != _FLAG_CLEAR:
+            raise JobCancelled(f"Job {job_id} was cancelled")
+        _progress_queue.put((job_id, fraction, message))
+
+    if _cancel_flags[slot] != _FLAG_CLEAR:
+        raise JobCancelled(f"Job {job_id} was cancelled")
+    _progress_queue.put((job_id, 0.0, f"Started in worker {os.getpid()}"))
+    with metrics.capture() as observations:
+        try:
+            return fn(*args, progress=progress, **kwargs)
+        finally:
+            # A report without a fraction carries the job's metrics, whatever the outcome
+            _progress_queue.put((job_id, None, observations))
+
+
+class JobManager:
+    """Bounded process-pool job queue with status, progress, results, cancellation and timeouts"""
+
+    def __init__(self, max_workers=None, max_queue=32, timeout=300, retention=3600, muscle_parallel=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.muscle_parallel = muscle_parallel
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.retention = retention
+        self._jobs = {}
+        # Reentrant: cancelling a queued future runs _on_done synchronously under the lock
+        self._lock = threading.RLock()
+        self._executor = None
+        self._free_slots = list(range(max_queue))
+        self.counters = {'submitted': 0, 'rejected': 0, DONE: 0, FAILED: 0, CANCELLED: 0, TIMEOUT: 0}
+
+    def _start(self):
+        """Starts the pool and helper threads on first use (lock held)"""
+        if self._executor is not None:
+            return
+        # spawn keeps workers independent of the web server's threads
+        context = multiprocessing.get_context('spawn')
+        self._progress_queue = context.Queue()
+        self._cancel_flags = context.Array('b', self.max_queue, lock=False)
+        # One semaphore for every worker: a per-process one would allow max_workers times as many runs
+        muscle_slots = context.BoundedSemaphore(self.muscle_parallel) if self.muscle_parallel else None
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                             initializer=_init_worker,
+                                             initargs=(self._progress_queue, self._cancel_flags, muscle_slots))
+        threading.Thread(target=self._drain_progress, name='job-progress', daemon=True).start()
+        threading.Thread(target=self._watchdog, name='job-watchdog', daemon=True).start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queues fn(*args, progress=..., **kwargs) and returns the job id, or raises QueueFullError"""
+        with self._lock:
+            self._start()
+            if not self._free_slots:
+                self.counters['rejected'] += 1
+                raise QueueFullError(f"Job queue is full ({self.max_queue} jobs queued or running)")
+            slot = self._free_slots.pop()
+            self._cancel_flags[slot] = _FLAG_CLEAR
+            job_id = uuid.uuid4().hex
+            job = {
+                'id': job_id,
+                'status': QUEUED,
+                'progress': 0.0,
+                'message': 'Waiting for a free worker',
+                'error': None,
+                'result': None,
+                'created': time.time(),
+                'started': None,
+                'finished': None,
+                'slot': slot,
+                'future': None,
+            }
+            self._jobs[job_id] = job
+            self.counters['submitted'] += 1
+            future = self._executor.submit(_run_in_worker, job_id, slot, fn, args, kwargs)
+            job['future'] = future
+        future.add_done_callback(lambda f, job_id=job_id: self._on_done(job_id, f))
+        return job_id
+
+    def status(self, job_id):
+        """Public view of a job (no result payload), or None if unknown/expired"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            view = {k: job[k] for k in ('id', 'status', 'progress', 'message', 'error',
+                                        'created', 'started', 'finished')}
+        view['elapsed'] = (view['finished'] or time.time()) - (view['started'] or view['created'])
+        return view
+
+    def result(self, job_id):
+        """The job's return value once it is done, None otherwise"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job['result'] if job is not None and job['status'] == DONE else None
+
+    def cancel(self, job_id):
+        """Cancels a queued or running job, returns False if it doesn't exist or already finished"""
+        return self._stop(job_id, CANCELLED, 'Cancelled by user')
+
+    def stats(self):
+        """Queue depth and lifetime counters"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['queued'] = sum(1 for job in self._jobs.values() if job['status'] == QUEUED)
+            stats['running'] = sum(1 for job in self._jobs.values() if job['status'] == RUNNING)
+            stats['capacity'] = self.max_queue
+            stats['workers'] = self.max_workers
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _stop(self, job_id, status, message):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] in FINISHED_STATES:
+                return False
+            self._cancel_flags[job['slot']] = _FLAG_CANCEL
+            job['status'] = status
+            job['message'] = message
+            job['finished'] = time.time()
+            self.counters[status] += 1
+            # Queued jobs never start, running ones stop at their next progress check
+            job['future'].cancel()
+        return True
+
+    def _on_done(self, job_id, future):
+        """Stores the outcome and frees the job's slot (runs in the executor's thread)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            if job['status'] not in FINISHED_STATES:
+                try:
+                    job['result'] = future.result()
+                    job['status'] = DONE
+                    job['progress'] = 1.0
+                    job['message'] = 'Finished'
+                except (CancelledError, JobCancelled):
+                    job['status'] = CANCELLED
+                    job['message'] = 'Cancelled'
+                except Exception as e:
+                    job['status'] = FAILED
+                    job['error'] = str(e) or e.__class__.__name__
+                    job['message'] = 'Failed'
+                job['finished'] = time.time()
+                self.counters[job['status']] += 1
+            # The worker is done with the slot either way
+            self._cancel_flags[job['slot']] = _FLAG_CLEAR
+            self._free_slots.append(job['slot'])
+            job['future'] = None
+
+    def _drain_progress(self):
+        """Moves progress reports from the workers into the job table"""
+        while True:
+            try:
+                job_id, fraction, message = self._progress_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            if fraction is None:
+                metrics.replay(message)
+                continue
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job['status'] in FINISHED_STATES:
+                    continue
+                if job['status'] == QUEUED:
+                    job['status'] = RUNNING
+                    job['started'] = time.time()
+                job['progress'] = max(job['progress'], fraction)
+                job['message'] = message
+
+    def _watchdog(self):
+        """Times out jobs that run too long and forgets finished ones after the retention period"""
+        while True:
+            time.sleep(1)
+            now = time.time()
+            expired, forgotten = [], []
+            with self._lock:
+                for job_id, job in self._jobs.items():
+                    if job['status'] == RUNNING and now - job['started'] > self.timeout:
+                        expired.append(job_id)
+                    elif (job['status'] in FINISHED_STATES and job['future'] is None
+                          and now - job['finished'] > self.retention):
+                        forgotten.append(job_id)
+                for job_id in forgotten:
+                    del self._jobs[job_id]
+            for job_id in expired:
+                self._stop(job_id, TIMEOUT, f"Timed out after {self.timeout:.0f} s")
@@ -0,0 +1,210 @@
+"""Stage timings and counters, exported in the Prometheus text format.
+
+Pipeline stages run inside `timed(stage, sequences, bases)`: the wall time
+goes into the gf_stage_seconds histogram, labelled with the stage and a size
+class of the input, and one JSON log line with the exact input size is
+printed. Counters record MUSCLE exit statuses, fallbacks between tree
+methods and cache lookups.
+
+Job workers are separate processes, so whatever a job records is captured
+in the worker (capture()) and sent back with its progress reports, where
+the web process merges it into its own registry (replay()). /metrics
+renders that registry plus point-in-time gauges (queue depth, cache sizes).
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from settings import STAGE_LOG
+
+# Histogram buckets (s), from parsing a few sequences up to MUSCLE's time limit
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Upper bounds (number of sequences) of the input size classes used as the `size` label
+SIZE_CLASSES = (10, 100, 1000, 10000)
+
+# Exported metrics: name -> (type, help)
+METRICS = {
+    'gf_stage_seconds': ('histogram', 'Wall time of each analysis pipeline stage'),
+    'gf_stage_bases_total': ('counter', 'Bases processed by each pipeline stage'),
+    'gf_request_seconds': ('histogram', 'Wall time of HTTP requests by endpoint'),
+    'gf_muscle_runs_total': ('counter', 'MUSCLE runs by exit status'),
+    'gf_tree_fallbacks_total': ('counter', 'Tree builds that fell back to another method'),
+    'gf_cache_lookups_total': ('counter', 'Cache lookups by cache and result'),
+    'gf_cache_write_errors_total': ('counter', 'Cache entries that could not be written to disk'),
+}
+
+
+def size_class(sequences):
+    """Label for an input of `sequences` sequences: '<=10', '<=100', ... or '>10000'"""
+    if sequences is None:
+        return 'none'
+    for bound in SIZE_CLASSES:
+        if sequences <= bound:
+            return f"<={bound}"
+    return f">{SIZE_CLASSES[-1]}"
+
+
+def input_size(sequences):
+    """(number of sequences, total bases) of [{'sequence': ...}] or [(id, sequence)]"""
+    bases = 0
+    for item in sequences:
+        if isinstance(item, dict):
+            bases += item['length'] if 'length' in item else len(item['sequence'])
+        else:
+            bases += len(item[1])
+    return len(sequences), bases
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Counters and fixed-bucket histograms keyed by (name, labels)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        # (name, labels) -> [per-bucket counts (last one is +Inf), sum, count]
+        self._histograms = {}
+        self._captures = []
+
+    def inc(self, name, value=1, **labels):
+        self.apply(('counter', name, _labels(labels), value))
+
+    def observe(self, name, value, **labels):
+        self.apply(('histogram', name, _labels(labels), value))
+
+    def apply(self, observation):
+        """Records one (kind, name, labels, value) observation"""
+        kind, name, labels, value = observation
+        with self._lock:
+            if kind == 'counter':
+                self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+            else:
+                series = self._histograms.get((name, labels))
+                if series is None:
+                    series = self._histograms[(name, labels)] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+                series[0][bisect_left(BUCKETS, value)] += 1
+                series[1] += value
+                series[2] += 1
+            for captured in self._captures:
+                captured.append(observation)
+
+    @contextmanager
+    def capture(self):
+        """Collects every observation recorded while active into the yielded list"""
+        captured = []
+        with self._lock:
+            self._captures.append(captured)
+        try:
+            yield captured
+        finally:
+            with self._lock:
+                self._captures.remove(captured)
+
+    def replay(self, observations):
+        """Records observations captured in another process"""
+        for observation in observations:
+            self.apply(tuple(observation))
+
+    def counter_values(self, name):
+        """{labels dict: value} of one counter"""
+        with self._lock:
+            return {labels: value for (metric, labels), value in self._counters.items() if metric == name}
+
+    def render(self, gauges=()):
+        """Prometheus text exposition of the registry plus (name, help, labels dict, value) gauges"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(series[0]), series[1], series[2]))
+                                for key, series in self._histograms.items())
+        lines = []
+        declared = set()
+
+        def declare(name, kind, help_text):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            declare(name, 'counter', METRICS.get(name, ('counter', name))[1])
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), (buckets, total, count) in histograms:
+            declare(name, 'histogram', METRICS.get(name, ('histogram', name))[1])
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ('+Inf',), buckets):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', str(bound))])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(float(total))}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for name, help_text, labels, value in gauges:
+            declare(name, 'gauge', help_text)
+            lines.append(f"{name}{_format_labels(_labels(labels))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+# One registry per process; the web process also holds what its job workers sent back
+REGISTRY = Registry()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+capture = REGISTRY.capture
+replay = REGISTRY.replay
+
+
+def log_event(event, **fields):
+    """One JSON log line (event, pid and the given fields) on stdout"""
+    if STAGE_LOG:
+        print(json.dumps(dict(event=event, pid=os.getpid(), **fields), sort_keys=True, default=str))
+
+
+@contextmanager
+def timed(stage, sequences=None, bases=None, **fields):
+    """Times the enclosed block as `stage`, tagged with the input size, and logs it.
+
+    Yields a dict holding the size, so a stage that only learns it while running
+    (parsing an upload) can fill in 'sequences' and 'bases' before it ends.
+    """
+    size = {'sequences': sequences, 'bases': bases}
+    start = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield size
+    except BaseException as e:
+        outcome = e.__class__.__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('gf_stage_seconds', elapsed, stage=stage, size=size_class(size['sequences']))
+        if size['bases']:
+            inc('gf_stage_bases_total', size['bases'], stage=stage)
+        log_event('stage', stage=stage, seconds=round(elapsed, 6), sequences=size['sequences'],
+                  bases=size['bases'], outcome=outcome, **fields)
+
+
+def cache_hit_ratios():
+    """(cache, hits / lookups) from the gf_cache_lookups_total counter"""
+    lookups, hits = {}, {}
+    for labels, value in REGISTRY.counter_values('gf_cache_lookups_total').items():
+        labels = dict(labels)
+        cache = labels.get('cache', '')
+        lookups[cache] = lookups.get(cache, 0) + value
+        if labels.get('result') != 'miss':
+            hits[cache] = hits.get(cache, 0) + value
+    return [(cache, hits.get(cache, 0) / total) for cache, total in sorted(lookups.items()) if total]
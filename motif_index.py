@@ -0,0 +1,270 @@
+"""Motif search over a stored dataset with a suffix array / FM-index.
+
+The dataset's sequences are joined with a separator and indexed once, on
+the first query (the arrays are saved next to the dataset, so other
+processes and later queries memory-map them instead of rebuilding):
+
+  sa    suffix array, built by prefix doubling with NumPy sorts (the first
+        21 characters are packed into one key to skip the early rounds)
+  bwt   Burrows-Wheeler transform, text[sa - 1]
+  occ   per-character counts of the BWT at every OCC_STEP-th position
+
+A query is a backward search: one pair of rank lookups per motif position
+and allowed base. IUPAC codes just allow several bases at a position, the
+reverse strand is the reverse complement searched on the same index, and
+mismatches branch into the other bases while the budget lasts. Matching
+suffix-array ranges are then located directly from the suffix array, so
+the cost is about motif length (times the branching) plus hits, not total
+bases.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Text codes: separator between sequences, the four bases, anything else
+SEPARATOR, OTHER = 0, 5
+SIGMA = 6
+BASES = 'ACGT'
+# Rank checkpoints every OCC_STEP BWT positions
+OCC_STEP = 64
+# Characters packed into the initial sort key (3 bits each)
+_PACKED = 21
+MAX_MISMATCHES = 3
+# Hits located per query at most (pagination happens over these)
+MAX_HITS = 100000
+# Indexes kept loaded
+OPEN_INDEXES = 4
+
+IUPAC = {
+    'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'U': 'T',
+    'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+    'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG', 'N': 'ACGT',
+}
+_COMPLEMENT = str.maketrans('ACGTURYSWKMBDHVN', 'TGCAAYRSWMKVHDBN')
+
+_FILES = ('sa', 'bwt', 'occ', 'counts', 'starts')
+
+
+def _build_lut():
+    """Byte -> text code, case-insensitive, U read as T"""
+    lut = np.full(256, OTHER, dtype=np.uint8)
+    for code, bases in enumerate(('Aa', 'Cc', 'Gg', 'TtUu'), start=1):
+        for base in bases:
+            lut[ord(base)] = code
+    return lut
+
+
+_LUT = _build_lut()
+
+
+def parse_motif(motif):
+    """Upper-cased motif, or ValueError if it has anything but IUPAC nucleotide codes"""
+    motif = ''.join(motif.split()).upper()
+    if not motif:
+        raise ValueError("Empty motif")
+    bad = sorted(set(motif) - set(IUPAC))
+    if bad:
+        raise ValueError(f"Invalid motif characters: {''.join(bad)}")
+    return motif
+
+
+def reverse_complement(motif):
+    return motif.translate(_COMPLEMENT)[::-1]
+
+
+def _group_starts(new_group):
+    """For each sorted position, the position where its group (of equal keys) starts"""
+    return np.maximum.accumulate(np.where(new_group, np.arange(len(new_group)), 0))
+
+
+def suffix_array(text):
+    """Suffix array of a small-alphabet uint8 array (values < 8) by prefix doubling.
+
+    Suffixes are ranked by the position of their group in the sorted order, and each
+    round only re-sorts the groups that are still tied, so repeated sequences cost
+    rounds over their own suffixes instead of over the whole text.
+    """
+    n = len(text)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    # Initial key: the first _PACKED characters of each suffix, 3 bits each (0 past the end)
+    padded = np.concatenate((text.astype(np.int64) + 1, np.zeros(_PACKED, dtype=np.int64)))
+    key = np.zeros(n, dtype=np.int64)
+    for t in range(_PACKED):
+        key = (key << 3) | padded[t:t + n]
+    sa = np.argsort(key, kind='stable')
+    sorted_key = key[sa]
+    del key
+    group = _group_starts(np.concatenate(([True], sorted_key[1:] != sorted_key[:-1])))
+    del sorted_key
+    # rank[i] = group of suffix i, with one extra slot so "past the end" ranks below everything
+    rank = np.full(n + 1, -1, dtype=np.int64)
+    rank[sa] = group
+
+    h = _PACKED
+    while h < n:
+        # Positions in a group of two or more
+        size = np.bincount(group, minlength=n)
+        tied = np.flatnonzero(size[group] > 1)
+        if not len(tied):
+            break
+        suffixes = sa[tied]
+        following = rank[np.minimum(suffixes + h, n)]
+        order = np.lexsort((following, group[tied]))
+        sa[tied] = suffixes[order]
+        following = following[order]
+        old_group = group[tied]
+        # Split groups where the following rank changes (tied positions are grouped contiguously)
+        boundary = np.concatenate(([True], (old_group[1:] != old_group[:-1]) | (following[1:] != following[:-1])))
+        group[tied] = tied[_group_starts(boundary)]
+        rank[sa[tied]] = group[tied]
+        h *= 2
+    return sa
+
+
+class MotifIndex:
+    """FM-index over the sequences of one dataset"""
+
+    def __init__(self, sa, bwt, occ, counts, starts):
+        self.sa = sa
+        self.bwt = bwt
+        self.occ = occ
+        # counts[c] = number of text characters smaller than c
+        self.counts = counts
+        # Text position where each sequence starts (sequences are separated by one character)
+        self.starts = starts
+
+    @classmethod
+    def build(cls, dataset):
+        """Indexes the dataset's sequences, joined with separators (one after each sequence)"""
+        raw = np.frombuffer(dataset._decode(0, dataset.total_bases), dtype=np.uint8)
+        offsets = np.asarray(dataset.offsets, dtype=np.int64)
+        n_seqs = len(offsets) - 1
+        starts = offsets[:-1] + np.arange(n_seqs)
+        text = np.full(len(raw) + n_seqs, SEPARATOR, dtype=np.uint8)
+        positions = np.ones(len(text), dtype=bool)
+        positions[offsets[1:] + np.arange(n_seqs)] = False
+        text[positions] = _LUT[raw]
+
+        sa = suffix_array(text)
+        sa = sa.astype(np.int32) if len(text) < 2 ** 31 else sa
+        bwt = text[sa - 1]  # sa == 0 wraps to the last character, a separator
+        steps = len(bwt) // OCC_STEP + 1
+        block = np.arange(len(bwt)) // OCC_STEP
+        per_block = np.bincount(block * SIGMA + bwt, minlength=steps * SIGMA).reshape(steps, SIGMA)
+        occ = np.zeros((steps + 1, SIGMA), dtype=np.int64)
+        np.cumsum(per_block, axis=0, out=occ[1:])
+        counts = np.concatenate(([0], np.cumsum(np.bincount(text, minlength=SIGMA))))[:SIGMA]
+        return cls(sa, bwt, occ[:-1], counts.astype(np.int64), starts)
+
+    @classmethod
+    def load_or_build(cls, dataset):
+        """Loads the index saved next to the dataset, building and saving it the first time"""
+        paths = {name: os.path.join(dataset.directory, f"motif_{name}.npy") for name in _FILES}
+        try:
+            return cls(**{name: np.load(path, mmap_mode='r') for name, path in paths.items()})
+        except (OSError, ValueError):
+            pass
+        index = cls.build(dataset)
+        for name, path in paths.items():
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, getattr(index, name))
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"WARNING: could not save motif index {path}: {e}")
+        return index
+
+    def _rank(self, code, i):
+        """Occurrences of code in bwt[:i]"""
+        block = i // OCC_STEP
+        base = block * OCC_STEP
+        return int(self.occ[block, code]) + int(np.count_nonzero(self.bwt[base:i] == code))
+
+    def _extend(self, code, lo, hi):
+        """Suffix-array range of code + (pattern of [lo, hi))"""
+        return (int(self.counts[code]) + self._rank(code, lo),
+                int(self.counts[code]) + self._rank(code, hi))
+
+    def ranges(self, motif, mismatches=0):
+        """[(lo, hi, mismatches)] suffix-array ranges of text windows matching the motif"""
+        allowed = [{BASES.index(b) + 1 for b in IUPAC[c]} for c in motif]
+        found = []
+        stack = [(len(motif), 0, len(self.sa), 0)]
+        while stack:
+            pos, lo, hi, used = stack.pop()
+            if pos == 0:
+                found.append((lo, hi, used))
+                continue
+            for code in range(1, SIGMA):
+                cost = used + (code not in allowed[pos - 1])
+                if cost > mismatches:
+                    continue
+                new_lo, new_hi = self._extend(code, lo, hi)
+                if new_lo < new_hi:
+                    stack.append((pos - 1, new_lo, new_hi, cost))
+        return found
+
+    def search(self, motif, mismatches=0, strands='both', limit=MAX_HITS):
+        """Hits sorted by (sequence, start, strand) as arrays: sequence, start, strand (+1/-1),
+        mismatches, plus the total number of hits before `limit` was applied"""
+        queries = []
+        if strands in ('both', 'forward'):
+            queries.append((motif, 1))
+        reverse = reverse_complement(motif)
+        # A palindromic motif matches the same windows on both strands, report them once
+        if strands in ('both', 'reverse') and not (strands == 'both' and reverse == motif):
+            queries.append((reverse, -1))
+
+        positions, strand_of, cost_of = [], [], []
+        total = 0
+        for query, strand in queries:
+            for lo, hi, used in self.ranges(query, mismatches):
+                total += hi - lo
+                take = max(0, min(hi - lo, limit - sum(len(p) for p in positions)))
+                if take:
+                    positions.append(np.asarray(self.sa[lo:lo + take], dtype=np.int64))
+                    strand_of.append(np.full(take, strand, dtype=np.int8))
+                    cost_of.append(np.full(take, used, dtype=np.int8))
+        if not positions:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty.astype(np.int8), empty.astype(np.int8), total
+
+        positions = np.concatenate(positions)
+        strand_of = np.concatenate(strand_of)
+        cost_of = np.concatenate(cost_of)
+        sequence = np.searchsorted(self.starts, positions, side='right') - 1
+        start = positions - self.starts[sequence]
+        order = np.lexsort((-strand_of, start, sequence))
+        return sequence[order], start[order], strand_of[order], cost_of[order], total
+
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+_building = {}
+
+
+def get_motif_index(dataset):
+    """The MotifIndex of a dataset, loaded or built on first use and kept in a small LRU"""
+    with _lock:
+        index = _indexes.get(dataset.id)
+        if index is not None:
+            _indexes.move_to_end(dataset.id)
+            return index
+        # One build per dataset even if several queries arrive at once
+        build_lock = _building.setdefault(dataset.id, threading.Lock())
+    with build_lock:
+        with _lock:
+            index = _indexes.get(dataset.id)
+        if index is None:
+            index = MotifIndex.load_or_build(dataset)
+            with _lock:
+                _indexes[dataset.id] = index
+                while len(_indexes) > OPEN_INDEXES:
+                    _indexes.popitem(last=False)
+    with _lock:
+        _building.pop(dataset.id, None)
+    return index
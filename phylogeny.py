@@ -0,0 +1,552 @@
+"""Phylogeny generation: MUSCLE/NJ, the built-in progressive aligner and the Hamming fallback, with caching.
+Trees are returned as references to their cache entry and drawn on request (render.py)."""
+import threading
+from collections import OrderedDict
+from io import StringIO
+
+import numpy as np
+from Bio import AlignIO, Phylo
+from Bio.Align import MultipleSeqAlignment
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from aligner import AlignerError, MuscleExecutor, find_muscle
+from dedup import normalize, reduce_sequences
+from distances import (DistanceIndex, append_condensed, condensed_row, condensed_to_square, pairwise_distances,
+                       query_distances)
+from jobs import JobCancelled
+from metrics import inc, input_size, timed
+from progressive import align as progressive_align, extend_alignment
+from settings import (ALIGN_PROCESSES, CACHE_DIR, CACHE_DISK_BYTES, CACHE_MEMORY_BYTES, DISTANCE_PROCESSES, MUSCLE_MAX_PARALLEL,
+                      MUSCLE_PATH, MUSCLE_THREADS, SKETCH_K, SKETCH_SIZE, TREE_METHOD, TREE_REBUILD_FRACTION)
+from sketch import sketch_distances, sketch_query_distances
+from tree_builder import build_tree, insert_tips, to_newick
+from tree_cache import TreeCache, cache_key
+
+# MUSCLE wall time limit (s)
+MUSCLE_TIMEOUT = 120
+
+# Created on first use, one per process (web server or job worker)
+_muscle_executor = None
+
+# Method parameters that go into the cache key of each route
+MUSCLE_PARAMS = {'method': 'muscle', 'distance': 'identity', 'tree': TREE_METHOD}
+PROGRESSIVE_PARAMS = {'method': 'progressive', 'distance': 'identity', 'tree': TREE_METHOD}
+SIMPLE_PARAMS = {'method': 'simple', 'distance': 'hamming', 'tree': TREE_METHOD}
+SKETCH_PARAMS = {'method': 'sketch', 'distance': 'mash', 'k': SKETCH_K, 'size': SKETCH_SIZE, 'tree': TREE_METHOD}
+
+# Distance methods offered on the analyze form: MUSCLE alignment (built-in aligner, then Hamming, as
+# fallbacks), the built-in progressive aligner alone, or k-mer sketches
+DISTANCE_METHODS = ('alignment', 'progressive', 'sketch')
+
+# Name -> index maps over cached distance matrices, for the distance query endpoints
+DISTANCE_INDEXES = 16
+_distance_indexes = OrderedDict()
+_index_lock = threading.Lock()
+
+tree_cache = TreeCache(CACHE_DIR, max_memory_bytes=CACHE_MEMORY_BYTES, max_disk_bytes=CACHE_DISK_BYTES)
+
+
+def _report(progress, fraction, message):
+    """Calls the optional progress callback (job workers use it to report and to check for cancellation)"""
+    print(message)
+    if progress is not None:
+        progress(fraction, message)
+
+
+def _params(params, cluster):
+    """Cache key parameters of a route plus the pre-alignment reduction settings"""
+    return dict(params, dedup=True, cluster=cluster)
+
+
+def build_reduced(build, sequences, cluster=None, **kwargs):
+    """Runs a build_* function on the deduplicated/clustered representatives only and maps
+    its names and distances back to every original sequence"""
+    with timed('dedup', *input_size(sequences)):
+        reduction = reduce_sequences(sequences, cluster)
+    if not reduction.reduced:
+        return build(sequences, **kwargs)
+    stats = reduction.stats()
+    _report(kwargs.get('progress'), 0.1, f"Reduced {stats['sequences']} sequences to {stats['representatives']} representatives")
+    entry = build(reduction.representatives, **kwargs)
+    if entry is None:
+        return None
+    entry['names'] = [seq_data['title'] for seq_data in sequences]
+    entry['condensed'] = reduction.expand(entry['condensed'])
+    # Every sequence is drawn as its representative's tip
+    tips = entry['info']['tips']
+    entry['info']['tips'] = [tips[rep] if rep >= 0 else '' for rep in reduction.assignment]
+    return entry
+
+
+def tree_ref(key, style):
+    """What the web app needs to serve a cached tree: its cache key and drawing style"""
+    return {'key': key, 'style': style}
+
+
+def cached_phylogeny(sequences, method='alignment', cluster=None):
+    """Returns the tree_ref straight from the cache, or None if this input hasn't been seen with
+    this method. Only the method's own key is looked up: a tree that one of its fallbacks built
+    (progressive or simple) is not a MUSCLE tree, so the job runs and tries MUSCLE again."""
+    params = {'sketch': SKETCH_PARAMS, 'progressive': PROGRESSIVE_PARAMS}.get(method, MUSCLE_PARAMS)
+    key = cache_key(sequences, **_params(params, cluster))
+    if tree_cache.get(key) is None:
+        return None
+    return tree_ref(key, 'muscle')
+
+
+def distance_index(key):
+    """DistanceIndex over the distances cached under a tree key, or None if the key is unknown"""
+    with _index_lock:
+        index = _distance_indexes.get(key)
+        if index is not None:
+            _distance_indexes.move_to_end(key)
+            return index
+    entry = tree_cache.get(key)
+    if entry is None:
+        return None
+    index = DistanceIndex(entry['names'], entry['condensed'])
+    with _index_lock:
+        _distance_indexes[key] = index
+        while len(_distance_indexes) > DISTANCE_INDEXES:
+            _distance_indexes.popitem(last=False)
+    return index
+
+
+def build_tree_entry(sequences, progress=None, timeout=None, method='alignment', cluster=None):
+    """Builds (or finds in the cache) the tree with `method` and returns (tree_ref, cache entry).
+    cluster is an identity threshold (0-1) for near-identical clustering, None for exact dedup only."""
+    if method == 'sketch':
+        built = generate_sketch_tree(sequences, progress=progress, cluster=cluster)
+    elif method == 'progressive':
+        built = generate_progressive_tree(sequences, progress=progress, cluster=cluster)
+    else:
+        built = generate_phylogenetic_tree_with_distances(sequences, progress=progress,
+                                                          timeout=timeout, cluster=cluster)
+    if built is None:
+        raise RuntimeError("Phylogenetic tree could not be generated")
+    return built
+
+
+def run_phylogeny_job(sequences, progress=None, timeout=None, method='alignment', cluster=None):
+    """Job entry point: builds the tree and returns everything the results page needs"""
+    tree, _ = build_tree_entry(sequences, progress=progress, timeout=timeout, method=method, cluster=cluster)
+    # Distances stay in the cache, the page queries them by tree key (distance_index)
+    return {'tree': tree}
+
+
+def generate_phylogenetic_tree_with_distances(sequences, progress=None, timeout=None, cluster=None):
+    """Generates a phylogenetic tree and its distance matrix (both cached), returns (tree_ref, entry)"""
+    try:
+        _report(progress, 0.05, "Starting phylogenetic tree generation...")
+        # Same sequences + same method = same alignment, distances and tree, so check the cache first
+        key = cache_key(sequences, **_params(MUSCLE_PARAMS, cluster))
+        entry = tree_cache.get(key)
+        if entry is not None:
+            print(f"Cache hit for {key[:12]}, skipping MUSCLE")
+        else:
+            # MUSCLE only sees one representative per group of (near-)identical sequences
+            entry = build_reduced(build_muscle_tree, sequences, cluster, progress=progress, timeout=timeout)
+            if entry is None:
+                # No usable MUSCLE: the built-in aligner still gives real alignments
+                inc('gf_tree_fallbacks_total', source='muscle', target='progressive', reason='unavailable')
+                return generate_progressive_tree(sequences, progress=progress, cluster=cluster)
+            entry = tree_cache.put(key, **entry)
+        
+        print("Phylogenetic tree generated successfully!")
+        return tree_ref(key, 'muscle'), entry
+        
+    except JobCancelled:
+        raise
+    except Exception as e:
+        print(f"Error generating phylogenetic tree: {e}")
+        import traceback
+        traceback.print_exc()
+        inc('gf_tree_fallbacks_total', source='muscle', target='progressive', reason='error')
+        return generate_progressive_tree(sequences, progress=progress, cluster=cluster)
+
+
+def get_muscle_executor():
+    """The process-wide MUSCLE executor, or None when no usable binary is found"""
+    global _muscle_executor
+    if _muscle_executor is None:
+        path = find_muscle(MUSCLE_PATH)
+        if path is None:
+            return None
+        _muscle_executor = MuscleExecutor(path, max_parallel=MUSCLE_MAX_PARALLEL, threads=MUSCLE_THREADS)
+    return _muscle_executor
+
+
+def build_muscle_tree(sequences, progress=None, timeout=None):
+    """Aligns with MUSCLE and builds the NJ tree, returns a cache entry or None if MUSCLE can't be used"""
+    executor = get_muscle_executor()
+    if executor is None:
+        print(f"ERROR: MUSCLE not found (looked at GF_MUSCLE_PATH, {MUSCLE_PATH} and PATH)")
+        return None
+    
+    valid_sequences = valid_alignment_input(sequences)
+    if valid_sequences is None:
+        return None
+    
+    _report(progress, 0.15, f"Running MUSCLE on {len(valid_sequences)} sequences...")
+    timeout = MUSCLE_TIMEOUT if timeout is None else min(timeout, MUSCLE_TIMEOUT)
+    # While MUSCLE runs, keep pinging the job so a cancel kills it right away
+    check = (lambda: progress(0.15, "Running MUSCLE...")) if progress is not None else None
+    try:
+        with timed('muscle', *input_size(valid_sequences)):
+            alignment = executor.align([(s['title'], s['sequence']) for s in valid_sequences],
+                                       timeout=timeout, check=check)
+    except AlignerError as e:
+        print(f"ERROR: {e}")
+        return None
+    print(f"Alignment read: {len(alignment)} sequences")
+    return alignment_entry(valid_sequences, alignment, progress, method='muscle')
+
+
+def valid_alignment_input(sequences):
+    """Non-empty sequences, upper-cased, with Newick-safe titles; None if fewer than 2 are left"""
+    valid_sequences = []
+    for i, seq_data in enumerate(sequences):
+        sequence = seq_data['sequence'].upper().strip()
+        title = seq_data['title'].strip()
+        
+        # Validate sequence is not empty
+        if not sequence:
+            print(f"WARNING: Sequence '{title}' is empty, skipping...")
+            continue
+            
+        valid_sequences.append({'title': newick_title(title, i), 'original_title': seq_data['title'], 'sequence': sequence})
+    
+    if len(valid_sequences) < 2:
+        print("ERROR: At least 2 valid sequences are required")
+        return None
+    return valid_sequences
+
+
+def alignment_entry(valid_sequences, alignment, progress=None, method='muscle'):
+    """Identity distances and the tree over an alignment's rows, as a cache entry"""
+    # Calculate distances and tree
+    _report(progress, 0.6, "Calculating distances...")
+    # Vectorized equivalent of DistanceCalculator('identity') on the aligned rows
+    rows = [str(record.seq) for record in alignment]
+    with timed('distances', len(rows), len(rows) * alignment.get_alignment_length()):
+        condensed = pairwise_distances(rows, 'identity', processes=DISTANCE_PROCESSES)
+    _report(progress, 0.75, f"Building {TREE_METHOD.upper()} tree...")
+    with timed('tree', len(rows)):
+        tree = build_tree([record.id for record in alignment], condensed, TREE_METHOD)
+    
+    return {
+        'names': [seq_data['original_title'] for seq_data in valid_sequences],
+        'condensed': condensed,
+        'aligned_fasta': format(alignment, 'fasta'),
+        'newick': tree_to_newick(tree),
+        'info': {'method': method, 'tips': [record.id for record in alignment]},
+    }
+
+
+def generate_progressive_tree(sequences, progress=None, cluster=None):
+    """Tree over the built-in progressive alignment (no MUSCLE), falls back to the simple tree"""
+    try:
+        _report(progress, 0.05, "Starting built-in progressive alignment...")
+        key = cache_key(sequences, **_params(PROGRESSIVE_PARAMS, cluster))
+        entry = tree_cache.get(key)
+        if entry is not None:
+            print(f"Cache hit for {key[:12]}")
+        else:
+            entry = build_reduced(build_progressive_tree, sequences, cluster, progress=progress)
+            if entry is None:
+                inc('gf_tree_fallbacks_total', source='progressive', target='simple', reason='unavailable')
+                return generate_simple_phylogenetic_tree(sequences, progress=progress, cluster=cluster)
+            entry = tree_cache.put(key, **entry)
+        
+        print("Progressive alignment tree generated successfully!")
+        return tree_ref(key, 'muscle'), entry
+        
+    except JobCancelled:
+        raise
+    except Exception as e:
+        print(f"Error in progressive alignment tree: {e}")
+        import traceback
+        traceback.print_exc()
+        inc('gf_tree_fallbacks_total', source='progressive', target='simple', reason='error')
+        return generate_simple_phylogenetic_tree(sequences, progress=progress, cluster=cluster)
+
+
+def build_progressive_tree(sequences, progress=None):
+    """Aligns with the built-in center-star aligner and builds the tree, returns a cache entry or None"""
+    valid_sequences = valid_alignment_input(sequences)
+    if valid_sequences is None:
+        return None
+    
+    _report(progress, 0.15, f"Aligning {len(valid_sequences)} sequences (built-in progressive aligner)...")
+    # Pairwise stage reports between 0.15 and 0.55
+    step = (lambda fraction, message: progress(0.15 + 0.4 * fraction, message)) if progress is not None else None
+    with timed('progressive_align', *input_size(valid_sequences)):
+        alignment = progressive_align([(s['title'], s['sequence']) for s in valid_sequences],
+                                      processes=ALIGN_PROCESSES, progress=step)
+    print(f"Alignment built: {len(alignment)} sequences, {alignment.get_alignment_length()} columns")
+    return alignment_entry(valid_sequences, alignment, progress, method='progressive')
+
+
+def newick_title(title, i):
+    """Title cleaned so it survives Newick (and MUSCLE), Seq_<i+1> if nothing is left"""
+    clean_title = title.strip().replace(' ', '_').replace('|', '_').replace(':', '_').replace(';', '_')
+    return clean_title or f"Seq_{i+1}"
+
+
+def tree_to_newick(tree):
+    """Serializes a Bio.Phylo tree to a Newick string"""
+    return to_newick(tree)
+
+
+def tree_from_newick(newick):
+    """Parses a Newick string back into a Bio.Phylo tree"""
+    return Phylo.read(StringIO(newick), 'newick')
+
+
+def generate_sketch_tree(sequences, progress=None, cluster=None):
+    """Alignment-free tree from Mash distances between k-mer sketches, falls back to the simple tree"""
+    try:
+        _report(progress, 0.1, f"Sketching {len(sequences)} sequences (k={SKETCH_K}, {SKETCH_SIZE} hashes)...")
+        
+        key = cache_key(sequences, **_params(SKETCH_PARAMS, cluster))
+        entry = tree_cache.get(key)
+        if entry is not None:
+            print(f"Cache hit for {key[:12]}")
+        else:
+            entry = tree_cache.put(key, **build_reduced(build_sketch_tree, sequences, cluster,
+                                                         progress=progress))
+        
+        print("Sketch phylogenetic tree generated successfully!")
+        return tree_ref(key, 'muscle'), entry
+        
+    except JobCancelled:
+        raise
+    except Exception as e:
+        print(f"Error in sketch phylogenetic tree: {e}")
+        import traceback
+        traceback.print_exc()
+        inc('gf_tree_fallbacks_total', source='sketch', target='simple', reason='error')
+        return generate_simple_phylogenetic_tree(sequences, progress=progress, cluster=cluster)
+
+
+def build_sketch_tree(sequences, progress=None):
+    """Mash distances from MinHash sketches plus a tree, returns a cache entry"""
+    with timed('sketch_distances', *input_size(sequences)):
+        condensed = sketch_distances([seq['sequence'] for seq in sequences], k=SKETCH_K, size=SKETCH_SIZE,
+                                     processes=DISTANCE_PROCESSES)
+    _report(progress, 0.6, f"Building {TREE_METHOD.upper()} tree...")
+    titles = [newick_title(seq['title'], i) for i, seq in enumerate(sequences)]
+    with timed('tree', len(titles)):
+        tree = build_tree(titles, condensed, TREE_METHOD)
+    return {
+        'names': [seq['title'] for seq in sequences],
+        'condensed': condensed,
+        'newick': tree_to_newick(tree),
+        'info': {'method': 'sketch', 'tips': titles},
+    }
+
+
+def generate_simple_phylogenetic_tree(sequences, progress=None, cluster=None):
+    """Generates a simple phylogenetic tree without MUSCLE using Hamming distances"""
+    try:
+        _report(progress, 0.2, "Generating simple phylogenetic tree...")
+        
+        key = cache_key(sequences, **_params(SIMPLE_PARAMS, cluster))
+        entry = tree_cache.get(key)
+        if entry is not None:
+            print(f"Cache hit for {key[:12]}")
+        else:
+            entry = tree_cache.put(key, **build_reduced(build_simple_tree, sequences, cluster))
+        
+        print("Simple phylogenetic tree generated successfully!")
+        return tree_ref(key, 'simple'), entry
+        
+    except JobCancelled:
+        raise
+    except Exception as e:
+        print(f"Error in simple phylogenetic tree: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def build_simple_tree(sequences):
+    """Hamming distances plus an NJ tree over the right-padded sequences, returns a cache entry"""
+    seq_names = [seq['title'] for seq in sequences]
+    raw = [seq['sequence'] for seq in sequences]
+    
+    with timed('hamming_distances', *input_size(sequences)):
+        # Hamming distances with the length penalty, for the calculator
+        condensed = pairwise_distances(raw, 'hamming', processes=DISTANCE_PROCESSES)
+        
+        # Identity distances over the sequences right-padded with '-' (no real alignment) for the tree
+        identity = pairwise_distances(raw, 'identity', processes=DISTANCE_PROCESSES)
+    clean_titles = [title.replace(' ', '_').replace('|', '_') for title in seq_names]
+    with timed('tree', len(clean_titles)):
+        tree = build_tree(clean_titles, identity, TREE_METHOD)
+    
+    return {
+        'names': seq_names,
+        'condensed': condensed,
+        'newick': tree_to_newick(tree),
+        'info': {'method': 'simple', 'tips': clean_titles},
+    }
+
+
+
+# Growing a cached tree when sequences are added to a dataset
+
+def extension_key(base_key, added):
+    """Cache key of the tree grown from the one under base_key by the added sequences"""
+    return cache_key(added, base=base_key, extend=True)
+
+
+def cached_extension(base_key, added):
+    """tree_ref of an already grown tree, or None"""
+    key = extension_key(base_key, added)
+    entry = tree_cache.get(key)
+    if entry is None:
+        return None
+    return tree_ref(key, 'simple' if entry['info'].get('method') == 'simple' else 'muscle')
+
+
+def run_extend_job(sequences, added, base_key=None, progress=None, timeout=None, method='alignment', cluster=None):
+    """Job entry point for sequences whose last `added` ones are new: the tree cached under
+    base_key grown by them (extend_entry), or a full build when that tree can't be grown"""
+    old, new = sequences[:len(sequences) - added], sequences[len(sequences) - added:]
+    base = tree_cache.get(base_key) if base_key else None
+    if base is None or 'tips' not in base['info'] or base['names'] != [s['title'] for s in old]:
+        print("No tree to extend for these sequences, building it from scratch")
+        inc('gf_tree_fallbacks_total', source='incremental', target='full', reason='unavailable')
+        return run_phylogeny_job(sequences, progress=progress, timeout=timeout, method=method, cluster=cluster)
+    try:
+        key = extension_key(base_key, new)
+        if tree_cache.get(key) is None:
+            tree_cache.put(key, **extend_entry(base, old, new, progress))
+        print("Phylogenetic tree extended successfully!")
+        return {'tree': tree_ref(key, 'simple' if base['info']['method'] == 'simple' else 'muscle')}
+    except JobCancelled:
+        raise
+    except Exception as e:
+        print(f"Error extending phylogenetic tree: {e}")
+        import traceback
+        traceback.print_exc()
+        inc('gf_tree_fallbacks_total', source='incremental', target='full', reason='error')
+        return run_phylogeny_job(sequences, progress=progress, timeout=timeout, method=method, cluster=cluster)
+
+
+def extend_entry(entry, old, new, progress=None):
+    """Cache entry for old + new sequences grown from the entry of the old ones.
+
+    Only the new sequences are aligned (to the existing alignment's profile, see
+    progressive.extend_alignment) and compared (new x all distances), so adding k
+    sequences to n costs about k * n. Each new sequence is inserted into the tree
+    next to its nearest tip with neighbour-joining's branch lengths for that pair;
+    once more than TREE_REBUILD_FRACTION of the tips were inserted this way the
+    tree is rebuilt from the updated distances instead.
+    """
+    info = entry['info']
+    n_old, n_new = len(old), len(new)
+    tips = list(info['tips'])
+    # New tips get Newick-safe, unique labels; empty sequences get none (1 from everything)
+    taken = set(tips)
+    labels = []
+    for i, seq_data in enumerate(new):
+        label = newick_title(seq_data['title'], n_old + i)
+        if label in taken:
+            label = f"{label}_{n_old + i + 1}"
+        taken.add(label)
+        labels.append(label if normalize(seq_data['sequence']) else '')
+    present = [i for i, label in enumerate(labels) if label]
+    _report(progress, 0.1, f"Adding {n_new} sequences to a tree of {n_old}...")
+
+    condensed = entry['condensed']
+    aligned_fasta = entry['aligned_fasta']
+    cross = np.ones((n_new, n_old))
+    within = np.ones((n_new, n_new))
+    if aligned_fasta and present:
+        records = list(AlignIO.read(StringIO(aligned_fasta), 'fasta'))
+        step = (lambda fraction, message: progress(0.1 + 0.5 * fraction, message)) if progress is not None else None
+        added = [new[i] for i in present]
+        with timed('extend_align', *input_size(added)):
+            rows, added_rows = extend_alignment([str(record.seq) for record in records],
+                                                [s['sequence'] for s in added], processes=ALIGN_PROCESSES,
+                                                progress=step)
+        # Identity over the longer alignment: old pairs keep their mismatches, the columns grew
+        condensed = condensed * (len(records[0].seq) / len(rows[0]))
+        _report(progress, 0.6, "Calculating distances to the new sequences...")
+        with timed('extend_distances', len(rows) + len(added_rows), len(added_rows) * len(rows[0])):
+            square = query_distances(added_rows + rows, range(len(added_rows)), 'identity')
+        row_of = {}
+        for r, record in enumerate(records):
+            row_of.setdefault(record.id, r)
+        columns = np.array([row_of.get(tip, -1) for tip in tips], dtype=np.intp)
+        has_row = np.flatnonzero(columns >= 0)
+        cross[np.ix_(present, has_row)] = square[:, len(added_rows) + columns[has_row]]
+        within[np.ix_(present, present)] = square[:, :len(added_rows)]
+        alignment = MultipleSeqAlignment(
+            [SeqRecord(Seq(row), id=record.id, description='') for record, row in zip(records, rows)]
+            + [SeqRecord(Seq(row), id=labels[i], description='') for i, row in zip(present, added_rows)])
+        aligned_fasta = format(alignment, 'fasta')
+    elif not aligned_fasta:
+        # New sequences first, so they are the query rows
+        raw = [s['sequence'] for s in new] + [s['sequence'] for s in old]
+        _report(progress, 0.4, "Calculating distances to the new sequences...")
+        with timed('extend_distances', *input_size(new + old)):
+            if info['method'] == 'sketch':
+                square = sketch_query_distances(raw, range(n_new), k=SKETCH_K, size=SKETCH_SIZE)
+            else:
+                square = query_distances(raw, range(n_new), 'hamming')
+        within, cross = square[:, :n_new], square[:, n_new:]
+    np.fill_diagonal(within, 0.0)
+    full = append_condensed(condensed, cross, within)
+
+    all_tips = tips + labels
+    inserted = info.get('inserted', 0) + len(present)
+    unique_tips = {}
+    for index, tip in enumerate(all_tips):
+        if tip:
+            unique_tips.setdefault(tip, index)
+    _report(progress, 0.8, "Updating the tree...")
+    with timed('extend_tree', len(unique_tips)):
+        if inserted > TREE_REBUILD_FRACTION * len(unique_tips):
+            print(f"{inserted} of {len(unique_tips)} tips were inserted, rebuilding the tree")
+            keep = np.fromiter(unique_tips.values(), dtype=np.intp, count=len(unique_tips))
+            tree = build_tree(list(unique_tips), condensed_to_square(full)[np.ix_(keep, keep)], TREE_METHOD)
+            inserted = 0
+        else:
+            tree = insert_tips(tree_from_newick(entry['newick']),
+                               _placements(condensed, cross, within, tips, labels, present))
+    return {
+        'names': entry['names'] + [s['title'] for s in new],
+        'condensed': full,
+        'aligned_fasta': aligned_fasta,
+        'newick': tree_to_newick(tree),
+        'info': dict(info, tips=all_tips, inserted=inserted),
+    }
+
+
+def _placements(condensed, cross, within, tips, labels, present):
+    """insert_tips placements: each new sequence next to its nearest tip (old, or new and placed
+    before it), split off with NJ's branch length as if the two were the first pair joined"""
+    n_old = cross.shape[1]
+    old_tips = np.array([bool(tip) for tip in tips])
+    placements = []
+    for a, i in enumerate(present):
+        earlier = present[:a]
+        old_distances = np.where(old_tips, cross[i], np.inf)
+        j = int(np.argmin(old_distances))
+        sum_new = cross[i].sum() + within[i, earlier].sum()
+        if earlier and within[i, earlier].min() < old_distances[j]:
+            e = earlier[int(np.argmin(within[i, earlier]))]
+            sibling, distance = labels[e], within[i, e]
+            sum_sibling = cross[e].sum() + within[e, earlier].sum()
+        else:
+            sibling, distance = tips[j], old_distances[j]
+            sum_sibling = condensed_row(condensed, n_old, j).sum() + cross[earlier, j].sum()
+        # r taxa so far (the new one included): d/2 + (u_sibling - u_new) / (2 (r - 2)) from the sibling
+        r = n_old + a + 1
+        branch = distance / 2 + (sum_sibling - sum_new) / (2 * (r - 2))
+        placements.append((labels[i], sibling, float(distance), float(branch)))
+    return placements
@@ -0,0 +1,66 @@
+"""The analysis pipeline without the web layer: statistics, histogram, distances and tree.
+
+/analyze and the batch command line (batch.py) both go through these
+functions. The web app queues the tree as a background job and reads it back
+from the tree cache by key; build_phylogeny builds it inline and returns the
+entry it built, so it never depends on the entry still being in the cache.
+"""
+import numpy as np
+
+from composition import base_counts, percentages
+from ingest import parse_fasta_stream
+from metrics import input_size, timed
+from phylogeny import build_tree_entry
+from settings import MAX_FASTA_BYTES, MAX_FASTA_RECORDS
+
+
+def read_fasta(path, max_records=MAX_FASTA_RECORDS, max_bytes=MAX_FASTA_BYTES):
+    """Records (title, sequence, length, gc, bases) of a plain or gzip/BGZF FASTA file"""
+    with open(path, 'rb') as f, timed('parse') as size:
+        sequences = list(parse_fasta_stream(f, max_records=max_records, max_bytes=max_bytes))
+        size['sequences'], size['bases'] = input_size(sequences)
+    return sequences
+
+
+def sequence_statistics(sequences):
+    """Per-sequence stats without the sequences themselves"""
+    return [{key: s[key] for key in ('title', 'length', 'gc', 'bases')} for s in sequences]
+
+
+def global_statistics(sequences):
+    """Totals, average GC and base percentages over all sequences"""
+    counts = base_counts(sequences)
+    return {
+        'total_sequences': len(sequences),
+        'total_bases': sum(s['length'] for s in sequences),
+        'avg_gc': float(np.mean([s['gc'] for s in sequences])) if sequences else 0.0,
+        'base_counts': counts,
+        'base_percentages': percentages(counts),
+    }
+
+
+def extend_global_statistics(global_stats, added):
+    """global_statistics of a dataset plus the added sequences, from its totals and the added
+    sequences only"""
+    more = global_statistics(added)
+    n = global_stats['total_sequences'] + more['total_sequences']
+    counts = {base: global_stats['base_counts'][base] + count for base, count in more['base_counts'].items()}
+    return {
+        'total_sequences': n,
+        'total_bases': global_stats['total_bases'] + more['total_bases'],
+        'avg_gc': (global_stats['avg_gc'] * global_stats['total_sequences']
+                   + more['avg_gc'] * more['total_sequences']) / n if n else 0.0,
+        'base_counts': counts,
+        'base_percentages': percentages(counts),
+    }
+
+
+def build_phylogeny(sequences, method='alignment', cluster=None, timeout=None, progress=None):
+    """Builds the tree in this process and returns its cache entry (names, condensed, newick,
+    aligned_fasta) plus key and style, or None with fewer than two sequences"""
+    if len(sequences) < 2:
+        return None
+    job_sequences = [{'title': s['title'], 'sequence': s['sequence']} for s in sequences]
+    tree, entry = build_tree_entry(job_sequences, progress=progress, timeout=timeout, method=method,
+                                   cluster=cluster)
+    return dict(entry, key=tree['key'], style=tree['style'])
@@ -0,0 +1,308 @@
+"""Built-in multiple aligner, for when MUSCLE is missing, fails or is too slow.
+
+Center-star progressive alignment in three stages:
+
+  guide     Mash distances between k-mer sketches (sketch.py) of every
+            sequence; the sequence closest to all the others is the center
+  pairwise  every other sequence is aligned to the center with
+            Bio.Align.PairwiseAligner, banded around a chain of shared unique
+            k-mers: the anchors are copied as exact matches and only the
+            stretches between them go through dynamic programming, so similar
+            sequences cost about their length instead of the product of their
+            lengths. These alignments are independent and run in a process
+            pool when processes > 1.
+  merge     the pairwise alignments are combined column by column ("once a
+            gap, always a gap"): insertions relative to the center get as many
+            columns as the longest insertion at that point.
+
+End gaps are free, so reads that only cover part of the center are not
+penalised for it.
+
+extend_alignment adds sequences to an existing alignment the same way, with
+the alignment's consensus as the center.
+"""
+from bisect import bisect_left
+
+import numpy as np
+from Bio.Align import MultipleSeqAlignment, PairwiseAligner
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from alignment_profile import SYMBOLS, AlignmentProfile
+from distances import condensed_to_square
+from sketch import sketch_distances
+
+# Anchor k-mer length (2 bits per base, must fit in 64 bits)
+ANCHOR_K = 15
+# Guide sketches: shorter k-mers and fewer hashes than the sketch distance mode
+GUIDE_K = 15
+GUIDE_SIZE = 256
+# Nucleotide scores (BLASTN-like)
+MATCH, MISMATCH, OPEN_GAP, EXTEND_GAP = 2, -3, -5, -2
+# Sequences handed to each pool worker at a time
+CHUNK = 8
+
+_aligners = None
+
+
+def _build_lut():
+    """Byte -> 2-bit base code, 4 for anything else"""
+    lut = np.full(256, 4, dtype=np.uint8)
+    for code, bases in enumerate(('Aa', 'Cc', 'Gg', 'TtUu')):
+        for base in bases:
+            lut[ord(base)] = code
+    return lut
+
+
+_LUT = _build_lut()
+
+
+def _get_aligners():
+    """Global aligners for the stretches between anchors: inner (no free end gaps), leading
+    (free on the left), trailing (free on the right) and whole (free on both ends)"""
+    global _aligners
+    if _aligners is None:
+        _aligners = {}
+        for name in ('inner', 'leading', 'trailing', 'whole'):
+            aligner = PairwiseAligner(mode='global', match_score=MATCH, mismatch_score=MISMATCH,
+                                      open_gap_score=OPEN_GAP, extend_gap_score=EXTEND_GAP)
+            if name in ('leading', 'whole'):
+                aligner.left_gap_score = 0
+            if name in ('trailing', 'whole'):
+                aligner.right_gap_score = 0
+            _aligners[name] = aligner
+    return _aligners
+
+
+def unique_kmers(sequence, k=ANCHOR_K):
+    """(k-mer codes, start positions) of the k-mers occurring exactly once, skipping non-ACGT"""
+    codes = _LUT[np.frombuffer(sequence.encode('ascii', 'replace'), dtype=np.uint8)]
+    m = len(codes) - k + 1
+    if m <= 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.intp)
+    invalid = np.concatenate(([0], np.cumsum(codes > 3)))
+    bases = np.where(codes > 3, 0, codes).astype(np.uint64)
+    kmers = np.zeros(m, dtype=np.uint64)
+    for t in range(k):
+        kmers <<= np.uint64(2)
+        kmers |= bases[t:t + m]
+    positions = np.flatnonzero(invalid[k:] == invalid[:-k])
+    values, first, counts = np.unique(kmers[positions], return_index=True, return_counts=True)
+    once = counts == 1
+    return values[once], positions[first[once]]
+
+
+def anchor_blocks(center_kmers, sequence, k=ANCHOR_K):
+    """Co-linear exact-match blocks [(center_start, seq_start, length)] between the center and
+    a sequence, from the longest increasing chain of their shared unique k-mers"""
+    values, center_positions = center_kmers
+    seq_values, seq_positions = unique_kmers(sequence, k)
+    _, in_center, in_seq = np.intersect1d(values, seq_values, assume_unique=True, return_indices=True)
+    if not len(in_center):
+        return []
+    order = np.argsort(center_positions[in_center])
+    pc = center_positions[in_center][order].tolist()
+    ps = seq_positions[in_seq][order].tolist()
+
+    # Longest strictly increasing subsequence of seq positions (patience sorting)
+    tails, tail_index, previous = [], [], [-1] * len(ps)
+    for i, p in enumerate(ps):
+        slot = bisect_left(tails, p)
+        if slot == len(tails):
+            tails.append(p)
+            tail_index.append(i)
+        else:
+            tails[slot] = p
+            tail_index[slot] = i
+        previous[i] = tail_index[slot - 1] if slot else -1
+    chain = []
+    i = tail_index[-1] if tail_index else -1
+    while i >= 0:
+        chain.append(i)
+        i = previous[i]
+    chain.reverse()
+
+    # Same-diagonal anchors merge into one block, overlapping ones on another diagonal are dropped
+    blocks = []
+    for i in chain:
+        c, s = pc[i], ps[i]
+        if blocks:
+            bc, bs, length = blocks[-1]
+            if c - s == bc - bs and c <= bc + length:
+                blocks[-1][2] = c + k - bc
+                continue
+            if c < bc + length or s < bs + length:
+                continue
+        blocks.append([c, s, k])
+    return blocks
+
+
+def _align_segment(aligner, target, query):
+    """Gapped (target, query) strings of the best global alignment of two stretches"""
+    if not target or not query:
+        return target + '-' * len(query), '-' * len(target) + query
+    alignment = aligner.align(target, query)[0]
+    coordinates = alignment.coordinates
+    target_row, query_row = [], []
+    for step in range(coordinates.shape[1] - 1):
+        t0, t1 = coordinates[0, step], coordinates[0, step + 1]
+        q0, q1 = coordinates[1, step], coordinates[1, step + 1]
+        if t1 > t0 and q1 > q0:
+            target_row.append(target[t0:t1])
+            query_row.append(query[q0:q1])
+        elif t1 > t0:
+            target_row.append(target[t0:t1])
+            query_row.append('-' * (t1 - t0))
+        else:
+            target_row.append('-' * (q1 - q0))
+            query_row.append(query[q0:q1])
+    return ''.join(target_row), ''.join(query_row)
+
+
+def align_to_center(center, center_kmers, sequence):
+    """Gapped (center, sequence) pair: anchors copied as matches, DP only between them"""
+    aligners = _get_aligners()
+    blocks = anchor_blocks(center_kmers, sequence)
+    if not blocks:
+        return _align_segment(aligners['whole'], center, sequence)
+    center_row, seq_row = [], []
+    c_end = s_end = 0
+    for i, (c, s, length) in enumerate(blocks):
+        aligner = aligners['leading'] if i == 0 else aligners['inner']
+        gapped = _align_segment(aligner, center[c_end:c], sequence[s_end:s])
+        center_row.append(gapped[0])
+        seq_row.append(gapped[1])
+        center_row.append(center[c:c + length])
+        seq_row.append(sequence[s:s + length])
+        c_end, s_end = c + length, s + length
+    gapped = _align_segment(aligners['trailing'], center[c_end:], sequence[s_end:])
+    center_row.append(gapped[0])
+    seq_row.append(gapped[1])
+    return ''.join(center_row), ''.join(seq_row)
+
+
+def merge_star(center, pairs):
+    """Rows of the multiple alignment from (gapped center, gapped sequence) pairs, center first"""
+    n_center = len(center)
+    parsed = []
+    for center_row, seq_row in pairs:
+        c = np.frombuffer(center_row.encode('ascii', 'replace'), dtype=np.uint8)
+        s = np.frombuffer(seq_row.encode('ascii', 'replace'), dtype=np.uint8)
+        residue = c != ord('-')
+        # Slot of each column: center residues before it (insertions sit before residue `slot`)
+        slot = np.cumsum(residue) - residue
+        inserted = ~residue
+        counts = np.bincount(slot[inserted], minlength=n_center + 1)
+        parsed.append((s, residue, slot, inserted, counts))
+
+    widths = np.max([p[4] for p in parsed], axis=0) if parsed else np.zeros(n_center + 1, dtype=np.int64)
+    # Column where the insertion block before center residue p starts, and where residue p sits
+    block_start = np.arange(n_center + 1) + np.concatenate(([0], np.cumsum(widths)[:-1]))
+    residue_column = (block_start + widths)[:n_center]
+    total = n_center + int(widths.sum())
+
+    rows = []
+    center_out = np.full(total, ord('-'), dtype=np.uint8)
+    center_out[residue_column] = np.frombuffer(center.encode('ascii', 'replace'), dtype=np.uint8)
+    rows.append(center_out.tobytes().decode('ascii'))
+    for s, residue, slot, inserted, counts in parsed:
+        out = np.full(total, ord('-'), dtype=np.uint8)
+        out[residue_column] = s[residue]
+        # k-th inserted column of a slot goes to block_start + k
+        ins_slots = slot[inserted]
+        rank = np.arange(len(ins_slots)) - np.repeat(np.cumsum(counts) - counts, counts)
+        out[block_start[ins_slots] + rank] = s[inserted]
+        rows.append(out.tobytes().decode('ascii'))
+    return rows
+
+
+def choose_center(sequences):
+    """Index of the sequence with the smallest total k-mer (Mash) distance to all the others"""
+    if len(sequences) < 3:
+        return int(np.argmax([len(s) for s in sequences]))
+    square = condensed_to_square(sketch_distances(sequences, k=GUIDE_K, size=GUIDE_SIZE))
+    return int(np.argmin(square.sum(axis=1)))
+
+
+# Worker-side center, set once per pool process
+_worker_center = None
+
+
+def _init_align_worker(center):
+    global _worker_center
+    _worker_center = (center, unique_kmers(center))
+
+
+def _worker_align(sequence):
+    center, center_kmers = _worker_center
+    return align_to_center(center, center_kmers, sequence)
+
+
+def _align_all(center, sequences, processes=None, progress=None):
+    """(gapped center, gapped sequence) pairs of every sequence against the center, in order"""
+    pairs = []
+    def report(done):
+        if progress is not None:
+            progress(done / len(sequences), f"Aligned {done}/{len(sequences)} sequences to the center")
+
+    if processes and processes > 1 and len(sequences) > CHUNK:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_align_worker,
+                                 initargs=(center,)) as pool:
+            for pair in pool.map(_worker_align, sequences, chunksize=CHUNK):
+                pairs.append(pair)
+                if len(pairs) % CHUNK == 0:
+                    report(len(pairs))
+    else:
+        center_kmers = unique_kmers(center)
+        for sequence in sequences:
+            pairs.append(align_to_center(center, center_kmers, sequence))
+            if len(pairs) % CHUNK == 0:
+                report(len(pairs))
+    return pairs
+
+
+def align(sequences, processes=None, progress=None):
+    """Aligns [(id, sequence), ...] and returns a MultipleSeqAlignment in input order.
+
+    progress(fraction, message) is called as pairwise alignments finish; if it raises
+    (a cancelled job) the alignment stops.
+    """
+    if len(sequences) < 2:
+        raise ValueError("At least 2 sequences are required")
+    raw = [''.join(sequence.split()).upper() for _, sequence in sequences]
+    center_index = choose_center(raw)
+    center = raw[center_index]
+    others = [i for i in range(len(raw)) if i != center_index]
+
+    pairs = _align_all(center, [raw[i] for i in others], processes, progress)
+    rows = merge_star(center, pairs)
+    # rows[0] is the center, the others follow in `others` order
+    ordered = [None] * len(raw)
+    ordered[center_index] = rows[0]
+    for i, row in zip(others, rows[1:]):
+        ordered[i] = row
+    return MultipleSeqAlignment([SeqRecord(Seq(row), id=title, name=title, description='')
+                                 for (title, _), row in zip(sequences, ordered)])
+
+
+def profile_consensus(rows):
+    """One residue per column of an alignment: its most common one, N where it has none"""
+    profile = AlignmentProfile.from_rows(range(len(rows)), rows)
+    symbols = np.frombuffer(SYMBOLS.replace('-', 'N').encode('ascii'), dtype=np.uint8)
+    return symbols[profile.consensus_codes].tobytes().decode('ascii')
+
+
+def extend_alignment(rows, sequences, processes=None, progress=None):
+    """Adds sequences to an existing alignment without realigning it.
+
+    Each sequence is aligned to the alignment's consensus the way the others are
+    aligned to the center, and the merge treats every existing row as already
+    aligned to that consensus: columns a new sequence inserts become gap
+    columns in the existing rows. Returns (existing rows, new rows).
+    """
+    consensus = profile_consensus(rows)
+    raw = [''.join(sequence.split()).upper() for sequence in sequences]
+    pairs = _align_all(consensus, raw, processes, progress)
+    merged = merge_star(consensus, [(consensus, row) for row in rows] + pairs)
+    return merged[1:len(rows) + 1], merged[len(rows) + 1:]
@@ -0,0 +1,381 @@
+"""Plot data and PNG rendering without pyplot.
+
+The results page no longer embeds base64 PNGs: the histogram and the trees
+are served from their own URLs (plus JSON with the underlying data so the
+browser can draw them itself). Figures are built with the object-oriented
+matplotlib API (a Figure on an Agg canvas), so there is no global pyplot
+state and renders can run from several request threads at once. Rendered
+PNGs are kept in a byte-bounded LRU keyed by the hash of their inputs, which
+also serves as the HTTP ETag.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.figure import Figure
+
+import metrics
+
+HISTOGRAM_BINS = 15
+# Points on the KDE curve, and fine bins the lengths are reduced to before smoothing
+KDE_POINTS = 200
+KDE_GRID = 2048
+# Bumped whenever the drawing code changes, so cached PNGs and ETags are not reused
+RENDER_VERSION = 1
+TREE_STYLES = ('muscle', 'simple')
+
+_GRADIENT = LinearSegmentedColormap.from_list('custom', ['#1a1a1a', '#2a2a2a', '#1e1e1e'], N=100)
+
+
+def data_key(values):
+    """SHA-256 of an integer array, the key of plots that only depend on it"""
+    return hashlib.sha256(np.ascontiguousarray(values, dtype=np.int64).tobytes()).hexdigest()
+
+
+def kde_curve(values, low, high, scale=1.0, points=KDE_POINTS):
+    """Gaussian KDE (Scott's bandwidth) on [low, high], multiplied by scale, or None when
+    the values have no spread. Values are binned on a fine grid first so the cost doesn't
+    grow with the number of sequences."""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 2 or not values.std() > 0:
+        return None
+    bandwidth = values.std(ddof=1) * len(values) ** (-1 / 5)
+    weights, edges = np.histogram(values, bins=KDE_GRID)
+    centers = (edges[:-1] + edges[1:]) / 2
+    centers, weights = centers[weights > 0], weights[weights > 0]
+    x = np.linspace(low, high, points)
+    z = (x[:, None] - centers[None, :]) / bandwidth
+    density = (np.exp(-0.5 * z * z) @ weights) / (len(values) * bandwidth * np.sqrt(2 * np.pi))
+    return {'x': x.tolist(), 'y': (density * scale).tolist()}
+
+
+def histogram_data(lengths, bins=HISTOGRAM_BINS):
+    """Bins, counts, mean and KDE curve (scaled to counts) of the sequence lengths"""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if not len(lengths):
+        return {'edges': [], 'counts': [], 'mean': None, 'kde': None}
+    counts, edges = np.histogram(lengths, bins=bins)
+    width = edges[1] - edges[0]
+    return {
+        'edges': edges.tolist(),
+        'counts': counts.tolist(),
+        'mean': float(lengths.mean()),
+        'kde': kde_curve(lengths, edges[0], edges[-1], scale=len(lengths) * width),
+    }
+
+
+def _image(fig, fmt='png', **kwargs):
+    """PNG (or `fmt`, e.g. 'svg') bytes of a Figure, drawn on its own Agg canvas"""
+    FigureCanvasAgg(fig)
+    buffer = BytesIO()
+    fig.savefig(buffer, format=fmt, bbox_inches='tight', dpi=100, **kwargs)
+    return buffer.getvalue()
+
+
+def render_histogram(data, fmt='png'):
+    """Length histogram with KDE and mean line, white on transparent, as PNG (or fmt) bytes"""
+    fig = Figure(figsize=(8, 4), facecolor='none')
+    ax = fig.add_subplot()
+    ax.set_facecolor('none')
+    edges, counts = np.asarray(data['edges']), np.asarray(data['counts'])
+    if len(counts):
+        ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge', color='#e63946',
+               alpha=0.75, edgecolor='none')
+    if data['kde']:
+        ax.plot(data['kde']['x'], data['kde']['y'], color='white')
+    ax.grid(False)
+
+    ax.set_title('Sequence Length Distribution', fontsize=14, color='white')
+    ax.set_xlabel('Length (bp)', fontsize=12, color='white')
+    ax.set_ylabel('Number of Sequences', fontsize=12, color='white')
+    ax.tick_params(colors='white')
+
+    if data['mean'] is not None:
+        ax.axvline(data['mean'], color='#2a9d8f', linestyle='dashed', linewidth=2)
+        ax.text(0.98, 0.98, f"Mean: {data['mean']:.0f} bp", color='#2a9d8f', fontsize=12,
+                transform=ax.transAxes, horizontalalignment='right', verticalalignment='top',
+                bbox=dict(facecolor='black', alpha=0.5, edgecolor='none', boxstyle='round,pad=0.3'))
+
+    for spine in ('top', 'right'):
+        ax.spines[spine].set_visible(False)
+    for spine in ('left', 'bottom'):
+        ax.spines[spine].set_color('white')
+        ax.spines[spine].set_linewidth(0.5)
+    return _image(fig, fmt, transparent=True)
+
+
+def _newick_tokens(newick):
+    """Punctuation characters and (label, quoted) pairs of a Newick string"""
+    i, n = 0, len(newick)
+    while i < n:
+        c = newick[i]
+        if c in '(),:;':
+            yield c
+            i += 1
+        elif c.isspace():
+            i += 1
+        elif c == "'":
+            # Quoted label, '' is an escaped quote
+            label = []
+            i += 1
+            while i < n:
+                if newick[i] == "'":
+                    if newick[i + 1:i + 2] == "'":
+                        label.append("'")
+                        i += 2
+                        continue
+                    i += 1
+                    break
+                label.append(newick[i])
+                i += 1
+            yield (''.join(label), True)
+        else:
+            start = i
+            while i < n and newick[i] not in "(),:;'" and not newick[i].isspace():
+                i += 1
+            yield (newick[start:i], False)
+
+
+def tree_layout(newick):
+    """Rectangular layout of a Newick tree, computed without recursion (deep NJ trees are fine).
+
+    Returns {'labels': [(x, y, name)], 'horizontal': [(x0, x1, y)], 'vertical': [(x, y0, y1)]},
+    with tips on rows 1..n from the top as Phylo.draw does and x the distance from the root
+    (unit branch lengths when the tree has none).
+    """
+    # Flat node arrays: parent, branch length, name, children
+    parent, length, name, children = [-1], [0.0], [''], [[]]
+    current = 0
+    expect_length = False
+    for token in _newick_tokens(newick):
+        if token == '(':
+            parent.append(current)
+            length.append(0.0)
+            name.append('')
+            children.append([])
+            children[current].append(len(parent) - 1)
+            current = len(parent) - 1
+        elif token == ',':
+            up = parent[current]
+            parent.append(up)
+            length.append(0.0)
+            name.append('')
+            children.append([])
+            children[up].append(len(parent) - 1)
+            current = len(parent) - 1
+        elif token == ')':
+            current = parent[current]
+        elif token == ':':
+            expect_length = True
+        elif token == ';':
+            break
+        elif expect_length:
+            length[current] = float(token[0])
+            expect_length = False
+        else:
+            name[current] = token[0]
+
+    n = len(parent)
+    # Parents always come before their children, so one forward pass gives the depths
+    lengths = np.array(length)
+    if not lengths[1:].any():
+        lengths[1:] = 1.0
+    depth = np.zeros(n)
+    for node in range(1, n):
+        depth[node] = depth[parent[node]] + lengths[node]
+
+    # Tips top to bottom in preorder, inner nodes midway between their first and last child
+    y = np.zeros(n)
+    row = 0
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        if children[node]:
+            stack.extend(reversed(children[node]))
+        else:
+            row += 1
+            y[node] = row
+    for node in range(n - 1, -1, -1):
+        if children[node]:
+            y[node] = (y[children[node][0]] + y[children[node][-1]]) / 2
+
+    horizontal = [(float(depth[parent[node]]), float(depth[node]), float(y[node])) for node in range(1, n)]
+    vertical = [(float(depth[node]), float(y[children[node][0]]), float(y[children[node][-1]]))
+                for node in range(n) if len(children[node]) > 1]
+    labels = [(float(depth[node]), float(y[node]), name[node]) for node in range(n) if not children[node]]
+    return {'labels': labels, 'horizontal': horizontal, 'vertical': vertical}
+
+
+def render_tree(newick, style='muscle', fmt='png'):
+    """Tree image (PNG unless fmt says otherwise): 'muscle' on the themed gradient background,
+    'simple' white on transparent"""
+    layout = tree_layout(newick)
+    fig = Figure(figsize=(10, 6), facecolor='none' if style == 'simple' else '#1a1a1a')
+    ax = fig.add_subplot()
+    if style == 'simple':
+        color, width, text_kwargs = 'white', 2, {'color': 'white', 'fontsize': 10}
+        ax.set_facecolor('none')
+        ax.set_title('Phylogenetic Tree (Simple Distances)', color='white', fontsize=14, pad=20)
+    else:
+        color, width, text_kwargs = 'black', 1, {}
+        ax.set_title('Phylogenetic Tree', color='white', fontsize=16, fontweight='bold', pad=20)
+
+    ax.add_collection(LineCollection([[(x0, y), (x1, y)] for x0, x1, y in layout['horizontal']],
+                                     colors=color, linewidths=width))
+    ax.add_collection(LineCollection([[(x, y0), (x, y1)] for x, y0, y1 in layout['vertical']],
+                                     colors=color, linewidths=width))
+    # NJ can give negative branch lengths, so the tree may extend left of the root
+    xs = [x for x, _, _ in layout['labels']] + [0.0]
+    xmin, span = min(xs), (max(xs) - min(xs)) or 1.0
+    for x, y, label in layout['labels']:
+        ax.text(x + span * 0.02, y, f" {label}", verticalalignment='center', **text_kwargs)
+    rows = len(layout['labels'])
+    ax.set_xlim(xmin - 0.05 * span, xmin + 1.25 * span)
+    ax.set_ylim(rows + 0.8, 0.2)
+
+    if style != 'simple':
+        ax.imshow(np.vstack([np.linspace(0, 1, 256)] * 2), aspect='auto', cmap=_GRADIENT, alpha=0.8,
+                  extent=[*ax.get_xlim(), *ax.get_ylim()], zorder=0)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    ax.tick_params(left=False, bottom=False, labelleft=False, labelbottom=False)
+
+    if style == 'simple':
+        return _image(fig, fmt, transparent=True)
+    return _image(fig, fmt, facecolor='#1a1a1a', edgecolor='none')
+
+
+class RenderCache:
+    """Byte-bounded LRU of rendered PNGs plus the (small, JSON) plot inputs they are drawn from.
+
+    Plot inputs are also written under `directory` so an image URL keeps working after
+    its data falls out of memory or from another process. Those files are evicted least
+    recently used first once they take more than max_disk_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=32 << 20, max_data=256, max_disk_bytes=64 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_data = max_data
+        self.max_disk_bytes = max_disk_bytes
+        self._images = OrderedDict()
+        self._bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'renders': 0, 'evictions': 0, 'disk_evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def etag(kind, key, variant=''):
+        """Strong validator for a rendered image: its inputs' hash plus the drawing code version"""
+        return hashlib.sha256(f"{kind}:{key}:{variant}:{RENDER_VERSION}".encode()).hexdigest()[:32]
+
+    def image(self, kind, key, render, variant=''):
+        """PNG bytes for (kind, key, variant), calling render() only on a miss"""
+        tag = self.etag(kind, key, variant)
+        with self._lock:
+            png = self._images.get(tag)
+            if png is not None:
+                self._images.move_to_end(tag)
+                self.counters['hits'] += 1
+        if png is not None:
+            metrics.inc('gf_cache_lookups_total', cache='render', result='hit')
+            return png
+        metrics.inc('gf_cache_lookups_total', cache='render', result='miss')
+        with metrics.timed(f'render_{kind}'):
+            png = render()
+        with self._lock:
+            self.counters['renders'] += 1
+            if tag not in self._images and len(png) <= self.max_bytes:
+                self._images[tag] = png
+                self._bytes += len(png)
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._images.popitem(last=False)
+                    self._bytes -= len(evicted)
+                    self.counters['evictions'] += 1
+        return png
+
+    def put_data(self, kind, key, data):
+        """Stores plot inputs (JSON-serialisable) under (kind, key)"""
+        with self._lock:
+            self._data[(kind, key)] = data
+            self._data.move_to_end((kind, key))
+            while len(self._data) > self.max_data:
+                self._data.popitem(last=False)
+        path = os.path.join(self.directory, f"{kind}-{key}.json")
+        if os.path.exists(path):
+            return
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            metrics.inc('gf_cache_write_errors_total', cache='render')
+            metrics.log_event('cache_write_error', cache='render', key=f"{kind}-{key}", error=str(e))
+            return
+        self._evict_disk()
+
+    def get_data(self, kind, key):
+        """Plot inputs stored under (kind, key), or None"""
+        with self._lock:
+            data = self._data.get((kind, key))
+        if data is not None:
+            return data
+        path = os.path.join(self.directory, f"{kind}-{key}.json")
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            os.utime(path)  # mtime doubles as the LRU clock for disk eviction
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._data[(kind, key)] = data
+        return data
+
+    def _evict_disk(self):
+        """Deletes the least recently used plot data files until they fit max_disk_bytes"""
+        files = []
+        try:
+            with os.scandir(self.directory) as it:
+                for item in it:
+                    if item.name.endswith('.json'):
+                        try:
+                            stat = item.stat()
+                        except OSError:
+                            continue
+                        files.append((item.path, stat.st_size, stat.st_mtime))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in files)
+        for path, size, _ in sorted(files, key=lambda f: f[2]):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                with self._lock:
+                    self.counters['disk_evictions'] += 1
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['images'] = len(self._images)
+            stats['bytes'] = self._bytes
+        return stats
@@ -0,0 +1,108 @@
+"""Sorted, filtered pages of a stored dataset's per-sequence statistics.
+
+The results page no longer carries one entry per sequence: it asks for a
+page at a time. Lengths, GC and lower-cased titles are kept as NumPy arrays
+(built once per dataset from its stored stats, see dataset_store.py), so a
+filter is a few vectorized comparisons and a sort is one argsort over the
+matching rows. Titles are ranked once, which turns sorting by title into
+sorting integers.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+SORT_KEYS = ('index', 'title', 'length', 'gc')
+# Rows per page (default and maximum)
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 500
+# Tables kept in memory
+OPEN_TABLES = 16
+
+
+class SequenceTable:
+    """Per-sequence title, length, GC and base counts of a dataset as arrays"""
+
+    def __init__(self, titles, stats):
+        self.titles = list(titles)
+        self.stats = stats
+        self.lengths = np.array([s['length'] for s in stats], dtype=np.int64)
+        self.gc = np.array([s['gc'] for s in stats], dtype=np.float64)
+        self.lower = np.array([t.lower() for t in self.titles], dtype=str)
+        self._title_rank = None
+
+    def __len__(self):
+        return len(self.titles)
+
+    @property
+    def title_rank(self):
+        """Position of each title in case-insensitive alphabetical order"""
+        if self._title_rank is None:
+            rank = np.empty(len(self), dtype=np.int64)
+            rank[np.argsort(self.lower, kind='stable')] = np.arange(len(self))
+            self._title_rank = rank
+        return self._title_rank
+
+    def summary(self):
+        if not len(self):
+            return {'sequences': 0}
+        return {
+            'sequences': len(self),
+            'min_length': int(self.lengths.min()),
+            'max_length': int(self.lengths.max()),
+            'min_gc': float(self.gc.min()),
+            'max_gc': float(self.gc.max()),
+        }
+
+    def select(self, query=None, min_length=None, max_length=None, min_gc=None, max_gc=None):
+        """Indices of the sequences whose title contains `query` (any case) and whose length
+        and GC are within the given bounds, in upload order"""
+        mask = np.ones(len(self), dtype=bool)
+        if query:
+            mask &= np.char.find(self.lower, query.lower()) >= 0
+        if min_length is not None:
+            mask &= self.lengths >= min_length
+        if max_length is not None:
+            mask &= self.lengths <= max_length
+        if min_gc is not None:
+            mask &= self.gc >= min_gc
+        if max_gc is not None:
+            mask &= self.gc <= max_gc
+        return np.flatnonzero(mask)
+
+    def order(self, indices, sort='index', descending=False):
+        """`indices` sorted by a SORT_KEYS column (ties keep upload order)"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key {sort!r}, expected one of {', '.join(SORT_KEYS)}")
+        keys = {'index': indices, 'title': self.title_rank[indices],
+                'length': self.lengths[indices], 'gc': self.gc[indices]}[sort]
+        if descending:
+            # Negated keys instead of a reversed result, so ties still keep upload order
+            keys = -keys
+        return indices[np.argsort(keys, kind='stable')]
+
+    def page(self, offset=0, limit=PAGE_SIZE, sort='index', descending=False, **filters):
+        """(number of matching sequences, [{'index', 'title', 'length', 'gc', 'bases'}] of one page)"""
+        indices = self.order(self.select(**filters), sort, descending)
+        items = [dict(self.stats[i], index=i, title=self.titles[i])
+                 for i in indices[offset:offset + limit].tolist()]
+        return len(indices), items
+
+
+_tables = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_sequence_table(dataset):
+    """The SequenceTable of a dataset, built on first use and kept in a small LRU (datasets never change)"""
+    with _lock:
+        table = _tables.get(dataset.id)
+        if table is not None:
+            _tables.move_to_end(dataset.id)
+            return table
+    table = SequenceTable(dataset.titles, dataset.stats)
+    with _lock:
+        _tables[dataset.id] = table
+        while len(_tables) > OPEN_TABLES:
+            _tables.popitem(last=False)
+    return table
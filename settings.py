@@ -0,0 +1,56 @@
+"""Paths and tunables shared by the web app, the job workers and the helper modules"""
+import os
+
+UPLOAD_FOLDER = 'uploads'
+# Use path relative to app.py
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Default MUSCLE location, GF_MUSCLE_PATH or a `muscle` on PATH are used when this one can't run
+MUSCLE_PATH = os.path.join(BASE_DIR, 'bin', 'muscle.exe')
+# Alignments allowed to run at once per process, and MUSCLE's own -threads option (MUSCLE 5)
+MUSCLE_MAX_PARALLEL = int(os.environ.get('GF_MUSCLE_MAX_PARALLEL', os.cpu_count() or 1))
+MUSCLE_THREADS = int(os.environ.get('GF_MUSCLE_THREADS', 1)) or None
+
+# Worker processes for the pairwise distance engine (1 = compute in the calling process)
+DISTANCE_PROCESSES = int(os.environ.get('GF_DISTANCE_PROCESSES', 1))
+# Worker processes for the pairwise stage of the built-in progressive aligner (1 = in the calling process)
+ALIGN_PROCESSES = int(os.environ.get('GF_ALIGN_PROCESSES', 1))
+# Tree construction method for both tree paths: 'nj' (neighbour-joining) or 'upgma'
+TREE_METHOD = os.environ.get('GF_TREE_METHOD', 'nj').lower()
+# Alignment-free mode: k-mer length and hashes per MinHash sketch (a power of two)
+SKETCH_K = int(os.environ.get('GF_SKETCH_K', 21))
+SKETCH_SIZE = int(os.environ.get('GF_SKETCH_SIZE', 1024))
+# Trees grown by adding sequences get the new tips inserted until more than this fraction of
+# their tips were inserted that way, then they are rebuilt from the distances
+TREE_REBUILD_FRACTION = float(os.environ.get('GF_TREE_REBUILD_FRACTION', 0.2))
+
+# Upload caps so one huge FASTA can't OOM a worker (decompressed bytes for .gz uploads)
+MAX_FASTA_RECORDS = int(os.environ.get('GF_MAX_FASTA_RECORDS', 100000))
+MAX_FASTA_BYTES = int(os.environ.get('GF_MAX_FASTA_BYTES', 1 << 30))
+
+# Alignment/distance/tree cache, memory LRU in front of .npz files under uploads/ (or GF_CACHE_DIR)
+CACHE_DIR = os.environ.get('GF_CACHE_DIR') or os.path.join(UPLOAD_FOLDER, 'cache')
+CACHE_MEMORY_BYTES = int(os.environ.get('GF_CACHE_MEMORY_BYTES', 64 << 20))
+CACHE_DISK_BYTES = int(os.environ.get('GF_CACHE_DISK_BYTES', 512 << 20))
+
+# Analyzed uploads kept server-side for the results page: expiry after the last access (s) and disk budget
+DATASET_DIR = os.path.join(UPLOAD_FOLDER, 'datasets')
+DATASET_TTL = float(os.environ.get('GF_DATASET_TTL', 86400))
+DATASET_MAX_BYTES = int(os.environ.get('GF_DATASET_MAX_BYTES', 2 << 30))
+
+# Rendered plot PNGs kept in memory, plot inputs (histogram bins, KDE) as JSON under uploads/cache/plots
+RENDER_CACHE_BYTES = int(os.environ.get('GF_RENDER_CACHE_BYTES', 32 << 20))
+RENDER_DISK_BYTES = int(os.environ.get('GF_RENDER_DISK_BYTES', 64 << 20))
+PLOT_DIR = os.path.join(CACHE_DIR, 'plots')
+
+# Background phylogeny jobs: worker processes, max queued+running jobs and per-job wall time (s)
+JOB_WORKERS = int(os.environ.get('GF_JOB_WORKERS', os.cpu_count() or 1))
+JOB_QUEUE_SIZE = int(os.environ.get('GF_JOB_QUEUE_SIZE', 32))
+JOB_TIMEOUT = float(os.environ.get('GF_JOB_TIMEOUT', 300))
+# How long finished jobs stay pollable (s)
+JOB_RETENTION = float(os.environ.get('GF_JOB_RETENTION', 3600))
+
+# Structured JSON log line per pipeline stage on stdout, and ?profile=1 cProfile summaries (off by default)
+STAGE_LOG = os.environ.get('GF_STAGE_LOG', '1') != '0'
+PROFILING = os.environ.get('GF_PROFILING', '0') == '1'
+# Functions listed in a profile summary
+PROFILE_LINES = int(os.environ.get('GF_PROFILE_LINES', 40))
@@ -0,0 +1,167 @@
+"""Alignment-free distances from MinHash sketches of canonical k-mers (Mash-style).
+
+Each sequence is reduced once to a fixed-size sketch: its canonical k-mers
+(the smaller of the k-mer and its reverse complement, 2 bits per base) are
+hashed with a vectorized rolling encoding, the hash's top bits pick one of
+`size` bins and every bin keeps its smallest hash (one-permutation MinHash).
+For comparison each bin is reduced to the low 32 bits of its minimum (b-bit
+MinHash, as in BinDash; the top bits are the bin number), so counting equal
+bins is a blocked XOR kernel over uint64 words, 2 bins per word. Total cost
+is linear in bases for sketching plus n^2 * size / 2 word compares, instead
+of an MSA or n^2 * L character comparisons.
+
+The Jaccard estimate skips bins that are empty in both sketches and corrects
+for 32-bit values matching by chance; a match count within a few standard
+deviations of that chance level counts as no shared k-mer at all (J = 0),
+so unrelated sequences stay at distance 1. J is turned into an evolutionary
+distance with the Mash formula -1/k * ln(2J / (1 + J)).
+"""
+import numpy as np
+
+from composition import BATCH_BASES, as_bytes
+from distances import distances_from_encoded, rows_from_encoded
+
+# Mash defaults: 21-mers, about a thousand hashes per sketch
+DEFAULT_K = 21
+DEFAULT_SIZE = 1024
+
+_EMPTY = np.uint64(0xFFFFFFFFFFFFFFFF)
+# Filled bins get a 32-bit value below 0xFFFFFFFE, empty ones a different sentinel on each side
+_VALUES = 0xFFFFFFFE
+_LEFT_EMPTY = 0xFFFFFFFF
+_RIGHT_EMPTY = 0xFFFFFFFE
+
+
+def _build_lut():
+    """Byte -> 2-bit base code (A=0, C=1, G=2, T/U=3), 4 for anything else"""
+    lut = np.full(256, 4, dtype=np.uint8)
+    for code, bases in enumerate(('Aa', 'Cc', 'Gg', 'TtUu')):
+        for base in bases:
+            lut[ord(base)] = code
+    return lut
+
+
+_LUT = _build_lut()
+
+
+def _mix(x):
+    """splitmix64 finalizer, spreads k-mer codes uniformly over 64 bits"""
+    x = x ^ (x >> np.uint64(30))
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+def window_hashes(codes, k):
+    """(start positions, hashes) of the canonical k-mers in a base code array, skipping
+    windows with anything other than ACGT/U"""
+    m = len(codes) - k + 1
+    if m <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.uint64)
+    invalid = np.concatenate(([0], np.cumsum(codes > 3)))
+    valid = invalid[k:] == invalid[:-k]
+    bases = np.where(codes > 3, 0, codes).astype(np.uint64)
+    forward = np.zeros(m, dtype=np.uint64)
+    reverse = np.zeros(m, dtype=np.uint64)
+    # One shift per k-mer position instead of one per window
+    for t in range(k):
+        window = bases[t:t + m]
+        forward <<= np.uint64(2)
+        forward |= window
+        reverse |= (np.uint64(3) - window) << np.uint64(2 * t)
+    positions = np.flatnonzero(valid)
+    return positions, _mix(np.minimum(forward, reverse)[positions])
+
+
+def _merge_minima(minima, keys, hashes):
+    """minima.flat[key] = min(minima.flat[key], smallest hash with that key)"""
+    if not len(keys):
+        return
+    order = np.lexsort((hashes, keys))
+    keys, hashes = keys[order], hashes[order]
+    first = np.concatenate(([True], keys[1:] != keys[:-1]))
+    flat = minima.reshape(-1)
+    flat[keys[first]] = np.minimum(flat[keys[first]], hashes[first])
+
+
+def sketch_sequences(sequences, k=DEFAULT_K, size=DEFAULT_SIZE):
+    """(n, size) uint64 matrix of per-bin minimum hashes (all ones = empty bin)"""
+    if not 1 <= k <= 32:
+        raise ValueError("k must be between 1 and 32")
+    if size < 8 or size & (size - 1):
+        raise ValueError("Sketch size must be a power of two, at least 8")
+    shift = np.uint64(64 - (size.bit_length() - 1))
+    raw = [as_bytes(s) for s in sequences]
+    minima = np.full((len(raw), size), _EMPTY, dtype=np.uint64)
+
+    start = 0
+    while start < len(raw):
+        # Long sequences are hashed alone, in overlapping pieces
+        if len(raw[start]) >= BATCH_BASES:
+            for offset in range(0, len(raw[start]), BATCH_BASES):
+                piece = raw[start][offset:offset + BATCH_BASES + k - 1]
+                _, hashes = window_hashes(_LUT[np.frombuffer(piece, dtype=np.uint8)], k)
+                _merge_minima(minima, start * size + (hashes >> shift).astype(np.intp), hashes)
+            start += 1
+            continue
+
+        # Short ones are joined with a separator no k-mer can span
+        end, total = start, 0
+        while end < len(raw) and len(raw[end]) < BATCH_BASES and total + len(raw[end]) <= BATCH_BASES:
+            total += len(raw[end]) + 1
+            end += 1
+        batch = raw[start:end]
+        codes = _LUT[np.frombuffer(b'!'.join(batch), dtype=np.uint8)]
+        lengths = np.fromiter((len(s) + 1 for s in batch), dtype=np.intp, count=len(batch))
+        owner = np.repeat(np.arange(start, end, dtype=np.intp), lengths)
+        positions, hashes = window_hashes(codes, k)
+        _merge_minima(minima, owner[positions] * size + (hashes >> shift).astype(np.intp), hashes)
+        start = end
+
+    return minima
+
+
+def _encode(minima, k):
+    """Sketch matrix -> arrays for the blocked kernel in distances.py"""
+    empty = minima == _EMPTY
+    # 32 bits per bin: the low half of its minimum hash (the high bits are the bin number);
+    # the two values kept for the sentinels fold onto the one below them
+    values = np.minimum(minima & np.uint64(0xFFFFFFFF), np.uint64(_VALUES - 1)).astype(np.uint32)
+    left = np.where(empty, _LEFT_EMPTY, values).astype(np.uint32)
+    right = np.where(empty, _RIGHT_EMPTY, values).astype(np.uint32)
+    bits = np.packbits(empty, axis=1)
+    bits = np.pad(bits, ((0, 0), (0, (-bits.shape[1]) % 8)))
+    return {'left': np.ascontiguousarray(left).view(np.uint64),
+            'right': np.ascontiguousarray(right).view(np.uint64),
+            'empty': bits.view(np.uint64), 'empty_counts': empty.sum(axis=1),
+            'bins': minima.shape[1], 'values': _VALUES, 'k': k}
+
+
+def sketch_distances(sequences, k=DEFAULT_K, size=DEFAULT_SIZE, processes=None, minima=None):
+    """Condensed Mash distances between sequences; pass precomputed minima to reuse sketches"""
+    if minima is None:
+        minima = sketch_sequences(sequences, k=k, size=size)
+    return distances_from_encoded(_encode(minima, k), 'mash', processes=processes)
+
+
+def sketch_query_distances(sequences, queries, k=DEFAULT_K, size=DEFAULT_SIZE):
+    """(len(queries), n) Mash distances from sequences[q] for each q in queries to every sequence"""
+    return rows_from_encoded(_encode(sketch_sequences(sequences, k=k, size=size), k), 'mash', queries)
+
+
+def distinct_kmers(sequences, k=DEFAULT_K):
+    """Number of distinct canonical k-mers of each sequence (the sets the sketches sample)"""
+    return np.array([len(np.unique(window_hashes(_LUT[np.frombuffer(as_bytes(s), dtype=np.uint8)], k)[1]))
+                     for s in sequences], dtype=np.int64)
+
+
+def sketch_matches(query, targets):
+    """(equal bins, bins filled in either sketch) between one sketch and each row of targets,
+    comparing the full minimum hashes (no chance matches)"""
+    query_empty = query == _EMPTY
+    target_empty = targets == _EMPTY
+    matches = np.count_nonzero((targets == query) & ~target_empty, axis=1)
+    compared = targets.shape[1] - np.count_nonzero(target_empty & query_empty, axis=1)
+    return matches, compared
@@ -41,7 +41,10 @@ function setupFilePreview() {
         fileInput.addEventListener('change', function(e) {
             //e es evento, target es el elemento que disparó el evento, files es una lista de archivos seleccionados
             const file = e.target.files[0];
-            if (file) {
+            if (file && /\.(gz|bgz)$/i.test(file.name)) {
+                // Los comprimidos se descomprimen en el servidor, aquí no hay vista previa
+                fileContent.value = `Compressed file (${file.name}), preview not available`;
+            } else if (file) {
                 //FileReader es una API del navegador para leer archivos locales sin enviarlos al servidor.
                 const reader = new FileReader();
                 //evento de tipo load de file reader, se activa cuando el archivo ha sido leído completament
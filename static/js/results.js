@@ -1,18 +1,110 @@
 document.addEventListener('DOMContentLoaded', function() {
     // Obtener datos de las secuencias y distancias obtenidos desde el flask
     const sequencesDataEl = document.getElementById('sequences-data');
-    const distanceDataEl = document.getElementById('distance-data');
     
-    const sequences = JSON.parse(sequencesDataEl.dataset.sequences);
-    const distanceMatrix = JSON.parse(distanceDataEl.dataset.distances);
+    // Solo el id y el número de secuencias; estadísticas y secuencias viven en el servidor bajo el id del dataset
+    const sequenceCount = parseInt(sequencesDataEl.dataset.sequenceCount);
+    const datasetId = sequencesDataEl.dataset.datasetId;
+    let sequencesPromise = null;
+    // Las distancias se quedan en el servidor; solo guardamos la clave del árbol para consultarlas
+    const calculatorEl = document.getElementById('distance-calculator');
+    // let: si el árbol se construye en segundo plano, la clave llega después
+    let treeKey = calculatorEl ? calculatorEl.dataset.treeKey : '';
+    // Resultados de motivos que se piden por página
+    const MOTIF_PAGE_SIZE = 50;
+    // Secuencias mostradas en la matriz de similitud (filas y columnas de cada bloque)
+    const SIMILARITY_MATRIX_SIZE = 30;
+    let matrixRow = 0;
+    let matrixCol = 0;
+    // Filas por página de la tabla de estadísticas y sugerencias de títulos
+    const STATS_PAGE_SIZE = 25;
+    const PICKER_SUGGESTIONS = 20;
     
     // Inicializar funcionalidades
     initSequenceVisualization();
-    initSequenceStatsSelector();
+    initSequenceStatsTable();
     initDistanceCalculator();
     initMultipleAlignment();
     initExportFunctions();
     initMotifSearch();
+    initTreeJob();
+    
+    function loadSequences() {
+        // las secuencias completas se piden una sola vez, y solo si alguna función las necesita
+        if (!sequencesPromise) {
+            sequencesPromise = fetch(`/datasets/${datasetId}/sequences`)
+                .then(response => {
+                    if (!response.ok) throw new Error('The dataset has expired, please run the analysis again');
+                    return response.json();
+                })
+                .catch(error => {
+                    sequencesPromise = null;
+                    showNotification(error.message, 'error');
+                    throw error;
+                });
+        }
+        return sequencesPromise;
+    }
+    
+    function initTreeJob() {
+        // El árbol filogenético se genera como trabajo en segundo plano: consultamos su estado hasta que termine
+        const jobEl = document.getElementById('tree-job');
+        if (!jobEl) return;
+        
+        const jobId = jobEl.dataset.jobId;
+        const messageEl = document.getElementById('tree-job-message');
+        const progressEl = document.getElementById('tree-job-progress');
+        const cancelBtn = document.getElementById('tree-job-cancel');
+        let finished = false;
+        
+        function showTreeMessage(text) {
+            finished = true;
+            jobEl.innerHTML = `<p style="color: var(--text-gray);">${text}</p>`;
+        }
+        
+        function poll() {
+            if (finished) return;
+            fetch(`/jobs/${jobId}/result`)
+                .then(response => response.json().then(data => ({ status: response.status, data })))
+                .then(({ status, data }) => {
+                    if (status === 202) {
+                        //todavía en cola o corriendo
+                        messageEl.textContent = data.status === 'queued' ? 'Waiting for a free worker...' : (data.message || 'Building phylogenetic tree...');
+                        progressEl.style.width = `${Math.round((data.progress || 0) * 100)}%`;
+                        setTimeout(poll, 1500);
+                    } else if (status === 200) {
+                        finished = true;
+                        // la imagen se pide aparte (con ETag), el Newick queda disponible en data.newick_url
+                        jobEl.outerHTML = `<img src="${data.tree_url}" alt="Phylogenetic tree" data-newick-url="${data.newick_url}" style="max-width: 100%; max-height: 250px; border-radius: 8px;">`;
+                        treeKey = data.tree.key;
+                        // las secuencias que se añadan después hacen crecer este árbol
+                        const extendTree = document.getElementById('extend-tree');
+                        if (extendTree) extendTree.value = treeKey;
+                        const calculator = document.getElementById('distance-calculator');
+                        if (calculator) {
+                            calculator.dataset.treeKey = treeKey;
+                            calculator.style.display = 'block';
+                            document.getElementById('seq-select-1').dispatchEvent(new Event('change'));
+                        }
+                        // con la clave del árbol la matriz de similitud pasa a usar el alineamiento de MUSCLE
+                        generateSimilarityMatrix();
+                        showNotification('Phylogenetic tree ready', 'success');
+                    } else if (status === 404) {
+                        showTreeMessage('Phylogenetic tree job expired, please run the analysis again');
+                    } else {
+                        showTreeMessage(`Phylogenetic tree not available (${data.status}${data.error ? ': ' + data.error : ''})`);
+                    }
+                })
+                .catch(() => setTimeout(poll, 3000));
+        }
+        
+        cancelBtn.addEventListener('click', function() {
+            fetch(`/jobs/${jobId}/cancel`, { method: 'POST' })
+                .then(() => showTreeMessage('Phylogenetic tree cancelled'));
+        });
+        
+        poll();
+    }
     
     function initMultipleAlignment() {
         const generateBtn = document.getElementById('generate-alignment-btn');
@@ -26,128 +118,75 @@ document.addEventListener('DOMContentLoaded', function() {
         });
         
         // Generar alineamiento al hacer clic
-        generateBtn.addEventListener('click', generateMultipleAlignment);
+        generateBtn.addEventListener('click', () => generateMultipleAlignment(0));
         
         // Cambiar vista del alineamiento
         viewSelect.addEventListener('change', updateAlignmentView);
         
         // Generar matriz de similitud inicial
+        initSimilarityMatrixPager();
         generateSimilarityMatrix();
     }
     
-    function generateMultipleAlignment() {
+    // El perfil del alineamiento (consenso, conservación, identidades) se calcula en el servidor;
+    // con la clave del árbol usa el alineamiento de MUSCLE, sin ella las secuencias rellenadas con '-'
+    function profileUrl(path, params) {
+        const query = new URLSearchParams(params);
+        if (treeKey) {
+            query.set('tree', treeKey);
+        }
+        return `/datasets/${datasetId}/profile${path}?${query}`;
+    }
+    
+    function fetchJson(url) {
+        return fetch(url).then(response => response.json().then(data => {
+            if (!response.ok) {
+                throw new Error(data.error || `HTTP ${response.status}`);
+            }
+            return data;
+        }));
+    }
+    
+    function generateMultipleAlignment(start) {
         const generateBtn = document.getElementById('generate-alignment-btn');
         const alignmentStats = document.getElementById('alignment-stats');
+        const viewType = document.getElementById('alignment-view-select').value;
         
         // Mostrar estado de carga
         const originalHTML = generateBtn.innerHTML;
         generateBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Generating...';
         generateBtn.disabled = true;
         
-        // Simular procesamiento
-        setTimeout(() => {
-            const alignment = performSimpleAlignment();
-            displayAlignment(alignment);
-            updateAlignmentStats(alignment);
-            
-            alignmentStats.style.display = 'block';
-            showNotification('Multiple alignment generated successfully', 'success');
-            
-            generateBtn.innerHTML = originalHTML;
-            generateBtn.disabled = false;
-        }, 1500);
-    }
-    
-    function performSimpleAlignment() {
-        //crea un array con longitudes de secuencias y escoge la de mayor tamaño
-        const maxLength = Math.max(...sequences.map(s => s.sequence.length)); 
-        const alignedSequences = []; //aligned sequecnes contendra objeto y cada objeto tiene tres propiedades definidas por llaves
-
-        sequences.forEach(seq => {
-            //rellena con guiones - al final de la secuencia si es más corta que maxLength
-            const paddedSeq = seq.sequence.padEnd(maxLength, '-');
-            //guarda el objeto con su titul, la nueva sec, y su longitud original
-            alignedSequences.push({
-                title: seq.title,
-                sequence: paddedSeq,
-                originalLength: seq.sequence.length
-            });
-        });
-        
-        return {
-            sequences: alignedSequences,
-            length: maxLength,
-            conservedPositions: calculateConservedPositions(alignedSequences),
-            similarity: calculateAverageSimilarity(alignedSequences),
-            gapsCount: calculateTotalGaps(alignedSequences)
-        };
-    }
-    
-    function calculateConservedPositions(alignedSeqs) {
-        const length = alignedSeqs[0].sequence.length; 
-        //toma longitud de primera seq como referencia
-        let conserved = 0;
-        //FULL PROGRAMACIÓN FUNCIONAL!!!    
-        for (let i = 0; i < length; i++) {
-            //para todas las secuencias, me da un array con sus valores en la posición i
-            const bases = alignedSeqs.map(seq => seq.sequence[i]);
-            //PARA todas las bases , se queda solo con las diferentes de guion y las hace unicas, (maximo puede tener 4 valores)
-            const uniqueBases = new Set(bases.filter(base => base !== '-'));
-            
-            if (uniqueBases.size === 1 && !uniqueBases.has('-')) {
-                conserved++; //si hay un solo caracter unico y no es un guion, cuenta como conservado
-            }
+        // La vista previa solo necesita 50 columnas; el consenso no necesita las filas.
+        // La identidad media (todas las parejas) solo se pide con la primera página
+        const params = { start: start };
+        if (start === 0) {
+            params.identity = 1;
         }
-        
-        return conserved; //retorna el numero de posiciones conservadas
-    }
-    
-    function calculateAverageSimilarity(alignedSeqs) {
-        //me da el PROMEDIO total de similitudes entre todas las PAREJAS POSIBLES de secuencias alineadas
-        let totalSimilarity = 0;
-        let comparisons = 0;
-        
-        for (let i = 0; i < alignedSeqs.length; i++) {
-            for (let j = i + 1; j < alignedSeqs.length; j++) {
-                //compara la similutud sin incluir pares iguales
-                const similarity = calculatePairwiseSimilarity(
-                    alignedSeqs[i].sequence, 
-                    alignedSeqs[j].sequence
-                );
-                totalSimilarity += similarity; //suma
-                comparisons++; //cuenta, para luego dividir por la suma y sacar el promedio
-            }
+        if (viewType === 'preview') {
+            params.end = start + 50;
+        } else if (viewType === 'consensus') {
+            params.rows = 0;
         }
         
-        return totalSimilarity / comparisons;
-    }
-    
-    function calculatePairwiseSimilarity(seq1, seq2) {
-        //Calcula cuánto se parecen dos secuencias alineadas, posición por posición. Solo considera posiciones sin guiones.
-        let matches = 0;
-        let validPositions = 0;
-        
-        for (let i = 0; i < seq1.length; i++) {
-            if (seq1[i] !== '-' && seq2[i] !== '-') {
-                validPositions++;
-                if (seq1[i] === seq2[i]) {
-                    matches++;
+        fetchJson(profileUrl('', params))
+            .then(profile => {
+                displayAlignment(profile);
+                updateAlignmentStats(profile);
+                
+                alignmentStats.style.display = 'block';
+                if (start === 0) {
+                    showNotification('Multiple alignment generated successfully', 'success');
                 }
-            }
-        }
-        
-        return (matches / validPositions) * 100;
-    }
-    
-    function calculateTotalGaps(alignedSeqs) {
-        // Cuenta el número total de guiones en todas las secuencias alineadas
-        return alignedSeqs.reduce((total, seq) => {
-                            //expresion regular que retorna una lista con todos los guiones, luego se cuenta el tamaño de esa lista y se suma con todas las demas listas de todas las secuencias
-            return total + (seq.sequence.match(/-/g) || []).length;
-        }, 0);
+            })
+            .catch(error => showNotification('Error generating alignment: ' + error.message, 'error'))
+            .finally(() => {
+                generateBtn.innerHTML = originalHTML;
+                generateBtn.disabled = false;
+            });
     }
     
-    function displayAlignment(alignment) {
+    function displayAlignment(profile) {
         const alignmentContent = document.getElementById('alignment-content');
         const viewSelect = document.getElementById('alignment-view-select');
         //leo el valor del selector
@@ -156,41 +195,59 @@ document.addEventListener('DOMContentLoaded', function() {
         
         switch (viewType) {
             case 'preview':
-                html = generateAlignmentPreview(alignment);
+                html = generateAlignmentPreview(profile);
                 break;
             case 'full':
-                html = generateFullAlignment(alignment);
+                html = generateFullAlignment(profile);
                 break;
             case 'consensus':
-                html = generateConsensusView(alignment);
+                html = generateConsensusView(profile);
                 break;
             default:
-                html = generateAlignmentPreview(alignment);
+                html = generateAlignmentPreview(profile);
         }
         //inserta el html dentro del elemento con id=alignmentContent, reemplazando lo q hubiese
         alignmentContent.innerHTML = html;
+        
+        // Botones para moverse por ventanas de columnas en alineamientos largos
+        alignmentContent.querySelectorAll('[data-alignment-start]').forEach(button => {
+            button.addEventListener('click', () => generateMultipleAlignment(Number(button.dataset.alignmentStart)));
+        });
+    }
+    
+    function generateAlignmentPager(profile) {
+        const { start, end } = profile.columns;
+        const size = end - start;
+        if (start === 0 && end >= profile.length) {
+            return '';
+        }
+        let html = '<div style="display: flex; justify-content: space-between; align-items: center; margin: 0.5rem 0 1rem;">';
+        html += `<button class="btn btn-secondary" data-alignment-start="${Math.max(0, start - size)}" ${start === 0 ? 'disabled' : ''}>Previous</button>`;
+        html += `<span style="color: var(--text-gray);">Positions ${start + 1}-${end} of ${profile.length.toLocaleString()}</span>`;
+        html += `<button class="btn btn-secondary" data-alignment-start="${end}" ${end >= profile.length ? 'disabled' : ''}>Next</button>`;
+        html += '</div>';
+        return html;
     }
     
-    function generateAlignmentPreview(alignment) {
+    function generateAlignmentPreview(profile) {
         //genera una vista previa del alineamiento mostrando los primeros 50 bp de cada secuencia
         const previewLength = 50;
         //aplica estilo al html que se mostrará
         let html = '<div style="margin-bottom: 1rem;">';
-        html += '<div style="color: var(--accent-green); font-weight: bold; margin-bottom: 0.5rem;">Alignment Preview (first 50 bp):</div>';
+        html += `<div style="color: var(--accent-green); font-weight: bold; margin-bottom: 0.5rem;">Alignment Preview (first 50 bp, ${profile.source === 'padded' ? 'unaligned, right-padded' : 'MUSCLE alignment'}):</div>`;
         
-        //para cada secuencia de alignment, toma su secuencia y la corta a los primeros 50 bp
-        //Recorre cada objeto seq dentro de alignment.sequences.
-        alignment.sequences.forEach((seq, index) => {
-            const preview = seq.sequence.substring(0, previewLength);
+        //para cada fila del alineamiento, toma sus primeros 50 bp
+        profile.columns.rows.forEach((row, index) => {
+            const preview = row.substring(0, previewLength);
             html += `<div style="margin-bottom: 0.3rem;">`;
-            html += `<span style="color: var(--accent-blue); width: 150px; display: inline-block;">${seq.title.substring(0, 15)}:</span>`;
+            html += `<span style="color: var(--accent-blue); width: 150px; display: inline-block;">${escapeHtml(profile.names[index].substring(0, 15))}:</span>`;
             html += `<span style="letter-spacing: 1px;">${formatAlignmentSequence(preview)}</span>`;
             html += `</div>`;
         });
         
-        if (alignment.length > previewLength) {
+        if (profile.length > previewLength) {
             html += `<div style="color: var(--text-gray); margin-top: 0.5rem; font-style: italic;">`;
-            html += `... and ${alignment.length - previewLength} more positions`;
+            html += `... and ${profile.length - previewLength} more positions`;
             html += `</div>`;
         }
         
@@ -198,90 +255,87 @@ document.addEventListener('DOMContentLoaded', function() {
         return html;
     }
     
-    function generateFullAlignment(alignment) {
+    function generateFullAlignment(profile) {
         const chunkSize = 80;
+        const { start, end, rows } = profile.columns;
         let html = '<div>';
         html += '<div style="color: var(--accent-green); font-weight: bold; margin-bottom: 1rem;">Full Alignment:</div>';
+        html += generateAlignmentPager(profile);
         
-        for (let start = 0; start < alignment.length; start += chunkSize) {
+        for (let offset = 0; offset < end - start; offset += chunkSize) {
             html += `<div style="margin-bottom: 2rem; background-color: rgba(30, 30, 30, 0.3); padding: 1rem; border-radius: 5px;">`;
-            html += `<div style="color: var(--text-gray); margin-bottom: 0.8rem; font-weight: bold; border-bottom: 1px solid rgba(255,255,255,0.1); padding-bottom: 0.5rem;">Positions ${start + 1}-${Math.min(start + chunkSize, alignment.length)}:</div>`;
+            html += `<div style="color: var(--text-gray); margin-bottom: 0.8rem; font-weight: bold; border-bottom: 1px solid rgba(255,255,255,0.1); padding-bottom: 0.5rem;">Positions ${start + offset + 1}-${Math.min(start + offset + chunkSize, end)}:</div>`;
             
-            alignment.sequences.forEach((seq, index) => {
-                //Para cada secuencia, extrae el fragmento de longitud 80 (o menos, al final).
-                
-                const chunk = seq.sequence.substring(start, start + chunkSize);
-                const shortTitle = seq.title.length > 15 ? seq.title.substring(0, 15) + '...' : seq.title;
+            rows.forEach((row, index) => {
+                //Para cada fila, extrae el fragmento de longitud 80 (o menos, al final).
+                const title = profile.names[index];
+                const chunk = row.substring(offset, offset + chunkSize);
+                const shortTitle = title.length > 15 ? title.substring(0, 15) + '...' : title;
                 //Línea de la secuencia con fuente monoespaciada, muestra el título corto en azul y, al pasar el ratón, el title completo.
                 html += `<div style="margin-bottom: 0.4rem; font-family: 'Courier New', monospace;">`;
-                html += `<span style="color: var(--accent-blue); width: 140px; display: inline-block; font-size: 0.9rem; font-weight: bold;" title="${seq.title}">${shortTitle}:</span>`;
+                html += `<span style="color: var(--accent-blue); width: 140px; display: inline-block; font-size: 0.9rem; font-weight: bold;" title="${escapeHtml(title)}">${escapeHtml(shortTitle)}:</span>`;
                 html += `<span style="letter-spacing: 1px; word-break: break-all;">${formatAlignmentSequence(chunk)}</span>`;
                 html += `</div>`;
             });
             
             html += `<div style="margin-top: 0.8rem; border-top: 1px solid rgba(255,255,255,0.1); padding-top: 0.5rem;">`;
             html += `<span style="color: var(--text-gray); width: 140px; display: inline-block; font-size: 0.9rem;">Conservation:</span>`;
-            html += `<span style="letter-spacing: 1px;">${generateConservationLine(alignment, start, chunkSize)}</span>`;
+            html += `<span style="letter-spacing: 1px;">${formatConservationLine(profile.columns.conservation_line.substring(offset, offset + chunkSize))}</span>`;
             html += `</div>`;
             
             html += `</div>`;
         }
         
+        html += generateAlignmentPager(profile);
         html += '</div>';
         return html;
     }
 
-    function generateConservationLine(alignment, start, chunkSize) {
-        let conservationLine = '';
-        const end = Math.min(start + chunkSize, alignment.length);
-        
-        for (let pos = start; pos < end; pos++) {
-            //para cada secuencia del alineamiento, toma su base en la posición pos
-            const bases = alignment.sequences.map(seq => seq.sequence[pos]);
-            //toma las bases unicas, filtra y retiene las bases que no son guiones
-            const uniqueBases = new Set(bases.filter(base => base !== '-'));
-            
-            if (uniqueBases.size === 1 && !uniqueBases.has('-')) {
-                conservationLine += '<span style="color: var(--accent-green); font-weight: bold;">*</span>';
-            } else if (uniqueBases.size <= 2) {
-                conservationLine += '<span style="color: #f1c40f;">:</span>';
-            } else {
-                conservationLine += '<span style="color: var(--text-gray);">.</span>';
+    function formatConservationLine(line) {
+        // '*' un solo tipo de base, ':' como mucho dos, '.' más (calculado en el servidor)
+        return line.split('').map(symbol => {
+            if (symbol === '*') {
+                return '<span style="color: var(--accent-green); font-weight: bold;">*</span>';
+            } else if (symbol === ':') {
+                return '<span style="color: #f1c40f;">:</span>';
             }
-        }
-        
-        return conservationLine;
+            return '<span style="color: var(--text-gray);">.</span>';
+        }).join('');
     }
     
-    function generateConsensusView(alignment) {
-        const consensus = calculateConsensusSequence(alignment);
+    function generateConsensusView(profile) {
         let html = '<div>';
         html += '<div style="color: var(--accent-green); font-weight: bold; margin-bottom: 1rem;">Consensus Sequence:</div>';
+        html += generateAlignmentPager(profile);
         
         html += `<div style="background-color: rgba(42, 157, 143, 0.1); padding: 1rem; border-radius: 5px; margin-bottom: 1rem;">`;
         html += `<div style="color: var(--accent-green); font-weight: bold; margin-bottom: 0.5rem;">Consensus:</div>`;
         
-        const formattedConsensus = formatConsensusWithLineBreaks(consensus.sequence, 80);
+        const formattedConsensus = formatConsensusWithLineBreaks(profile.columns.consensus, 80, profile.columns.start + 1);
         html += `<div style="letter-spacing: 2px; font-size: 1.1rem; word-break: break-all; white-space: pre-wrap; font-family: 'Courier New', monospace; line-height: 1.8;">${formattedConsensus}</div>`;
         html += `</div>`;
         
         html += `<div style="margin-top: 1rem; background-color: rgba(30, 30, 30, 0.3); padding: 1rem; border-radius: 5px;">`;
         html += `<div style="color: var(--text-gray); margin-bottom: 0.5rem; font-weight: bold;">Consensus Statistics:</div>`;
         
-        const stats = calculateConsensusStats(consensus);
+        // Estadísticas de todo el alineamiento, no solo de la ventana mostrada
         html += `<div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(150px, 1fr)); gap: 1rem; margin-bottom: 1rem;">`;
         html += `<div style="text-align: center;">`;
-        html += `<div style="font-size: 1.5rem; font-weight: bold; color: var(--accent-green);">${stats.fullyConserved}</div>`;
+        html += `<div style="font-size: 1.5rem; font-weight: bold; color: var(--accent-green);">${profile.fully_conserved}</div>`;
         html += `<div style="font-size: 0.9rem; color: var(--text-gray);">100% conserved positions</div>`;
         html += `</div>`;
         html += `<div style="text-align: center;">`;
-        html += `<div style="font-size: 1.5rem; font-weight: bold; color: #f1c40f">${stats.partiallyConserved}</div>`;
+        html += `<div style="font-size: 1.5rem; font-weight: bold; color: #f1c40f">${profile.partially_conserved}</div>`;
         html += `<div style="font-size: 0.9rem; color: var(--text-gray);">>50% conserved positions</div>`;
         html += `</div>`;
         html += `<div style="text-align: center;">`;
-        html += `<div style="font-size: 1.5rem; font-weight: bold; color: var(--primary-red);">${stats.variable}</div>`;
+        html += `<div style="font-size: 1.5rem; font-weight: bold; color: var(--primary-red);">${profile.variable}</div>`;
         html += `<div style="font-size: 0.9rem; color: var(--text-gray);">Variable positions</div>`;
         html += `</div>`;
+        html += `<div style="text-align: center;">`;
+        html += `<div style="font-size: 1.5rem; font-weight: bold; color: var(--accent-blue);">${profile.mean_entropy.toFixed(2)}</div>`;
+        html += `<div style="font-size: 0.9rem; color: var(--text-gray);">Mean entropy (bits)</div>`;
+        html += `</div>`;
         html += `</div>`;
         
         html += `<div style="margin-top: 1rem;">`;
@@ -299,9 +353,9 @@ document.addEventListener('DOMContentLoaded', function() {
         return html;
     }
 
-    function formatConsensusWithLineBreaks(sequence, lineLength = 80) {
+    function formatConsensusWithLineBreaks(sequence, lineLength = 80, firstPosition = 1) {
         let formatted = '';
-        let position = 1;
+        let position = firstPosition;
         
         for (let i = 0; i < sequence.length; i += lineLength) {
             const chunk = sequence.substring(i, i + lineLength);
@@ -328,61 +382,6 @@ document.addEventListener('DOMContentLoaded', function() {
         
         return formatted;
     }
-
-    function calculateConsensusStats(consensus) {
-        let fullyConserved = 0;
-        let partiallyConserved = 0;
-        let variable = 0;
-        
-        consensus.conservation.forEach(conservation => {
-            if (conservation === 1.0) {
-                fullyConserved++;
-            } else if (conservation > 0.5) {
-                partiallyConserved++;
-            } else {
-                variable++;
-            }
-        });
-        
-        return {
-            fullyConserved,
-            partiallyConserved,
-            variable
-        };
-    }
-    
-    function calculateConsensusSequence(alignment) {
-        const length = alignment.length;
-        let consensus = '';
-        let conservation = [];
-        
-        for (let i = 0; i < length; i++) {
-            const baseCounts = {};
-            let totalBases = 0;
-            
-            alignment.sequences.forEach(seq => {
-                const base = seq.sequence[i];
-                if (base !== '-') {
-                    baseCounts[base] = (baseCounts[base] || 0) + 1;
-                    totalBases++;
-                }
-            });
-            
-            if (totalBases === 0) {
-                consensus += '-';
-                conservation.push(0);
-            } else {
-                const mostCommon = Object.keys(baseCounts).reduce((a, b) => 
-                    baseCounts[a] > baseCounts[b] ? a : b);
-                const frequency = baseCounts[mostCommon] / totalBases;
-                
-                consensus += mostCommon;
-                conservation.push(frequency);
-            }
-        }
-        
-        return { sequence: consensus, conservation };
-    }
     
     function formatAlignmentSequence(sequence) {
         //aplica a cada base de la secuencia un color dependiendo de su tipo
@@ -407,44 +406,81 @@ document.addEventListener('DOMContentLoaded', function() {
         return colors[base.toUpperCase()] || '#ffffff';
     }
     
+    function escapeHtml(text) {
+        const div = document.createElement('div');
+        div.textContent = text;
+        return div.innerHTML.replace(/"/g, '&quot;');
+    }
+    
     function updateAlignmentView() {
         const alignmentContent = document.getElementById('alignment-content');
         if (alignmentContent && alignmentContent.innerHTML && !alignmentContent.innerHTML.includes('Haz clic')) {
-            generateMultipleAlignment();
+            generateMultipleAlignment(0);
         }
     }
     
-    function updateAlignmentStats(alignment) {
-        document.getElementById('alignment-length').textContent = alignment.length.toLocaleString();
-        document.getElementById('conserved-positions').textContent = alignment.conservedPositions.toLocaleString();
-        document.getElementById('similarity-score').textContent = alignment.similarity.toFixed(1) + '%';
-        document.getElementById('gaps-count').textContent = alignment.gapsCount.toLocaleString();
+    function updateAlignmentStats(profile) {
+        document.getElementById('alignment-length').textContent = profile.length.toLocaleString();
+        document.getElementById('conserved-positions').textContent = profile.conserved_positions.toLocaleString();
+        if ('average_identity' in profile) {
+            document.getElementById('similarity-score').textContent =
+                profile.average_identity === null ? '-' : profile.average_identity.toFixed(1) + '%';
+        }
+        document.getElementById('gaps-count').textContent = profile.gaps.toLocaleString();
     }
     
     function generateSimilarityMatrix() {
+        // solo el bloque visible: SIMILARITY_MATRIX_SIZE filas desde matrixRow por otras tantas columnas desde matrixCol
+        fetchJson(profileUrl('/identity', { limit: SIMILARITY_MATRIX_SIZE, row: matrixRow, col: matrixCol }))
+            .then(renderSimilarityMatrix)
+            .catch(error => showNotification('Error loading similarity matrix: ' + error.message, 'error'));
+    }
+    
+    function initSimilarityMatrixPager() {
+        const pager = document.getElementById('similarity-matrix-pager');
+        if (!pager) return;
+        pager.querySelectorAll('button[data-move]').forEach(button => {
+            button.addEventListener('click', () => {
+                const shift = parseInt(button.dataset.step) * SIMILARITY_MATRIX_SIZE;
+                const last = Math.max(sequenceCount - 1, 0);
+                if (button.dataset.move === 'row') {
+                    matrixRow = Math.min(Math.max(matrixRow + shift, 0), last);
+                } else {
+                    matrixCol = Math.min(Math.max(matrixCol + shift, 0), last);
+                }
+                generateSimilarityMatrix();
+            });
+        });
+    }
+    
+    function renderSimilarityMatrix(data) {
         const matrixContainer = document.getElementById('similarity-matrix');
+        const names = data.names;
+        const columns = data.columns;
         
         let html = '<div class="dynamic-matrix-grid" style="display: grid; gap: 1px; background-color: rgba(255, 255, 255, 0.1); border-radius: 5px; overflow: hidden;">';
         
-        const gridCols = sequences.length + 1;
+        const gridCols = columns.length + 1;
         html = html.replace('display: grid;', `display: grid; grid-template-columns: repeat(${gridCols}, 1fr);`);
         
         html += '<div class="matrix-cell matrix-header">Sequence</div>';
         
-        sequences.forEach(seq => {
-            const shortTitle = seq.title.length > 10 ? seq.title.substring(0, 10) + '...' : seq.title;
-            html += `<div class="matrix-cell matrix-header" title="${seq.title}">${shortTitle}</div>`;
+        columns.forEach(name => {
+            const shortTitle = name.length > 10 ? name.substring(0, 10) + '...' : name;
+            html += `<div class="matrix-cell matrix-header" title="${escapeHtml(name)}">${escapeHtml(shortTitle)}</div>`;
         });
         
-        sequences.forEach((seq1, i) => {
-            const shortTitle1 = seq1.title.length > 10 ? seq1.title.substring(0, 10) + '...' : seq1.title;
-            html += `<div class="matrix-cell matrix-header" title="${seq1.title}">${shortTitle1}</div>`;
+        // Identidades ya calculadas en el servidor (null si dos filas no comparten columnas)
+        data.identity.forEach((row, i) => {
+            const shortTitle1 = names[i].length > 10 ? names[i].substring(0, 10) + '...' : names[i];
+            html += `<div class="matrix-cell matrix-header" title="${escapeHtml(names[i])}">${escapeHtml(shortTitle1)}</div>`;
             
-            sequences.forEach((seq2, j) => {
-                if (i === j) {
+            row.forEach((similarity, j) => {
+                if (data.row + i === data.col + j) {
                     html += '<div class="matrix-cell" style="background-color: var(--accent-green); color: white; font-weight: bold;">100%</div>';
+                } else if (similarity === null) {
+                    html += '<div class="matrix-cell" style="color: var(--text-gray);">-</div>';
                 } else {
-                    const similarity = calculateSequenceSimilarity(seq1.sequence, seq2.sequence);
                     const color = getSimilarityColor(similarity);
                     html += `<div class="matrix-cell" style="background-color: ${color}; color: white;">${similarity.toFixed(1)}%</div>`;
                 }
@@ -453,19 +489,13 @@ document.addEventListener('DOMContentLoaded', function() {
         
         html += '</div>';
         matrixContainer.innerHTML = html;
-    }
-    
-    function calculateSequenceSimilarity(seq1, seq2) {
-        const minLength = Math.min(seq1.length, seq2.length);
-        let matches = 0;
         
-        for (let i = 0; i < minLength; i++) {
-            if (seq1[i].toUpperCase() === seq2[i].toUpperCase()) {
-                matches++;
-            }
+        const pager = document.getElementById('similarity-matrix-pager');
+        if (pager && data.sequences > SIMILARITY_MATRIX_SIZE) {
+            pager.style.display = 'flex';
+            document.getElementById('similarity-matrix-info').textContent =
+                `Rows ${data.row + 1}-${data.row + names.length}, columns ${data.col + 1}-${data.col + columns.length} of ${data.sequences}`;
         }
-        
-        return (matches / minLength) * 100;
     }
     
     function getSimilarityColor(similarity) {
@@ -475,26 +505,180 @@ document.addEventListener('DOMContentLoaded', function() {
         return 'rgba(231, 76, 60, 0.8)';
     }
     
-    function initSequenceStatsSelector() {
-        const statsSelect = document.getElementById('sequence-stats-select');
+    // Una página de estadísticas por secuencia, ya filtrada y ordenada en el servidor
+    function fetchStatsPage(params) {
+        return fetchJson(`/datasets/${datasetId}/stats?${new URLSearchParams(params)}`);
+    }
+    
+    function initSequenceStatsTable() {
+        const tableEl = document.getElementById('sequence-stats-table');
         const statsContainer = document.getElementById('sequence-stats-container');
-        
-        function updateSequenceStats() {
-            const selectedIndex = parseInt(statsSelect.value);
-            const selectedSequence = sequences[selectedIndex];
-            
-            const statsHTML = generateSequenceStatsHTML(selectedSequence, selectedIndex);
-            
+        const pageInfo = document.getElementById('stats-page-info');
+        const prevBtn = document.getElementById('stats-prev-page');
+        const nextBtn = document.getElementById('stats-next-page');
+        const filterInputs = {
+            q: document.getElementById('stats-filter-title'),
+            min_length: document.getElementById('stats-min-length'),
+            max_length: document.getElementById('stats-max-length'),
+            min_gc: document.getElementById('stats-min-gc'),
+            max_gc: document.getElementById('stats-max-gc')
+        };
+        const columns = [
+            { key: 'index', label: '#' },
+            { key: 'title', label: 'Title' },
+            { key: 'length', label: 'Length' },
+            { key: 'gc', label: 'GC %' }
+        ];
+        let offset = 0;
+        let matched = 0;
+        let selectedIndex = null;
+        let filterTimer = null;
+        
+        function showSequenceStats(item) {
+            selectedIndex = item.index;
+            tableEl.querySelectorAll('tr[data-index]').forEach(tr => {
+                tr.classList.toggle('selected', parseInt(tr.dataset.index) === selectedIndex);
+            });
             statsContainer.style.opacity = '0.5';
             setTimeout(() => {
-                statsContainer.innerHTML = statsHTML;
+                statsContainer.innerHTML = generateSequenceStatsHTML(item, item.index);
                 statsContainer.style.opacity = '1';
                 addStatsCardEffects();
+                loadWindowProfile(item.index);
             }, 150);
         }
         
-        statsSelect.addEventListener('change', updateSequenceStats);
-        updateSequenceStats();
+        function loadPage() {
+            const params = {
+                offset: offset,
+                limit: STATS_PAGE_SIZE,
+                sort: tableEl.dataset.sort,
+                order: tableEl.dataset.order
+            };
+            Object.entries(filterInputs).forEach(([name, input]) => {
+                if (input && input.value.trim() !== '') params[name] = input.value.trim();
+            });
+            fetchStatsPage(params)
+                .then(data => {
+                    matched = data.matched;
+                    renderStatsTable(data.items);
+                    pageInfo.textContent = matched
+                        ? `${offset + 1}-${offset + data.items.length} of ${matched}` + (matched < data.sequences ? ` (${data.sequences} total)` : '')
+                        : 'No sequences match the filters';
+                    prevBtn.disabled = offset === 0;
+                    nextBtn.disabled = offset + STATS_PAGE_SIZE >= matched;
+                    // al abrir la página se muestran las estadísticas de la primera fila
+                    if (selectedIndex === null && data.items.length) {
+                        showSequenceStats(data.items[0]);
+                    }
+                })
+                .catch(error => showNotification('Error loading sequence statistics: ' + error.message, 'error'));
+        }
+        
+        function renderStatsTable(items) {
+            const arrow = tableEl.dataset.order === 'desc' ? '&#9660;' : '&#9650;';
+            let html = '<table class="stats-table" style="width: 100%; border-collapse: collapse;"><thead><tr>';
+            columns.forEach(column => {
+                const active = tableEl.dataset.sort === column.key;
+                html += `<th data-sort="${column.key}" style="cursor: pointer; text-align: left; padding: 6px; color: var(--accent-green);">${column.label} ${active ? arrow : ''}</th>`;
+            });
+            html += '</tr></thead><tbody>';
+            items.forEach(item => {
+                const selected = item.index === selectedIndex ? ' class="selected"' : '';
+                html += `<tr data-index="${item.index}"${selected} style="cursor: pointer;">
+                    <td style="padding: 6px;">${item.index + 1}</td>
+                    <td style="padding: 6px;">${escapeHtml(item.title)}</td>
+                    <td style="padding: 6px;">${item.length.toLocaleString()}</td>
+                    <td style="padding: 6px;">${item.gc.toFixed(2)}</td>
+                </tr>`;
+            });
+            html += '</tbody></table>';
+            tableEl.innerHTML = html;
+            
+            tableEl.querySelectorAll('th[data-sort]').forEach(th => {
+                th.addEventListener('click', () => {
+                    // mismo encabezado: invierte el orden; otro: orden ascendente por esa columna
+                    if (tableEl.dataset.sort === th.dataset.sort) {
+                        tableEl.dataset.order = tableEl.dataset.order === 'asc' ? 'desc' : 'asc';
+                    } else {
+                        tableEl.dataset.sort = th.dataset.sort;
+                        tableEl.dataset.order = 'asc';
+                    }
+                    offset = 0;
+                    loadPage();
+                });
+            });
+            tableEl.querySelectorAll('tr[data-index]').forEach((tr, i) => {
+                tr.addEventListener('click', () => showSequenceStats(items[i]));
+            });
+        }
+        
+        prevBtn.addEventListener('click', () => {
+            offset = Math.max(offset - STATS_PAGE_SIZE, 0);
+            loadPage();
+        });
+        nextBtn.addEventListener('click', () => {
+            if (offset + STATS_PAGE_SIZE < matched) {
+                offset += STATS_PAGE_SIZE;
+                loadPage();
+            }
+        });
+        Object.values(filterInputs).forEach(input => {
+            if (!input) return;
+            input.addEventListener('input', () => {
+                // se espera a que el usuario deje de escribir antes de pedir la página
+                clearTimeout(filterTimer);
+                filterTimer = setTimeout(() => {
+                    offset = 0;
+                    loadPage();
+                }, 300);
+            });
+        });
+        
+        loadPage();
+    }
+    
+    // Campo de texto con sugerencias de títulos buscadas en el servidor; onPick recibe el índice y el título
+    function initSequencePicker(input, onPick) {
+        const datalist = document.getElementById(input.getAttribute('list'));
+        const known = new Map();
+        let timer = null;
+        
+        function suggest(query) {
+            return fetchStatsPage({ q: query, limit: PICKER_SUGGESTIONS, sort: 'title' }).then(data => {
+                datalist.innerHTML = '';
+                data.items.forEach(item => {
+                    known.set(item.title, item.index);
+                    const option = document.createElement('option');
+                    option.value = item.title;
+                    datalist.appendChild(option);
+                });
+                return data.items;
+            });
+        }
+        
+        input.addEventListener('input', () => {
+            clearTimeout(timer);
+            timer = setTimeout(() => suggest(input.value.trim()).catch(() => {}), 250);
+        });
+        input.addEventListener('focus', () => {
+            if (!datalist.options.length) suggest('').catch(() => {});
+        });
+        if (!onPick) return;
+        input.addEventListener('change', () => {
+            const title = input.value;
+            if (known.has(title)) {
+                onPick(known.get(title), title);
+                return;
+            }
+            // título escrito sin elegir sugerencia: se busca la coincidencia exacta
+            suggest(title.trim())
+                .then(items => {
+                    const match = items.find(item => item.title === title);
+                    if (match) onPick(match.index, title);
+                })
+                .catch(() => {});
+        });
     }
     
     function generateSequenceStatsHTML(sequence, index) {
@@ -557,10 +741,78 @@ document.addEventListener('DOMContentLoaded', function() {
                     </h5>
                     ${generateProgressBarsHTML(sequence.bases, totalBases)}
                 </div>
+                
+                <div style="background-color: rgba(30, 30, 30, 0.5); padding: 1.5rem; border-radius: 8px; margin-top: 1.5rem;">
+                    <h5 style="color: var(--text-gray); margin-bottom: 1rem; display: flex; align-items: center;">
+                        <i class="fas fa-wave-square" style="margin-right: 0.5rem;"></i>
+                        Sliding-Window Profile
+                    </h5>
+                    <div id="window-profile" style="color: var(--text-gray);">Loading...</div>
+                </div>
             </div>
         `;
     }
     
+    function loadWindowProfile(index) {
+        const container = document.getElementById('window-profile');
+        if (!container) return;
+        // El servidor calcula las ventanas sobre la secuencia almacenada y devuelve ~400 puntos
+        fetchJson(`/datasets/${datasetId}/sequences/${index}/windows?points=400`)
+            .then(data => {
+                const runs = data.n_runs_total
+                    ? `${data.n_runs_total.toLocaleString()} N runs (${data.n_bases.toLocaleString()} N bases)`
+                    : 'No N runs';
+                container.innerHTML = `
+                    <div style="font-size: 0.85rem; margin-bottom: 0.5rem;">
+                        Window ${data.window.toLocaleString()} bp, step ${data.step.toLocaleString()} bp
+                        (${data.windows.toLocaleString()} windows) &middot; ${runs}
+                    </div>
+                    ${generateWindowChartHTML(data, 'gc', 'GC %', '#27ae60')}
+                    ${generateWindowChartHTML(data, 'gc_skew', 'GC skew', '#f39c12')}
+                    ${generateWindowChartHTML(data, 'cumulative_gc_skew', 'Cumulative GC skew', '#3498db')}
+                    <div style="font-size: 0.85rem;">
+                        Cumulative skew minimum at ${(data.skew_minimum || 0).toLocaleString()} bp,
+                        maximum at ${(data.skew_maximum || 0).toLocaleString()} bp
+                    </div>
+                `;
+            })
+            .catch(error => {
+                container.textContent = `Could not compute the window profile: ${error.message}`;
+            });
+    }
+    
+    function generateWindowChartHTML(data, series, label, color) {
+        const width = 600, height = 80;
+        const values = data[series];
+        const valid = values.filter(v => v !== null);
+        if (!valid.length) return '';
+        const min = Math.min(...valid), max = Math.max(...valid);
+        const span = max - min || 1;
+        // Una polilínea por tramo sin datos (ventanas solo de N)
+        const segments = [[]];
+        values.forEach((v, i) => {
+            if (v === null) {
+                if (segments[segments.length - 1].length) segments.push([]);
+                return;
+            }
+            const x = values.length > 1 ? (i / (values.length - 1)) * width : width / 2;
+            const y = height - ((v - min) / span) * height;
+            segments[segments.length - 1].push(`${x.toFixed(1)},${y.toFixed(1)}`);
+        });
+        const lines = segments.filter(points => points.length)
+            .map(points => `<polyline points="${points.join(' ')}" fill="none" stroke="${color}" stroke-width="1.5"/>`)
+            .join('');
+        return `
+            <div style="display: flex; justify-content: space-between; font-size: 0.8rem;">
+                <span>${label}</span><span>${min.toFixed(3)} – ${max.toFixed(3)}</span>
+            </div>
+            <svg viewBox="0 0 ${width} ${height}" preserveAspectRatio="none"
+                 style="width: 100%; height: ${height}px; background-color: rgba(0, 0, 0, 0.2); margin-bottom: 0.75rem;">
+                ${lines}
+            </svg>
+        `;
+    }
+    
     function generateBaseCompositionHTML(bases, totalBases) {
         const baseColors = {
             'A': '#e74c3c',
@@ -641,92 +893,122 @@ document.addEventListener('DOMContentLoaded', function() {
         const dnaDisplay = document.getElementById('dna-sequence-display');
         
         function updateSequenceDisplay() {
-            const selectedIndex = parseInt(sequenceSelect.value);
-            const selectedSequence = sequences[selectedIndex];
-            
-            dnaDisplay.innerHTML = '';
+            const selectedIndex = parseInt(sequenceSelect.dataset.index);
             
-            const sequenceToShow = selectedSequence.sequence.slice(0, 120);
-            
-            sequenceToShow.split('').forEach(base => {
-                const span = document.createElement('span');
-                span.textContent = base;
-                span.className = `dna-base ${base.toUpperCase()}`;
-                dnaDisplay.appendChild(span);
-            });
-            
-            if (selectedSequence.sequence.length > 120) {
-                const moreIndicator = document.createElement('span');
-                moreIndicator.style.color = 'var(--text-gray)';
-                moreIndicator.textContent = ` ... (${selectedSequence.sequence.length - 120} more)`;
-                dnaDisplay.appendChild(moreIndicator);
-            }
+            // solo se piden al servidor las primeras 120 bases de la secuencia elegida
+            fetch(`/datasets/${datasetId}/sequences/${selectedIndex}?end=120`)
+                .then(response => response.json())
+                .then(data => {
+                    if (data.error) throw new Error(data.error);
+                    dnaDisplay.innerHTML = '';
+                    
+                    data.sequence.split('').forEach(base => {
+                        const span = document.createElement('span');
+                        span.textContent = base;
+                        span.className = `dna-base ${base.toUpperCase()}`;
+                        dnaDisplay.appendChild(span);
+                    });
+                    
+                    if (data.length > 120) {
+                        const moreIndicator = document.createElement('span');
+                        moreIndicator.style.color = 'var(--text-gray)';
+                        moreIndicator.textContent = ` ... (${data.length - 120} more)`;
+                        dnaDisplay.appendChild(moreIndicator);
+                    }
+                })
+                .catch(error => showNotification('Error loading sequence: ' + error.message, 'error'));
         }
         
-        sequenceSelect.addEventListener('change', updateSequenceDisplay);
-        updateSequenceDisplay();
+        // la primera secuencia ya viene renderizada en el HTML
+        initSequencePicker(sequenceSelect, index => {
+            sequenceSelect.dataset.index = index;
+            updateSequenceDisplay();
+        });
     }
     
     function initDistanceCalculator() {
         const seq1Select = document.getElementById('seq-select-1');
         const seq2Select = document.getElementById('seq-select-2');
         const distanceResult = document.getElementById('distance-result');
+        const nearestEl = document.getElementById('nearest-sequences');
+        if (!seq1Select) return;
+        // los valores son títulos: basta con sugerirlos, el servidor los resuelve
+        initSequencePicker(seq1Select);
+        initSequencePicker(seq2Select);
+        
+        function showDistance(distance) {
+            if (distance === null || distance === undefined) {
+                distanceResult.textContent = 'N/A';
+                distanceResult.style.color = 'var(--text-gray)';
+                return;
+            }
+            distanceResult.textContent = distance.toFixed(4);
+            
+            if (distance < 0.1) {
+                distanceResult.style.color = 'var(--accent-green)';
+            } else if (distance < 0.3) {
+                distanceResult.style.color = '#f1c40f';
+            } else {
+                distanceResult.style.color = 'var(--primary-red)';
+            }
+            
+            distanceResult.classList.add('distance-highlight');
+            setTimeout(() => {
+                distanceResult.classList.remove('distance-highlight');
+            }, 1000);
+        }
         
         function updateDistance() {
             const seq1 = seq1Select.value;
             const seq2 = seq2Select.value;
+            if (!treeKey) return;
             
-            distanceResult.classList.add('loading');
+            if (seq1 === seq2) {
+                showDistance(0);
+                return;
+            }
             
-            setTimeout(() => {
-                if (seq1 === seq2) {
-                    distanceResult.textContent = '0.0000';
-                    distanceResult.style.color = 'var(--accent-green)';
-                } else {
-                    const key1 = `${seq1}|${seq2}`;
-                    const key2 = `${seq2}|${seq1}`;
-                    
-                    let distance = distanceMatrix[key1] || distanceMatrix[key2];
-                    
-                    if (distance !== undefined) {
-                        distanceResult.textContent = distance.toFixed(4);
-                        
-                        if (distance < 0.1) {
-                            distanceResult.style.color = 'var(--accent-green)';
-                        } else if (distance < 0.3) {
-                            distanceResult.style.color = '#f1c40f';
-                        } else {
-                            distanceResult.style.color = 'var(--primary-red)';
-                        }
-                        
-                        distanceResult.classList.add('distance-highlight');
-                        setTimeout(() => {
-                            distanceResult.classList.remove('distance-highlight');
-                        }, 1000);
-                        
-                    } else {
-                        distanceResult.textContent = 'N/A';
-                        distanceResult.style.color = 'var(--text-gray)';
+            distanceResult.classList.add('loading');
+            // una sola pareja: el servidor la busca en la matriz condensada sin que enviemos nada más
+            fetch(`/distances/${treeKey}/pairs`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ pairs: [[seq1, seq2]] })
+            })
+                .then(response => response.json())
+                .then(data => showDistance(data.distances ? data.distances[0] : null))
+                .catch(() => showDistance(null))
+                .finally(() => distanceResult.classList.remove('loading'));
+        }
+        
+        function updateNearest() {
+            if (!treeKey || !nearestEl) return;
+            // las 5 secuencias más cercanas a la primera elegida
+            fetch(`/distances/${treeKey}/nearest?name=${encodeURIComponent(seq1Select.value)}&k=5`)
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.neighbours || !data.neighbours.length) {
+                        nearestEl.textContent = '';
+                        return;
                     }
-                }
-                
-                distanceResult.classList.remove('loading');
-            }, 300);
+                    nearestEl.textContent = 'Closest: ' + data.neighbours
+                        .map(n => `${n.name} (${n.distance.toFixed(4)})`).join(', ');
+                })
+                .catch(() => { nearestEl.textContent = ''; });
         }
         
-        seq1Select.addEventListener('change', updateDistance);
+        seq1Select.addEventListener('change', () => { updateDistance(); updateNearest(); });
         seq2Select.addEventListener('change', updateDistance);
         updateDistance();
+        updateNearest();
     }
     
     function initMotifSearch() {
         const motifInput = document.getElementById('motif-input');
-        const searchButton = document.querySelector('.panel button[style*="width: 100%"]');
+        const searchButton = document.getElementById('motif-search-btn');
         
         searchButton.addEventListener('click', function() {
-            const motif = motifInput.value.trim().toUpperCase();
-            
-            searchMotifInSequences(motif);
+            searchMotifInSequences(motifInput.value.trim().toUpperCase(), 1);
         });
         
         motifInput.addEventListener('keypress', function(e) {
@@ -736,46 +1018,42 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
-    function searchMotifInSequences(motif) {
-        const results = [];
-        
-        const validBases = /^[ATCGN]+$/i;
-        
-        sequences.forEach((seq, seqIndex) => {
-            const sequence = seq.sequence.toUpperCase();
-            let position = 0;
-            
-            while ((position = sequence.indexOf(motif, position)) !== -1) {
-                results.push({
-                    sequenceTitle: seq.title,
-                    position: position + 1,
-                    endPosition: position + motif.length,
-                    context: getSequenceContext(sequence, position, motif.length)
-                });
-                position++;
-            }
+    // La búsqueda se hace en el servidor (índice FM del dataset), aquí solo se pide una página de resultados
+    function searchMotifInSequences(motif, page) {
+        if (!motif) {
+            showNotification('Enter a motif to search', 'warning');
+            return;
+        }
+        const params = new URLSearchParams({
+            q: motif,
+            strands: document.getElementById('motif-strands').value,
+            mismatches: document.getElementById('motif-mismatches').value,
+            page: page,
+            per_page: MOTIF_PAGE_SIZE
         });
         
-        displayMotifResults(motif, results);
-        
-        if (results.length > 0) {
-            showNotification(`Found ${results.length} matches`, 'success');
-        } else {
-            showNotification('No matches found', 'warning');
-        }
-    }
-    
-    function getSequenceContext(sequence, position, motifLength, contextSize = 10) {
-        const start = Math.max(0, position - contextSize);
-        const end = Math.min(sequence.length, position + motifLength + contextSize);
-        const before = sequence.slice(start, position);
-        const motif = sequence.slice(position, position + motifLength);
-        const after = sequence.slice(position + motifLength, end);
-        
-        return { before, motif, after };
+        fetch(`/datasets/${datasetId}/motifs?${params}`)
+            .then(response => response.json().then(data => {
+                if (!response.ok) {
+                    throw new Error(data.error || `HTTP ${response.status}`);
+                }
+                return data;
+            }))
+            .then(data => {
+                displayMotifResults(data);
+                // Solo se avisa en la primera página, no al paginar
+                if (page === 1) {
+                    if (data.total > 0) {
+                        showNotification(`Found ${data.total} matches`, 'success');
+                    } else {
+                        showNotification('No matches found', 'warning');
+                    }
+                }
+            })
+            .catch(error => showNotification('Error searching motif: ' + error.message, 'error'));
     }
     
-    function displayMotifResults(motif, results) {
+    function displayMotifResults(data) {
         let resultsContainer = document.querySelector('.motif-results');
         
         if (!resultsContainer) {
@@ -789,7 +1067,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 resultsContainer.className = 'motif-results';
                 resultsContainer.style.marginTop = '1.5rem';
                 
-                const button = panel.querySelector('button');
+                const button = panel.querySelector('#motif-search-btn');
                 if (button && button.parentNode) {
                     button.parentNode.insertBefore(resultsContainer, button.nextSibling);
                 }
@@ -799,11 +1077,11 @@ document.addEventListener('DOMContentLoaded', function() {
         resultsContainer.innerHTML = '';
         
         const resultsTitle = document.createElement('h4');
-        resultsTitle.textContent = `Results for "${motif}":`;
+        resultsTitle.textContent = `Results for "${data.motif}":`;
         resultsTitle.style.color = 'var(--accent-green)';
         resultsContainer.appendChild(resultsTitle);
         
-        if (results.length === 0) {
+        if (data.hits.length === 0) {
             const noResults = document.createElement('p');
             noResults.textContent = 'No matches found.';
             noResults.style.color = 'var(--text-gray)';
@@ -814,7 +1092,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const resultsList = document.createElement('div');
         resultsList.style.marginTop = '1rem';
         
-        results.forEach((result, index) => {
+        data.hits.forEach(hit => {
             const resultItem = document.createElement('div');
             resultItem.className = 'motif-result-item';
             resultItem.style.cssText = `
@@ -826,19 +1104,20 @@ document.addEventListener('DOMContentLoaded', function() {
                 transition: all 0.3s ease;
             `;
             
+            // Posiciones en base 1 para mostrarlas; el contexto es siempre la hebra directa
+            const details = `Position ${hit.start + 1}-${hit.end} (${hit.strand})` +
+                (hit.mismatches ? `, ${hit.mismatches} mismatch${hit.mismatches > 1 ? 'es' : ''}` : '');
             resultItem.innerHTML = `
                 <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 0.5rem;">
-                    <strong style="color: var(--accent-green);">${result.sequenceTitle}</strong>
-                    <span style="color: var(--text-gray); font-size: 0.9rem;">
-                        Position ${result.position}-${result.endPosition}
-                    </span>
+                    <strong style="color: var(--accent-green);"></strong>
+                    <span style="color: var(--text-gray); font-size: 0.9rem;">${details}</span>
+                </div>
+                <div style="font-family: 'Courier New', monospace; font-size: 0.9rem; background-color: rgba(0,0,0,0.3); padding: 0.5rem; border-radius: 3px; overflow-x: auto;">
+                    <span style="color: #95a5a6;">${hit.before}</span><span style="color: var(--accent-green); font-weight: bold; background-color: rgba(42, 157, 143, 0.3);">${hit.match}</span><span style="color: #95a5a6;">${hit.after}</span>
                 </div>
-                ${result.context ? `
-                    <div style="font-family: 'Courier New', monospace; font-size: 0.9rem; background-color: rgba(0,0,0,0.3); padding: 0.5rem; border-radius: 3px; overflow-x: auto;">
-                        <span style="color: #95a5a6;">${result.context.before}</span><span style="color: var(--accent-green); font-weight: bold; background-color: rgba(42, 157, 143, 0.3);">${result.context.motif}</span><span style="color: #95a5a6;">${result.context.after}</span>
-                    </div>
-                ` : ''}
             `;
+            // El título viene del usuario, se inserta como texto
+            resultItem.querySelector('strong').textContent = hit.title;
             
             resultItem.addEventListener('mouseenter', function() {
                 this.style.backgroundColor = 'rgba(42, 157, 143, 0.2)';
@@ -855,6 +1134,28 @@ document.addEventListener('DOMContentLoaded', function() {
         
         resultsContainer.appendChild(resultsList);
         
+        // Paginación sobre los resultados localizados en el servidor
+        const pages = Math.max(1, Math.ceil(data.located / data.per_page));
+        if (pages > 1) {
+            const pager = document.createElement('div');
+            pager.style.cssText = 'display: flex; justify-content: space-between; align-items: center; margin-top: 0.5rem;';
+            const previous = document.createElement('button');
+            previous.className = 'btn btn-secondary';
+            previous.textContent = 'Previous';
+            previous.disabled = data.page <= 1;
+            previous.addEventListener('click', () => searchMotifInSequences(data.motif, data.page - 1));
+            const next = document.createElement('button');
+            next.className = 'btn btn-secondary';
+            next.textContent = 'Next';
+            next.disabled = data.page >= pages;
+            next.addEventListener('click', () => searchMotifInSequences(data.motif, data.page + 1));
+            const label = document.createElement('span');
+            label.style.color = 'var(--text-gray)';
+            label.textContent = `Page ${data.page} of ${pages}`;
+            pager.append(previous, label, next);
+            resultsContainer.appendChild(pager);
+        }
+        
         const stats = document.createElement('div');
         stats.style.cssText = `
             margin-top: 1rem;
@@ -864,22 +1165,21 @@ document.addEventListener('DOMContentLoaded', function() {
             border: 1px solid rgba(42, 157, 143, 0.3);
         `;
         
-        const uniqueSequences = new Set(results.map(r => r.sequenceTitle)).size;
-        const avgPositions = results.length > 0 ? (results.reduce((sum, r) => sum + r.position, 0) / results.length).toFixed(1) : 0;
+        const forward = data.hits.filter(hit => hit.strand === '+').length;
         
         stats.innerHTML = `
             <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(150px, 1fr)); gap: 1rem; text-align: center;">
                 <div>
-                    <div style="font-size: 1.5rem; font-weight: bold; color: var(--accent-green);">${results.length}</div>
+                    <div style="font-size: 1.5rem; font-weight: bold; color: var(--accent-green);">${data.total}</div>
                     <div style="color: var(--text-gray); font-size: 0.9rem;">Total matches</div>
                 </div>
                 <div>
-                    <div style="font-size: 1.5rem; font-weight: bold; color: var(--accent-green);">${uniqueSequences}</div>
+                    <div style="font-size: 1.5rem; font-weight: bold; color: var(--accent-green);">${data.sequences}</div>
                     <div style="color: var(--text-gray); font-size: 0.9rem;">Sequences affected</div>
                 </div>
                 <div>
-                    <div style="font-size: 1.5rem; font-weight: bold; color: var(--accent-green);">${avgPositions}</div>
-                    <div style="color: var(--text-gray); font-size: 0.9rem;">Average position</div>
+                    <div style="font-size: 1.5rem; font-weight: bold; color: var(--accent-green);">${forward} / ${data.hits.length - forward}</div>
+                    <div style="color: var(--text-gray); font-size: 0.9rem;">Forward / reverse (this page)</div>
                 </div>
             </div>
         `;
@@ -908,8 +1208,12 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     function copySequencesToClipboard() {
+        loadSequences().then(copyFasta).catch(() => {});
+    }
+    
+    function copyFasta(fullSequences) {
         let fastaContent = '';
-        sequences.forEach(seq => {
+        fullSequences.forEach(seq => {
             fastaContent += `>${seq.title}\n${seq.sequence}\n`;
         });
         
@@ -927,50 +1231,52 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     function exportToFASTA() {
-        const exportButton = document.getElementById('export-fasta-btn') || 
-                           Array.from(document.querySelectorAll('button')).find(btn => 
-                               btn.textContent.includes('Exportar FASTA'));
-        
-        const originalHTML = exportButton.innerHTML;
-        exportButton.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Exporting...';
-        exportButton.disabled = true;
-        
-        fetch('/export_fasta', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                sequences: sequences
+        const format = document.getElementById('export-format').value;
+        const params = new URLSearchParams({ format: format });
+        params.set('wrap', document.getElementById('export-wrap').value || '0');
+        if (document.getElementById('export-gzip').checked) {
+            params.set('gzip', '1');
+        }
+        // alineamiento, consenso y Newick salen del árbol, que puede no estar listo todavía
+        if (format !== 'fasta' && !treeKey) {
+            showNotification('The phylogenetic tree is not ready yet', 'warning');
+            return;
+        }
+        if (treeKey) {
+            params.set('tree', treeKey);
+        }
+        if (document.getElementById('export-filtered').checked) {
+            // los mismos filtros que la tabla de estadísticas
+            const filters = {
+                q: 'stats-filter-title',
+                min_length: 'stats-min-length',
+                max_length: 'stats-max-length',
+                min_gc: 'stats-min-gc',
+                max_gc: 'stats-max-gc'
+            };
+            Object.entries(filters).forEach(([name, id]) => {
+                const value = document.getElementById(id).value.trim();
+                if (value !== '') params.set(name, value);
+            });
+        }
+        
+        const url = `/datasets/${datasetId}/export?${params}`;
+        // HEAD valida la selección sin generar el archivo; los errores llegan como JSON en el GET
+        fetch(url, { method: 'HEAD' })
+            .then(response => {
+                if (!response.ok) {
+                    return fetchJson(url);
+                }
+                // el navegador descarga la respuesta directamente a disco mientras el servidor la va escribiendo
+                const a = document.createElement('a');
+                a.href = url;
+                a.download = '';
+                document.body.appendChild(a);
+                a.click();
+                document.body.removeChild(a);
+                showNotification('Export started', 'success');
             })
-        })
-        .then(response => {
-            return response.blob();
-        })
-        .then(blob => {
-            const url = window.URL.createObjectURL(blob);
-            const a = document.createElement('a');
-            a.href = url;
-            
-            const now = new Date();
-            const timestamp = now.toISOString().slice(0,19).replace(/[:-]/g, '').replace('T', '_');
-            a.download = `genomics_freedom_export_${timestamp}.fasta`;
-            
-            document.body.appendChild(a);
-            a.click();
-            document.body.removeChild(a);
-            
-            window.URL.revokeObjectURL(url);
-            
-            showNotification(`FASTA file exported: ${a.download}`, 'success');
-        })
-        .catch(error => {
-            showNotification('Error exporting FASTA file: ' + error.message, 'error');
-        })
-        .finally(() => {
-            exportButton.innerHTML = originalHTML;
-            exportButton.disabled = false;
-        });
+            .catch(error => showNotification('Error exporting: ' + error.message, 'error'));
     }
 });
 
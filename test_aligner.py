@@ -0,0 +1,150 @@
+"""aligner.py: binary discovery, failures, timeouts and the slot cap with a stub MUSCLE."""
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+import aligner
+from aligner import AlignerError, MuscleExecutor, find_muscle
+from jobs import DONE, JobManager
+
+# MUSCLE 5 stand-in: writes the records back gap-padded and in reverse order (MUSCLE reorders them),
+# logs when it starts and stops, and sleeps / fails when the first sequence asks it to
+STUB = '''#!{python}
+import sys, time
+args = sys.argv[1:]
+if '-version' in args:
+    print('muscle 5.1.linux64')
+    sys.exit(0)
+text = open(args[args.index('-align') + 1]).read()
+records = [block.split('\\n', 1) for block in text.split('>')[1:]]
+width = max(len(sequence.strip()) for _, sequence in records)
+first = records[0][1].strip()
+with open({log!r}, 'a') as log:
+    log.write(f"start {{time.time()}}\\n")
+if first.startswith('SLEEP'):
+    time.sleep(float(first[5:].replace('A', '')) / 10)
+if first == 'FAIL':
+    sys.stderr.write('stub failure')
+    sys.exit(3)
+with open(args[args.index('-output') + 1], 'w') as out:
+    for name, sequence in reversed(records):
+        out.write(f">{{name}}\\n{{sequence.strip().ljust(width, '-')}}\\n")
+with open({log!r}, 'a') as log:
+    log.write(f"end {{time.time()}}\\n")
+'''
+
+
+@pytest.fixture
+def stub(tmp_path):
+    path = tmp_path / 'muscle'
+    path.write_text(STUB.format(python=sys.executable, log=str(tmp_path / 'runs.log')))
+    path.chmod(0o755)
+    return str(path)
+
+
+def _max_overlap(log_path):
+    """Most stub runs that were going at once, from its start/end log"""
+    events = sorted((float(t), 1 if kind == 'start' else -1)
+                    for kind, t in (line.split() for line in open(log_path)))
+    running = peak = 0
+    for _, change in events:
+        running += change
+        peak = max(peak, running)
+    return peak
+
+
+def test_find_muscle(stub, tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmp_path / 'empty'))
+    monkeypatch.setenv('GF_MUSCLE_PATH', str(tmp_path / 'missing'))
+    assert find_muscle(str(tmp_path / 'also-missing')) is None
+    assert find_muscle(stub) == stub
+    monkeypatch.setenv('GF_MUSCLE_PATH', stub)
+    assert find_muscle() == stub
+    # A file that isn't executable doesn't count
+    (tmp_path / 'plain').write_text('')
+    monkeypatch.setenv('GF_MUSCLE_PATH', str(tmp_path / 'plain'))
+    assert find_muscle() is None
+    monkeypatch.setenv('PATH', str(tmp_path))
+    assert find_muscle() == stub
+
+
+def test_rows_come_back_in_input_order(stub):
+    executor = MuscleExecutor(stub)
+    assert executor.version == 5
+    alignment = executor.align([('first title', 'ACGT'), ('second', 'AC-T'), ('third', 'GGGG')])
+    assert [(record.id, str(record.seq)) for record in alignment] == [
+        ('first title', 'ACGT'), ('second', 'AC-T'), ('third', 'GGGG')]
+    assert executor.stats()['runs'] == 1
+
+
+def test_failures_raise_aligner_error(stub):
+    executor = MuscleExecutor(stub)
+    with pytest.raises(AlignerError, match='stub failure'):
+        executor.align([('a', 'FAIL'), ('b', 'ACGT')])
+    with pytest.raises(AlignerError):
+        executor.align([('a', 'ACGT')])
+    assert executor.stats()['failures'] == 1
+
+
+def test_timeout_kills_muscle_and_removes_its_directory(stub, tmp_path, monkeypatch):
+    work = tmp_path / 'work'
+    work.mkdir()
+    monkeypatch.setattr(aligner.tempfile, 'tempdir', str(work))
+    executor = MuscleExecutor(stub)
+    started = time.time()
+    with pytest.raises(AlignerError, match='timed out'):
+        executor.align([('a', 'SLEEP100'), ('b', 'ACGT')], timeout=0.5)
+    assert time.time() - started < 5
+    assert os.listdir(work) == []
+    assert executor.stats()['timeouts'] == 1
+
+    def cancelled():
+        raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        executor.align([('a', 'SLEEP100'), ('b', 'ACGT')], check=cancelled)
+    assert os.listdir(work) == []
+    assert executor.stats()['cancelled'] == 1
+
+
+def _align_in_threads(executor, n=4):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(len(executor.align([('a', 'SLEEP3'), ('b', 'ACGT')]))))
+               for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [2] * n
+
+
+def test_slots_cap_concurrent_runs(stub, tmp_path):
+    _align_in_threads(MuscleExecutor(stub, max_parallel=2))
+    assert _max_overlap(tmp_path / 'runs.log') == 2
+
+
+def test_shared_slots_override_the_local_cap(stub, tmp_path, monkeypatch):
+    monkeypatch.setattr(aligner, '_shared_slots', None)
+    aligner.share_slots(multiprocessing.get_context('spawn').BoundedSemaphore(1))
+    _align_in_threads(MuscleExecutor(stub, max_parallel=4))
+    assert _max_overlap(tmp_path / 'runs.log') == 1
+
+
+def align_job(path, progress=None):
+    return len(MuscleExecutor(path, max_parallel=4).align([('a', 'SLEEP3'), ('b', 'ACGT')]))
+
+
+def test_job_workers_share_one_cap(stub, tmp_path):
+    manager = JobManager(max_workers=3, max_queue=3, muscle_parallel=1)
+    try:
+        job_ids = [manager.submit(align_job, stub) for _ in range(3)]
+        end = time.time() + 60
+        while any(manager.status(job_id)['status'] != DONE for job_id in job_ids) and time.time() < end:
+            time.sleep(0.05)
+        assert [manager.result(job_id) for job_id in job_ids] == [2, 2, 2]
+    finally:
+        manager.shutdown()
+    assert _max_overlap(tmp_path / 'runs.log') == 1
@@ -0,0 +1,90 @@
+"""alignment_profile.py: column statistics and identities against per-column and per-pair loops."""
+import math
+import random
+
+import numpy as np
+import pytest
+
+import alignment_profile
+from alignment_profile import SYMBOLS, AlignmentProfile
+from composition import annotate_sequences
+from dataset_store import DatasetStore
+
+RESIDUES = 'ACGTN'
+
+
+def _rows(n=15, length=70, seed=0):
+    rng = random.Random(seed)
+    reference = [rng.choice('ACGT') for _ in range(length)]
+    rows = []
+    for _ in range(n):
+        row = [rng.choice('ACGTNRY--') if rng.random() < 0.3 else base for base in reference]
+        rows.append(''.join(row))
+    rows.append('-' * length)
+    return rows
+
+
+def _symbol(c):
+    c = c.upper().replace('U', 'T')
+    return c if c in 'ACGT-' else ('-' if c == '.' else 'N')
+
+
+def test_columns_match_a_per_column_count():
+    rows = _rows()
+    profile = AlignmentProfile.from_rows([f"r{i}" for i in range(len(rows))], rows)
+    for column in range(len(rows[0])):
+        symbols = [_symbol(row[column]) for row in rows]
+        counts = [symbols.count(s) for s in RESIDUES]
+        total = sum(counts)
+        if total:
+            top = max(range(len(RESIDUES)), key=lambda k: (counts[k], -k))
+            assert SYMBOLS[profile.consensus_codes[column]] == RESIDUES[top]
+            assert math.isclose(profile.conservation[column], counts[top] / total)
+            entropy = -sum(c / total * math.log2(c / total) for c in counts if c)
+            assert math.isclose(profile.entropy[column], entropy, abs_tol=1e-12)
+        else:
+            assert SYMBOLS[profile.consensus_codes[column]] == '-'
+        assert profile.distinct[column] == sum(1 for c in counts if c)
+        assert math.isclose(profile.gap_fraction[column], symbols.count('-') / len(rows))
+
+
+def _identity(a, b):
+    compared = [(x, y) for x, y in zip(a, b) if x != '-' and y != '-']
+    return 100.0 * sum(x == y for x, y in compared) / len(compared) if compared else None
+
+
+@pytest.mark.parametrize('block', [512, 4, 1])
+def test_identities_match_a_per_pair_loop(monkeypatch, block):
+    # Small blocks split both sides of the pair matrix, unevenly
+    monkeypatch.setattr(alignment_profile, 'IDENTITY_BLOCK', block)
+    rows = [''.join(_symbol(c) for c in row) for row in _rows(seed=1)]
+    profile = AlignmentProfile.from_rows([f"r{i}" for i in range(len(rows))], rows)
+    matrix = profile.identity_matrix()
+    expected = [[_identity(a, b) for b in rows] for a in rows]
+    assert np.allclose(matrix, np.array(expected, dtype=np.float64), equal_nan=True)
+    assert np.allclose(profile.identity_matrix(limit=4, row=3, col=9), matrix[3:7, 9:13], equal_nan=True)
+    pairs = [expected[i][j] for i in range(len(rows)) for j in range(i + 1, len(rows)) if expected[i][j] is not None]
+    assert math.isclose(profile.average_identity(), sum(pairs) / len(pairs))
+
+
+def test_summary_computes_the_average_identity_only_when_asked(monkeypatch):
+    rows = _rows(seed=2)
+    profile = AlignmentProfile.from_rows([f"r{i}" for i in range(len(rows))], rows)
+    calls = []
+    average = profile.average_identity
+    monkeypatch.setattr(profile, 'average_identity', lambda: calls.append(1) or average())
+    assert 'average_identity' not in profile.summary()
+    assert not calls
+    assert profile.summary(identity=True)['average_identity'] == average()
+
+
+def test_dataset_profile_is_the_gap_padded_rows(tmp_path):
+    sequences = [{'title': f"s{i}", 'sequence': s} for i, s in enumerate(['ACGTNacgt', 'AC', '', 'GGGRYA'])]
+    annotate_sequences(sequences)
+    store = DatasetStore(str(tmp_path))
+    profile = AlignmentProfile.from_dataset(store.get(store.put(sequences)))
+    rows = [s['sequence'].ljust(9, '-') for s in sequences]
+    expected = AlignmentProfile.from_rows([s['title'] for s in sequences], rows)
+    assert profile.source == 'padded'
+    assert np.array_equal(profile.codes, expected.codes)
+    assert np.array_equal(profile.counts, expected.counts)
@@ -0,0 +1,31 @@
+"""batch.py: outputs and the cache directory, run from an unrelated working directory."""
+import json
+import os
+import subprocess
+import sys
+
+import batch
+
+FASTA = ''.join(f">{title}\n{sequence * 3}\n" for title, sequence in
+                [('a', 'ACGTACGTAAACGTTGCA'), ('b', 'ACGTACGTTTACGTTGCA'), ('c', 'TTGTACGTTTACGATGCA')])
+
+
+def test_default_cache_is_next_to_the_module():
+    assert batch.DEFAULT_CACHE_DIR == os.path.join(os.path.dirname(os.path.abspath(batch.__file__)), 'uploads', 'cache')
+
+
+def test_cache_dir_option(tmp_path):
+    work = tmp_path / 'work'
+    work.mkdir()
+    (work / 'reads.fa').write_text(FASTA)
+    env = dict(os.environ, GF_STAGE_LOG='0')
+    env.pop('GF_CACHE_DIR', None)
+    command = [sys.executable, batch.__file__, 'reads.fa', '-o', 'out', '--jobs', '1', '--method', 'sketch',
+               '--cache-dir', str(tmp_path / 'cache')]
+    subprocess.run(command, cwd=work, env=env, check=True, capture_output=True)
+    # Nothing is written relative to the working directory besides the outputs
+    assert sorted(os.listdir(work)) == ['out', 'reads.fa']
+    assert any(name.endswith('.npz') for name in os.listdir(tmp_path / 'cache'))
+    stats = json.loads((work / 'out' / 'reads' / 'stats.json').read_text())
+    assert stats['tree']['method'] == 'sketch'
+    assert (work / 'out' / 'reads' / 'tree.nwk').read_text().strip().endswith(';')
@@ -0,0 +1,59 @@
+"""composition.py: the LUT/bincount kernel against the original per-character loop and gc_fraction."""
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+from Bio.SeqUtils import gc_fraction
+
+import composition
+from composition import CLASSES, annotate_sequences, count_classes
+
+
+def _baseline(sequence):
+    """The per-sequence stats the upload route used to compute"""
+    bases = {'A': 0, 'T': 0, 'C': 0, 'G': 0, 'N': 0}
+    for base in sequence.upper():
+        if base in bases:
+            bases[base] += 1
+        else:
+            bases['N'] += 1
+    return {'length': len(sequence), 'gc': 100 * gc_fraction(sequence, ambiguous='ignore'), 'bases': bases}
+
+
+def _sequences(seed=0):
+    rng = random.Random(seed)
+    alphabet = 'ACGTacgtNnRYSWKMBDHVryswkmbdhvUu-.*X0 '
+    sequences = [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 200))) for _ in range(40)]
+    return sequences + ['', 'SSSS', 'gggccc', 'N' * 10, 'ACGT' * 500]
+
+
+@pytest.fixture(params=[1 << 22, 64])
+def batch_bases(request, monkeypatch):
+    # 64 bases per batch spreads the sequences over many batches, and makes the long ones go alone
+    monkeypatch.setattr(composition, 'BATCH_BASES', request.param)
+    return request.param
+
+
+def test_stats_match_the_per_character_loop(batch_bases):
+    sequences = _sequences()
+    records = [{'sequence': s} for s in sequences]
+    annotate_sequences(records)
+    for record, sequence in zip(records, sequences):
+        expected = _baseline(sequence)
+        assert record['length'] == expected['length']
+        assert record['gc'] == pytest.approx(expected['gc'], abs=1e-9)
+        assert record['bases'] == expected['bases']
+
+
+def test_class_counts_match_counter(batch_bases):
+    sequences = _sequences(seed=1)
+    counts = count_classes(sequences)
+    for row, sequence in zip(counts, sequences):
+        counter = Counter(c.upper() if c.upper() in CLASSES else ('-' if c == '.' else 'other') for c in sequence)
+        assert row.tolist() == [counter.get(name, 0) for name in CLASSES]
+
+
+def test_bytes_and_str_count_the_same():
+    sequences = _sequences(seed=2)
+    assert np.array_equal(count_classes(sequences), count_classes([s.encode('ascii') for s in sequences]))
@@ -0,0 +1,54 @@
+"""dataset_store.py: decoding round trips, and extend() against storing everything at once."""
+import random
+
+import numpy as np
+import pytest
+
+from composition import annotate_sequences
+from dataset_store import _ARRAYS, DatasetStore
+
+
+def _records(sequences, first=0):
+    records = [{'title': f"s{first + i}", 'sequence': s} for i, s in enumerate(sequences)]
+    annotate_sequences(records)
+    return records
+
+
+def _random(n, seed):
+    rng = random.Random(seed)
+    return [''.join(rng.choice('ACGTACGTacgtNnRY-') for _ in range(rng.randint(0, 50))) for _ in range(n)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return DatasetStore(str(tmp_path))
+
+
+def test_sequences_decode_as_stored(store):
+    records = _records(_random(20, seed=0) + ['', 'N' * 9, 'acgtn' * 7])
+    dataset = store.get(store.put(records))
+    assert list(dataset.records()) == [{'title': r['title'], 'sequence': r['sequence']} for r in records]
+    assert dataset.sequence(22, 3, 11) == records[22]['sequence'][3:11]
+    assert dataset.stats[0] == {key: records[0][key] for key in ('length', 'gc', 'bases')}
+
+
+@pytest.mark.parametrize('old, new', [
+    # Runs of Ns and of lower case carried across the cut, which falls inside a packed byte
+    (['ACGTA', 'acgNN'], ['NNacg', 'TTTT']),
+    (['ACGT'], ['nnnn', 'ACGT']),
+    (_random(9, seed=1), _random(6, seed=2)),
+])
+def test_extend_matches_a_single_put(store, old, new):
+    base = store.get(store.put(_records(old)))
+    extended = store.get(store.extend(base, _records(new, first=len(old))))
+    whole = store.get(store.put(_records(old + new)))
+    for name in _ARRAYS:
+        assert np.array_equal(getattr(extended, name), getattr(whole, name)), name
+    assert extended.titles == whole.titles and extended.stats == whole.stats
+    assert [r['sequence'] for r in extended.records()] == old + new
+
+
+@pytest.mark.parametrize('dataset_id', [None, 12, ['ab'], {'id': 'ab'}, '', 'ABC', '../x', 'abc'])
+def test_bad_or_unknown_ids_are_not_found(store, dataset_id):
+    # Ids come straight from JSON bodies and URLs
+    assert store.get(dataset_id) is None
@@ -0,0 +1,110 @@
+"""dedup.py: exact and near-identical reduction, the prefilter bound and the expand round trip."""
+import random
+
+import numpy as np
+import pytest
+
+import dedup
+from dedup import identity, reduce_sequences
+from distances import condensed_to_square
+
+
+def _random(rng, length):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+
+def _mutate(rng, sequence, substitutions, indels):
+    out = []
+    for base in sequence:
+        r = rng.random()
+        if r < substitutions:
+            out.append(rng.choice('ACGT'.replace(base, '')))
+        elif r < substitutions + indels / 2:
+            continue
+        elif r < substitutions + indels:
+            out.append(base + rng.choice('ACGT'))
+        else:
+            out.append(base)
+    return ''.join(out)
+
+
+def _pairs(seed=0):
+    """(a, b) pairs near the identity thresholds: substitutions, small indels and substrings"""
+    rng = random.Random(seed)
+    for length in (100, 150, 300, 1000, 5000):
+        for threshold in (0.8, 0.9, 0.95, 0.97, 0.99):
+            for trial in range(6 if length < 5000 else 2):
+                a = _random(rng, length)
+                if trial % 3 == 2:
+                    start = rng.randint(0, length // 4)
+                    b = _mutate(rng, a[start:start + length // 2], rng.uniform(0, 1 - threshold), 0)
+                else:
+                    b = _mutate(rng, a, rng.uniform(0, 1 - threshold), rng.uniform(0, 0.01))
+                yield threshold, a, b
+
+
+def test_prefilter_keeps_every_pair_above_the_threshold():
+    checked = 0
+    for threshold, a, b in _pairs():
+        if identity(a, b) < threshold:
+            continue
+        checked += 1
+        # With just the two of them, b joins a unless the prefilter drops the pair
+        reduction = reduce_sequences([{'title': 'a', 'sequence': a}, {'title': 'b', 'sequence': b}], threshold)
+        assert len(reduction.representatives) == 1, (threshold, len(a), len(b))
+    assert checked > 50
+
+
+def test_prefilter_skips_unrelated_centers(monkeypatch):
+    rng = random.Random(1)
+    sequences = [{'title': str(i), 'sequence': _random(rng, 1000)} for i in range(20)]
+    calls = []
+    monkeypatch.setattr(dedup, 'identity', lambda a, b: calls.append(1) or 0.0)
+    assert len(reduce_sequences(sequences, 0.99).representatives) == 20
+    assert not calls
+
+
+def test_duplicates_collapse_and_expand_back_to_every_name():
+    rng = random.Random(2)
+    base = [_random(rng, 400) for _ in range(3)]
+    sequences = [
+        {'title': 'a', 'sequence': base[0]},
+        {'title': 'b', 'sequence': base[1]},
+        {'title': 'a copy', 'sequence': base[0].lower()},
+        {'title': 'empty', 'sequence': ''},
+        {'title': 'a wrapped', 'sequence': '\n'.join(base[0][i:i + 60] for i in range(0, 400, 60))},
+        {'title': 'c', 'sequence': base[2]},
+        {'title': 'b copy', 'sequence': base[1]},
+    ]
+    reduction = reduce_sequences(sequences)
+    assert [r['title'] for r in reduction.representatives] == ['a_x3', 'b_x2', 'c']
+    assert reduction.assignment.tolist() == [0, 1, 0, -1, 0, 2, 1]
+    assert reduction.stats() == {'sequences': 7, 'representatives': 3, 'duplicates': 4, 'largest_group': 3}
+
+    condensed = np.array([0.2, 0.3, 0.4])
+    square = condensed_to_square(reduction.expand(condensed))
+    assert square.shape == (len(sequences), len(sequences))
+    rep = {0: 0, 1: 1, 2: 0, 4: 0, 5: 2, 6: 1}
+    reps = condensed_to_square(condensed)
+    for i in rep:
+        for j in rep:
+            expected = 0.0 if rep[i] == rep[j] else reps[rep[i], rep[j]]
+            assert square[i, j] == pytest.approx(expected)
+        assert square[i, 3] == 1.0
+
+
+def test_near_copies_join_the_most_abundant_center():
+    rng = random.Random(3)
+    a = _random(rng, 500)
+    near = a[:100] + ('A' if a[100] != 'A' else 'C') + a[101:]
+    sequences = [{'title': 'near', 'sequence': near}, {'title': 'a', 'sequence': a},
+                 {'title': 'a2', 'sequence': a}, {'title': 'other', 'sequence': _random(rng, 500)}]
+    reduction = reduce_sequences(sequences, 0.99)
+    # 'a' has two copies so it is the center, but representatives keep the upload order
+    assert [r['title'] for r in reduction.representatives] == ['a_x3', 'other']
+    assert reduction.representatives[0]['sequence'] == a
+    assert reduction.assignment.tolist() == [0, 0, 0, 1]
+    assert reduction.offsets[0] == pytest.approx(1 / 500)
+    square = condensed_to_square(reduction.expand(np.array([0.7])))
+    assert square[0, 1] == pytest.approx(1 / 500) and square[1, 2] == 0.0
+    assert square[0, 3] == square[1, 3] == 0.7
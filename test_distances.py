@@ -0,0 +1,72 @@
+"""distances.py: the blocked kernel against Bio and naive per-pair loops."""
+import math
+import random
+
+import numpy as np
+from Bio.Align import MultipleSeqAlignment
+from Bio.Phylo.TreeConstruction import DistanceCalculator
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from distances import (biopython_from_condensed, condensed_from_biopython, condensed_to_square, pairwise_distances,
+                       query_distances, square_to_condensed)
+
+
+def _sequences(n, seed=0, alphabet='ACGT', lengths=(40, 120)):
+    rng = random.Random(seed)
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(*lengths))) for _ in range(n)]
+
+
+def _naive(sequences, distance):
+    return np.array([distance(a, b) for i, a in enumerate(sequences) for b in sequences[i + 1:]])
+
+
+def _hamming(a, b):
+    # The original fallback distance
+    if not a or not b:
+        return 1.0
+    return (sum(x != y for x, y in zip(a, b)) + abs(len(a) - len(b))) / max(len(a), len(b))
+
+
+def _p(a, b):
+    pairs = [(x, y) for x, y in zip(a.upper(), b.upper()) if x in 'ACGT' and y in 'ACGT']
+    return sum(x != y for x, y in pairs) / len(pairs) if pairs else 1.0
+
+
+def test_identity_matches_biopython():
+    # Aligned rows with gaps, Ns and one shorter row that Bio sees padded with '-'
+    rows = _sequences(12, seed=1, alphabet='ACGTN-', lengths=(90, 90)) + ['ACGT-ACGTN' * 8]
+    width = max(len(r) for r in rows)
+    alignment = MultipleSeqAlignment([SeqRecord(Seq(r.ljust(width, '-')), id=f"s{i}") for i, r in enumerate(rows)])
+    reference = condensed_from_biopython(DistanceCalculator('identity').get_distance(alignment))
+    assert np.allclose(pairwise_distances(rows, 'identity'), reference)
+
+
+def test_hamming_matches_the_per_pair_loop():
+    sequences = _sequences(25, seed=2) + ['']
+    assert np.allclose(pairwise_distances(sequences, 'hamming'), _naive(sequences, _hamming))
+
+
+def test_p_and_jc69_compare_only_bases():
+    sequences = _sequences(20, seed=3, alphabet='ACGTacgtN-', lengths=(50, 80))
+    p = _naive(sequences, _p)
+    assert np.allclose(pairwise_distances(sequences, 'p'), p)
+    jc = [-0.75 * math.log(1 - 4 * min(d, 0.7499) / 3) for d in p]
+    assert np.allclose(pairwise_distances(sequences, 'jc69'), jc)
+
+
+def test_process_pool_and_query_rows_agree_with_the_matrix(monkeypatch):
+    import distances
+    # Small blocks so the rows are spread over several workers
+    monkeypatch.setattr(distances, 'BLOCK_ELEMENTS', 64)
+    sequences = _sequences(30, seed=4)
+    serial = pairwise_distances(sequences, 'hamming')
+    assert np.array_equal(pairwise_distances(sequences, 'hamming', processes=2), serial)
+    assert np.allclose(query_distances(sequences, [0, 7, 29]), condensed_to_square(serial)[[0, 7, 29]])
+
+
+def test_condensed_conversions_round_trip():
+    condensed = pairwise_distances(_sequences(6, seed=5), 'hamming')
+    assert np.array_equal(square_to_condensed(condensed_to_square(condensed)), condensed)
+    dm = biopython_from_condensed([f"s{i}" for i in range(6)], condensed)
+    assert np.allclose(condensed_from_biopython(dm), condensed)
@@ -0,0 +1,92 @@
+"""export.py: streamed FASTA, wrapping, gzip and clades against Bio and plain joins."""
+import gzip
+import random
+from io import StringIO
+
+import pytest
+from Bio import SeqIO
+
+import export
+from alignment_profile import AlignmentProfile
+from composition import annotate_sequences
+from dataset_store import DatasetStore
+from export import aligned_records, blocks, clade_of, consensus_record, fasta_records, gzipped, newick, wrap
+from phylogeny import tree_from_newick
+from tree_builder import to_newick
+
+
+def _lines(text, width):
+    return ''.join(text[i:i + width] + '\n' for i in range(0, len(text), width))
+
+
+@pytest.fixture
+def sequences():
+    rng = random.Random(0)
+    lengths = [rng.randint(1, 300) for _ in range(8)]
+    records = [{'title': f"seq {i} | x", 'sequence': ''.join(rng.choice('ACGTacgtN') for _ in range(length))}
+               for i, length in enumerate(lengths)]
+    # One empty sequence, which has no record
+    records[3]['sequence'] = ''
+    annotate_sequences(records)
+    return records
+
+
+@pytest.fixture
+def dataset(tmp_path, sequences):
+    store = DatasetStore(str(tmp_path))
+    return store.get(store.put(sequences))
+
+
+@pytest.mark.parametrize('length, width', [(0, 60), (59, 60), (60, 60), (61, 60), (250, 7), (40, 0)])
+def test_wrap_matches_plain_slicing(length, width):
+    data = ''.join(random.Random(length).choice('ACGT') for _ in range(length))
+    expected = data + '\n' if not width else _lines(data, width)
+    assert wrap(data.encode('ascii'), width).decode('ascii') == expected
+
+
+@pytest.mark.parametrize('width', [60, 7, 0])
+def test_fasta_reads_back_with_biopython(monkeypatch, dataset, sequences, width):
+    # Chunks smaller than the sequences, and not a multiple of the width
+    monkeypatch.setattr(export, 'CHUNK', 50)
+    text = b''.join(fasta_records(dataset, range(len(sequences)), width)).decode('ascii')
+    kept = [s for s in sequences if s['sequence']]
+    parsed = list(SeqIO.parse(StringIO(text), 'fasta'))
+    assert [record.description for record in parsed] == [s['title'] for s in kept]
+    assert [str(record.seq) for record in parsed] == [s['sequence'] for s in kept]
+    if width:
+        assert text == ''.join(f">{s['title']}\n" + _lines(s['sequence'], width) for s in kept)
+
+
+def test_aligned_records_are_rewrapped_and_selected():
+    aligned = '>a first\nAC-G\nTA\n>b\nACTG\n-A\n>c\nAAAA\nAA\n'
+    text = b''.join(aligned_records(aligned, {'a', 'c'}, width=4)).decode('ascii')
+    assert text == '>a first\nAC-G\nTA\n>c\nAAAA\nAA\n'
+    assert b''.join(aligned_records(aligned, width=0)).decode('ascii') == '>a first\nAC-GTA\n>b\nACTG-A\n>c\nAAAAAA\n'
+
+
+def test_consensus_drops_gap_columns():
+    profile = AlignmentProfile.from_rows(['a', 'b', 'c'], ['AC--GT', 'AC--GA', 'TG-AGA'])
+    text = b''.join(consensus_record(profile, width=0)).decode('ascii')
+    assert text == '>consensus alignment n=3\nACAGA\n'
+    assert b''.join(consensus_record(profile, rows=[0, 1], width=0)).decode('ascii').endswith('\nACGA\n')
+
+
+def test_clade_is_the_common_ancestors_tips():
+    newick_text = '((a:1,b:1)x:1,((c:1,d:1)y:1,e:1)z:1);'
+    entry = {'names': ['A', 'B', 'C', 'D', 'E', 'F'], 'newick': newick_text,
+             'info': {'tips': ['a', 'b', 'c', 'd', 'e', '']}}
+    indices, clade = clade_of(entry, ['C', 'E'])
+    reference = tree_from_newick(newick_text).common_ancestor('c', 'e')
+    assert indices.tolist() == [2, 3, 4]
+    assert to_newick(clade) == to_newick(reference)
+    assert b''.join(newick(entry, clade)).decode('utf-8') == to_newick(reference) + '\n'
+    assert clade_of(entry, ['A'])[0].tolist() == [0]
+    assert clade_of(entry, ['A', 'F']) == (None, None)
+
+
+def test_gzipped_blocks_decompress_to_the_same_bytes(dataset, sequences):
+    chunks = list(fasta_records(dataset, range(len(sequences))))
+    gathered = list(blocks(iter(chunks), size=100))
+    assert b''.join(gathered) == b''.join(chunks)
+    assert all(len(block) >= 100 for block in gathered[:-1])
+    assert gzip.decompress(b''.join(gzipped(iter(gathered)))) == b''.join(chunks)
@@ -0,0 +1,99 @@
+"""ingest.py: the streaming parser against SeqIO across chunk boundaries, gzip/BGZF and caps."""
+import gzip
+import io
+
+import pytest
+from Bio import SeqIO, bgzf
+
+from ingest import CHUNK_SIZE, FastaFormatError, FastaLimitError, parse_fasta_stream
+
+CHUNK_SIZES = (1, 2, 3, CHUNK_SIZE)
+
+FASTA = [
+    b'>seq1 first record\nACGTAC\nGTNNac\n>seq2\n\n>seq3 desc with > inside\nAC>GT\n>>x\nTT\n',
+    b'>a\r\nACGT\r\nAC\r\n>b c\r\nGG\r\n',
+    b'>a\nACGT\n>b',
+    b'>only\nAC GT\nT T\n\n',
+    b'>\nAAA\n>b\nC\n',
+    b'>' + b'long_header_' * 20 + b'\n' + b'ACGT' * 100 + b'\n>z\n' + b'G' * 77,
+]
+
+
+def _seqio(data):
+    handle = io.TextIOWrapper(io.BytesIO(data), encoding='ascii')
+    return [(record.id, str(record.seq)) for record in SeqIO.parse(handle, 'fasta')]
+
+
+def _parse(data, **kwargs):
+    return [(r['title'], r['sequence']) for r in parse_fasta_stream(io.BytesIO(data), **kwargs)]
+
+
+class _Kept(io.BytesIO):
+    """BytesIO that keeps its contents when BgzfWriter closes it"""
+
+    def close(self):
+        pass
+
+
+class _Pipe:
+    """Read-only, non-seekable stream like a request body"""
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._data.read(size)
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+@pytest.mark.parametrize('data', FASTA)
+def test_records_match_seqio(data, chunk_size):
+    assert _parse(data, chunk_size=chunk_size) == _seqio(data)
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_multi_member_gzip_and_bgzf(chunk_size):
+    data = b''.join(FASTA[:2])
+    expected = _seqio(data)
+    members = gzip.compress(FASTA[0]) + gzip.compress(FASTA[1])
+    assert _parse(members, chunk_size=chunk_size) == expected
+    handle = _Kept()
+    writer = bgzf.BgzfWriter(fileobj=handle)
+    # Small blocks so the records span several BGZF members
+    for start in range(0, len(data), 16):
+        writer.write(data[start:start + 16])
+        writer.flush()
+    writer.close()
+    assert _parse(handle.getvalue(), chunk_size=chunk_size) == expected
+    records = list(parse_fasta_stream(_Pipe(members), chunk_size=chunk_size))
+    assert [(r['title'], r['sequence']) for r in records] == expected
+
+
+def test_stats_come_with_each_record():
+    record = next(parse_fasta_stream(io.BytesIO(b'>a\nGGCCAT\nNN\n')))
+    # Ns count in the GC denominator, like gc_fraction(ambiguous='ignore')
+    assert record['length'] == 8 and record['gc'] == pytest.approx(50.0)
+
+
+def test_lines_before_the_first_header_are_skipped():
+    assert _parse(b'\n;comment\njunk > here\n>a\nAC\n', chunk_size=2) == [('a', 'AC')]
+
+
+def test_non_ascii_sequences_are_rejected():
+    with pytest.raises(FastaFormatError):
+        _parse('>a\nACé\n'.encode('utf-8'))
+    # Headers may be UTF-8
+    assert _parse('>é\nAC\n'.encode('utf-8')) == [('é', 'AC')]
+
+
+def test_caps():
+    data = b'>a\nAC\n>b\nGT\n>c\nTT\n'
+    assert len(_parse(data, max_records=3)) == 3
+    with pytest.raises(FastaLimitError):
+        _parse(data, max_records=2)
+    assert len(_parse(data, max_bytes=len(data))) == 3
+    with pytest.raises(FastaLimitError):
+        _parse(data, max_bytes=len(data) - 1, chunk_size=4)
+    # The byte cap applies to the decompressed data
+    with pytest.raises(FastaLimitError):
+        _parse(gzip.compress(b'>a\n' + b'A' * 10000), max_bytes=5000)
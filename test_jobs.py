@@ -0,0 +1,93 @@
+"""jobs.py: submit, poll, cancel, failures and timeouts on the real spawn process pool."""
+import time
+
+import pytest
+
+from jobs import CANCELLED, DONE, FAILED, FINISHED_STATES, RUNNING, TIMEOUT, JobManager, QueueFullError
+
+
+# Jobs run in spawned workers, which import them from this module
+
+def add(a, b, progress=None):
+    progress(0.5, 'Adding')
+    return a + b
+
+
+def fail(progress=None):
+    raise ValueError('bad input')
+
+
+def spin(seconds=60, progress=None):
+    """Reports progress until cancelled (progress raises JobCancelled) or `seconds` pass"""
+    end = time.time() + seconds
+    while time.time() < end:
+        progress(0.1, 'Spinning')
+        time.sleep(0.05)
+    return 'finished'
+
+
+def _wait(manager, job_id, states=FINISHED_STATES, timeout=60):
+    end = time.time() + timeout
+    while time.time() < end:
+        status = manager.status(job_id)
+        if status['status'] in states:
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"job still {manager.status(job_id)['status']}")
+
+
+@pytest.fixture
+def manager():
+    manager = JobManager(max_workers=1, max_queue=2, timeout=300)
+    yield manager
+    manager.shutdown()
+
+
+def test_result_and_status(manager):
+    job_id = manager.submit(add, 2, b=3)
+    status = _wait(manager, job_id)
+    assert status['status'] == DONE and status['progress'] == 1.0 and status['error'] is None
+    assert manager.result(job_id) == 5
+    assert manager.status('unknown') is None and manager.result('unknown') is None
+
+
+def test_failure_is_reported(manager):
+    job_id = manager.submit(fail)
+    status = _wait(manager, job_id)
+    assert status['status'] == FAILED and status['error'] == 'bad input'
+    assert manager.result(job_id) is None
+    assert manager.stats()['failed'] == 1
+
+
+def test_cancel_stops_a_running_job_and_frees_its_slot(manager):
+    job_id = manager.submit(spin)
+    _wait(manager, job_id, states=(RUNNING,))
+    assert manager.cancel(job_id)
+    assert manager.status(job_id)['status'] == CANCELLED
+    assert not manager.cancel(job_id)
+    # The single worker only takes the next job once the cancelled one has stopped
+    next_id = manager.submit(add, 1, 1)
+    assert _wait(manager, next_id, timeout=30)['status'] == DONE
+    assert manager.status(job_id)['status'] == CANCELLED
+
+
+def test_full_queue_rejects_jobs(manager):
+    running = manager.submit(spin)
+    queued = manager.submit(spin)
+    with pytest.raises(QueueFullError):
+        manager.submit(add, 1, 2)
+    assert manager.stats()['rejected'] == 1
+    # A cancelled queued job never starts
+    assert manager.cancel(queued) and manager.cancel(running)
+    assert manager.status(queued)['started'] is None
+    assert _wait(manager, manager.submit(add, 1, 2))['status'] == DONE
+
+
+def test_watchdog_times_out_long_jobs():
+    manager = JobManager(max_workers=1, max_queue=1, timeout=0.5)
+    try:
+        job_id = manager.submit(spin)
+        status = _wait(manager, job_id, timeout=30)
+        assert status['status'] == TIMEOUT and 'Timed out' in status['message']
+    finally:
+        manager.shutdown()
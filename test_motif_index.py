@@ -0,0 +1,87 @@
+"""motif_index.py: FM-index hits against a plain scan of both strands."""
+import random
+
+import numpy as np
+import pytest
+
+from composition import annotate_sequences
+from dataset_store import DatasetStore
+from motif_index import IUPAC, MotifIndex, parse_motif, reverse_complement, suffix_array
+
+
+def _sequences(seed=0):
+    rng = random.Random(seed)
+    sequences = [''.join(rng.choice('ACGTACGTacgtN') for _ in range(rng.randint(0, 400))) for _ in range(12)]
+    # Repeats and a motif straddling two records
+    sequences += ['ACGT' * 50, 'GAATTC' * 3 + 'GAAT', 'TCGGAATT']
+    return [{'title': f"s{i}", 'sequence': s} for i, s in enumerate(sequences)]
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    sequences = _sequences()
+    annotate_sequences(sequences)
+    store = DatasetStore(str(tmp_path))
+    return store.get(store.put(sequences))
+
+
+def _scan(sequences, motif, mismatches):
+    """{(sequence, start, strand, mismatches)} from comparing every window on both strands"""
+    hits = set()
+    reverse = reverse_complement(motif)
+    queries = [(motif, 1)] + ([(reverse, -1)] if reverse != motif else [])
+    for i, record in enumerate(sequences):
+        sequence = record['sequence'].upper()
+        for start in range(len(sequence) - len(motif) + 1):
+            window = sequence[start:start + len(motif)]
+            for query, strand in queries:
+                cost = sum(base not in IUPAC[code] for base, code in zip(window, query))
+                if cost <= mismatches:
+                    hits.add((i, start, strand, cost))
+    return hits
+
+
+@pytest.mark.parametrize('motif, mismatches', [('GAATTC', 0), ('ACG', 0), ('TTGCA', 1), ('RGWNY', 0),
+                                               ('CCGTAT', 2), ('A', 0)])
+def test_hits_match_a_scan_of_both_strands(dataset, motif, mismatches):
+    sequence, start, strand, cost, total = MotifIndex.build(dataset).search(parse_motif(motif), mismatches)
+    found = set(zip(sequence.tolist(), start.tolist(), strand.tolist(), cost.tolist()))
+    assert found == _scan(_sequences(), motif, mismatches)
+    assert total == len(found) == len(sequence)
+
+
+def test_exact_hits_match_str_find(dataset):
+    index = MotifIndex.build(dataset)
+    for motif in ('GAAT', 'CGT'):
+        for query, strand in ((motif, 1), (reverse_complement(motif), -1)):
+            sequence, start, _, _, _ = index.search(motif, strands='forward' if strand == 1 else 'reverse')
+            expected = []
+            for i, record in enumerate(_sequences()):
+                text, position = record['sequence'].upper(), record['sequence'].upper().find(query)
+                while position >= 0:
+                    expected.append((i, position))
+                    position = text.find(query, position + 1)
+            assert list(zip(sequence.tolist(), start.tolist())) == expected
+
+
+def test_saved_index_is_reloaded(dataset):
+    built = MotifIndex.load_or_build(dataset)
+    loaded = MotifIndex.load_or_build(dataset)
+    assert isinstance(loaded.sa, np.memmap)
+    assert np.array_equal(loaded.sa, built.sa)
+
+
+def test_suffix_array_matches_sorted_suffixes():
+    rng = np.random.default_rng(0)
+    # Long runs keep groups tied past the packed key, so the doubling rounds run too
+    text = np.concatenate((rng.integers(0, 6, 300), np.full(100, 2), rng.integers(1, 3, 200))).astype(np.uint8)
+    expected = sorted(range(len(text)), key=lambda i: text[i:].tolist())
+    assert suffix_array(text).tolist() == expected
+
+
+def test_parse_motif_rejects_non_iupac():
+    assert parse_motif(' ac gn\n') == 'ACGN'
+    with pytest.raises(ValueError):
+        parse_motif('ACGX')
+    with pytest.raises(ValueError):
+        parse_motif('  ')
@@ -0,0 +1,93 @@
+"""phylogeny.py: cache lookups per distance method and trees grown by added sequences."""
+import random
+from io import StringIO
+
+import numpy as np
+import pytest
+from Bio import AlignIO
+
+import phylogeny
+from distances import pairwise_distances
+from tree_cache import TreeCache, cache_key
+
+SEQUENCES = [{'title': 'a', 'sequence': 'ACGTACGTAA'},
+             {'title': 'b', 'sequence': 'ACGTACGTTT'},
+             {'title': 'c', 'sequence': 'TTGTACGTTT'}]
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = TreeCache(str(tmp_path))
+    monkeypatch.setattr(phylogeny, 'tree_cache', cache)
+    return cache
+
+
+def _put(cache, params, sequences=SEQUENCES):
+    key = cache_key(sequences, **phylogeny._params(params, None))
+    cache.put(key, [s['title'] for s in sequences], np.zeros(3), newick='(a:0,b:0,c:0);')
+    return key
+
+
+def test_alignment_is_not_served_a_fallback_tree(cache):
+    _put(cache, phylogeny.PROGRESSIVE_PARAMS)
+    _put(cache, phylogeny.SIMPLE_PARAMS)
+    assert phylogeny.cached_phylogeny(SEQUENCES, method='alignment') is None
+    key = _put(cache, phylogeny.MUSCLE_PARAMS)
+    assert phylogeny.cached_phylogeny(SEQUENCES, method='alignment')['key'] == key
+
+
+def test_progressive_is_not_served_a_simple_tree(cache):
+    _put(cache, phylogeny.SIMPLE_PARAMS)
+    assert phylogeny.cached_phylogeny(SEQUENCES, method='progressive') is None
+    key = _put(cache, phylogeny.PROGRESSIVE_PARAMS)
+    assert phylogeny.cached_phylogeny(SEQUENCES, method='progressive')['key'] == key
+
+
+def _family(n, length=120, rate=0.1, seed=0):
+    rng = random.Random(seed)
+    root = ''.join(rng.choice('ACGT') for _ in range(length))
+    return [{'title': f"seq {i}", 'sequence': ''.join(rng.choice('ACGT') if rng.random() < rate else base
+                                                       for base in root)} for i in range(n)]
+
+
+def _tips(entry):
+    return sorted(tip.name for tip in phylogeny.tree_from_newick(entry['newick']).get_terminals())
+
+
+def _base(cache, build, old):
+    # Bases come out of the cache, which fills in the fields a build leaves out
+    return cache.put(cache_key(old, method='test'), **build(old))
+
+
+def test_extended_simple_tree_has_the_full_distances(cache):
+    sequences = _family(12)
+    old, new = sequences[:10], sequences[10:]
+    entry = phylogeny.extend_entry(_base(cache, phylogeny.build_simple_tree, old), old, new)
+    full = phylogeny.build_simple_tree(sequences)
+    assert entry['names'] == full['names']
+    assert np.allclose(entry['condensed'], full['condensed'])
+    assert _tips(entry) == sorted(full['info']['tips'])
+    assert entry['info']['inserted'] == 2
+
+
+def test_extended_alignment_keeps_identity_distances(cache, monkeypatch):
+    # Past the rebuild fraction the tree is rebuilt from the grown distances
+    monkeypatch.setattr(phylogeny, 'TREE_REBUILD_FRACTION', 0.1)
+    sequences = _family(8, seed=1)
+    old, new = sequences[:6], sequences[6:]
+    entry = phylogeny.extend_entry(_base(cache, phylogeny.build_progressive_tree, old), old, new)
+    # Old rows only gained gap columns, so every distance is the identity over the grown alignment
+    rows = [str(record.seq) for record in AlignIO.read(StringIO(entry['aligned_fasta']), 'fasta')]
+    assert np.allclose(entry['condensed'], pairwise_distances(rows, 'identity'))
+    assert [''.join(row.split('-')) for row in rows] == [s['sequence'] for s in sequences]
+    assert _tips(entry) == sorted(entry['info']['tips']) and entry['info']['inserted'] == 0
+
+
+def test_extend_job_grows_the_cached_tree(cache):
+    sequences = _family(7, seed=2)
+    base_key = cache_key(sequences[:5], method='test')
+    _base(cache, phylogeny.build_simple_tree, sequences[:5])
+    ref = phylogeny.run_extend_job(sequences, 2, base_key=base_key)['tree']
+    assert ref == {'key': phylogeny.extension_key(base_key, sequences[5:]), 'style': 'simple'}
+    assert phylogeny.cached_extension(base_key, sequences[5:]) == ref
+    assert cache.get(ref['key'])['names'] == [s['title'] for s in sequences]
@@ -0,0 +1,24 @@
+"""pipeline.py: build_phylogeny returns the entry it built, whatever the cache kept."""
+import numpy as np
+import pytest
+
+import phylogeny
+from pipeline import build_phylogeny
+from tree_cache import TreeCache
+
+SEQUENCES = [{'title': 'a', 'sequence': 'ACGTACGTAAACGTTGCA' * 3},
+             {'title': 'b', 'sequence': 'ACGTACGTTTACGTTGCA' * 3},
+             {'title': 'c', 'sequence': 'TTGTACGTTTACGATGCA' * 3}]
+
+
+@pytest.mark.parametrize('method', ['sketch', 'progressive'])
+def test_entry_does_not_depend_on_the_cache(tmp_path, monkeypatch, method):
+    # Nothing fits in either tier, so every entry is evicted as soon as it is stored
+    monkeypatch.setattr(phylogeny, 'tree_cache', TreeCache(str(tmp_path), max_memory_bytes=0, max_disk_bytes=0))
+    tree = build_phylogeny(SEQUENCES, method=method)
+    assert phylogeny.tree_cache.get(tree['key']) is None
+    assert tree['names'] == ['a', 'b', 'c'] and tree['style'] == 'muscle'
+    assert tree['condensed'].shape == (3,) and np.all(tree['condensed'] >= 0)
+    assert tree['newick'].endswith(';')
+    assert bool(tree['aligned_fasta']) == (method == 'progressive')
+    assert build_phylogeny(SEQUENCES[:1], method=method) is None
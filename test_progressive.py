@@ -0,0 +1,89 @@
+"""progressive.py: rows keep their residues, share one length and line up near-copies column for column."""
+import random
+
+import pytest
+
+from progressive import align, extend_alignment
+
+
+def _random(rng, length):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+
+def _mutate(rng, sequence, rate):
+    out = []
+    for base in sequence:
+        r = rng.random()
+        if r < rate / 2:
+            out.append(rng.choice('ACGT'.replace(base, '')))
+        elif r < 3 * rate / 4:
+            continue
+        elif r < rate:
+            out.append(base + _random(rng, rng.randint(1, 3)))
+        else:
+            out.append(base)
+    return ''.join(out)
+
+
+def _family(seed, n=8, length=300, rate=0.05):
+    rng = random.Random(seed)
+    ancestor = _random(rng, length)
+    sequences = [_mutate(rng, ancestor, rate) for _ in range(n)]
+    # A fragment, a read with Ns and lower case, and an unrelated sequence with no anchors
+    sequences.append(sequences[0][40:200])
+    sequences.append(sequences[1][:150].lower() + 'NNNN' + sequences[1][150:])
+    sequences.append(_random(rng, 90))
+    return [(f"s{i}", s) for i, s in enumerate(sequences)]
+
+
+def _check(records, alignment):
+    rows = [str(record.seq) for record in alignment]
+    assert [record.id for record in alignment] == [title for title, _ in records]
+    assert len({len(row) for row in rows}) == 1
+    for (_, sequence), row in zip(records, rows):
+        assert row.replace('-', '') == sequence.upper()
+    # No column is all gaps
+    assert all(any(row[i] != '-' for row in rows) for i in range(len(rows[0])))
+    return rows
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_rows_are_the_inputs_with_gaps(seed):
+    records = _family(seed)
+    _check(records, align(records))
+
+
+def test_pool_gives_the_same_alignment():
+    records = _family(3, n=20)
+    assert _check(records, align(records, processes=2)) == _check(records, align(records))
+
+
+def test_identical_and_near_identical_inputs_line_up():
+    rng = random.Random(4)
+    a = _random(rng, 500)
+    rows = _check([('a', a), ('b', a), ('c', a)], align([('a', a), ('b', a), ('c', a)]))
+    assert rows == [a, a, a]
+
+    # Substitutions only: no gaps at all, every column holds the same position of each input
+    b = ''.join(rng.choice('ACGT'.replace(c, '')) if i % 50 == 25 else c for i, c in enumerate(a))
+    c = a[:100] + ('A' if a[100] != 'A' else 'G') + a[101:]
+    rows = _check([('a', a), ('b', b), ('c', c)], align([('a', a), ('b', b), ('c', c)]))
+    assert rows == [a, b, c]
+
+    # One deleted base costs one gap, every other column still lines up
+    d = a[:250] + a[251:]
+    rows = _check([('a', a), ('d', d)], align([('a', a), ('d', d)]))
+    assert len(rows[0]) == len(a) and rows[1].count('-') == 1
+    assert sum(x == y for x, y in zip(*rows)) == len(a) - 1
+
+
+def test_extend_keeps_the_existing_rows():
+    records = _family(5)
+    rows = [str(record.seq) for record in align(records)]
+    added = [s for _, s in _family(6, n=3)]
+    existing, new = extend_alignment(rows, added)
+    assert len({len(row) for row in existing + new}) == 1
+    assert [row.replace('-', '') for row in new] == [s.upper() for s in added]
+    # Dropping the columns the new rows inserted gives back the original alignment
+    kept = [i for i in range(len(existing[0])) if any(row[i] != '-' for row in existing)]
+    assert [''.join(row[i] for i in kept) for row in existing] == rows
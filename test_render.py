@@ -0,0 +1,61 @@
+"""render.py: the RenderCache memory and disk tiers of plot data."""
+import os
+import time
+
+import metrics
+import render
+from render import RenderCache
+
+
+def _files(directory):
+    return sorted(os.listdir(directory))
+
+
+def test_data_survives_the_memory_tier(tmp_path):
+    cache = RenderCache(str(tmp_path), max_data=1)
+    cache.put_data('histogram', 'a', {'bins': [1, 2]})
+    cache.put_data('histogram', 'b', {'bins': [3]})
+    assert _files(tmp_path) == ['histogram-a.json', 'histogram-b.json']
+    # 'a' fell out of memory but is read back from disk, also by another cache on the same directory
+    assert cache.get_data('histogram', 'a') == {'bins': [1, 2]}
+    assert RenderCache(str(tmp_path)).get_data('histogram', 'b') == {'bins': [3]}
+    assert cache.get_data('histogram', 'missing') is None
+
+
+def test_disk_files_are_evicted_least_recently_used_first(tmp_path):
+    cache = RenderCache(str(tmp_path), max_data=1, max_disk_bytes=3000)
+    payload = {'values': list(range(200))}
+    size = len(str(payload))
+    for key in ('a', 'b', 'c'):
+        cache.put_data('histogram', key, payload)
+        os.utime(tmp_path / f"histogram-{key}.json", (time.time() - 100 + ord(key), time.time() - 100 + ord(key)))
+    assert size * 3 <= 3000 < size * 4
+    # Reading 'a' makes it the most recently used, so 'b' goes first
+    assert cache.get_data('histogram', 'a') == payload
+    cache.put_data('histogram', 'd', payload)
+    assert _files(tmp_path) == ['histogram-a.json', 'histogram-c.json', 'histogram-d.json']
+    assert cache.stats()['disk_evictions'] == 1
+
+
+def test_failed_writes_leave_no_temp_file(tmp_path, monkeypatch):
+    cache = RenderCache(str(tmp_path))
+
+    def full_disk(data, f):
+        f.write('{"partial')
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(render.json, 'dump', full_disk)
+    before = metrics.REGISTRY.counter_values('gf_cache_write_errors_total').get((('cache', 'render'),), 0)
+    cache.put_data('histogram', 'a', {'bins': [1]})
+    assert _files(tmp_path) == []
+    assert metrics.REGISTRY.counter_values('gf_cache_write_errors_total')[(('cache', 'render'),)] == before + 1
+    # The data is still served from memory
+    assert cache.get_data('histogram', 'a') == {'bins': [1]}
+
+
+def test_images_render_once(tmp_path):
+    cache = RenderCache(str(tmp_path), max_bytes=10)
+    calls = []
+    render_png = lambda: calls.append(1) or b'png'
+    assert cache.image('tree', 'k', render_png, 'muscle') == b'png'
+    assert cache.image('tree', 'k', render_png, 'muscle') == b'png'
+    assert len(calls) == 1 and cache.stats()['hits'] == 1
@@ -0,0 +1,59 @@
+"""sketch.py: the blocked b-bit kernel against full-minimum Mash distances."""
+import random
+
+import numpy as np
+
+from distances import condensed_to_square
+from sketch import DEFAULT_K, sketch_distances, sketch_query_distances, sketch_sequences
+
+
+def _random_sequences(n, length, seed=0):
+    rng = random.Random(seed)
+    return [''.join(rng.choice('ACGT') for _ in range(length)) for _ in range(n)]
+
+
+def _mutate(sequence, rate, seed=1):
+    rng = random.Random(seed)
+    return ''.join(rng.choice('ACGT'.replace(c, '')) if rng.random() < rate else c for c in sequence)
+
+
+def test_unrelated_sequences_are_at_distance_one():
+    sequences = _random_sequences(30, 3000)
+    distances = sketch_distances(sequences)
+    assert np.all(distances == 1.0)
+
+
+def test_homologs_are_closer_than_unrelated():
+    sequences = _random_sequences(5, 3000)
+    sequences.append(_mutate(sequences[0], 0.15))
+    square = condensed_to_square(sketch_distances(sequences))
+    assert 0.1 < square[0, 5] < 0.3
+    assert np.all(square[1:5, 5] == 1.0)
+
+
+def _full_minimum_distances(minima, k=DEFAULT_K):
+    """Mash distances from whole 64-bit minima, skipping bins empty in both sketches"""
+    empty = minima == np.uint64(0xFFFFFFFFFFFFFFFF)
+    matches = ((minima[:, None] == minima[None, :]) & ~empty[None, :]).sum(axis=2)
+    compared = minima.shape[1] - (empty[:, None] & empty[None, :]).sum(axis=2)
+    jaccard = matches / compared
+    with np.errstate(divide='ignore'):
+        return np.where(jaccard > 0, np.minimum(-np.log(2 * jaccard / (1 + jaccard)) / k, 1.0), 1.0)
+
+
+def test_kernel_matches_full_minima():
+    sequences = _random_sequences(8, 2000, seed=3)
+    sequences += [_mutate(s, rate, seed=i) for i, (s, rate) in enumerate(zip(sequences, (0.01, 0.05, 0.1, 0.2)))]
+    minima = sketch_sequences(sequences)
+    square = condensed_to_square(sketch_distances(sequences, minima=minima))
+    reference = _full_minimum_distances(minima)
+    assert np.allclose(square, reference, atol=1e-6)
+
+
+
+
+
+def test_query_rows_match_the_matrix():
+    sequences = _random_sequences(4, 1500, seed=4) + [_mutate('A' * 10 + 'C' * 1490, 0.3)]
+    square = condensed_to_square(sketch_distances(sequences))
+    assert np.allclose(sketch_query_distances(sequences, [1, 4]), square[[1, 4]])
@@ -0,0 +1,78 @@
+"""tree_builder.py: NJ and UPGMA against Bio's DistanceTreeConstructor."""
+import io
+
+import numpy as np
+from Bio import Phylo
+from Bio.Phylo.TreeConstruction import DistanceTreeConstructor
+
+from distances import biopython_from_condensed, condensed_size, condensed_to_square
+from tree_builder import build_tree, insert_tips, to_newick
+
+
+def _distances(n, seed=0):
+    # Euclidean distances between random points, plus noise so there are no ties
+    rng = np.random.default_rng(seed)
+    points = rng.random((n, 3))
+    i, j = np.triu_indices(n, 1)
+    return np.sqrt(((points[i] - points[j]) ** 2).sum(axis=1)) + rng.random(condensed_size(n)) * 1e-3
+
+
+def _splits(tree):
+    """{frozenset of tips under a clade: its branch length} for every clade but the root"""
+    return {frozenset(t.name for t in clade.get_terminals()): round(clade.branch_length or 0.0, 9)
+            for clade in tree.find_clades() if clade is not tree.root}
+
+
+def _same_tree(ours, reference):
+    # NJ trees are unrooted: a split and its complement are the same edge
+    tips = frozenset(t.name for t in reference.get_terminals())
+    def edges(tree):
+        return {min(s, tips - s, key=sorted): length for s, length in _splits(tree).items()}
+    assert edges(ours) == edges(reference)
+
+
+def test_nj_matches_biopython():
+    # 80 taxa also go through the RapidNJ search
+    for n in (3, 10, 80):
+        names = [f"t{i}" for i in range(n)]
+        condensed = _distances(n, seed=n)
+        reference = DistanceTreeConstructor().nj(biopython_from_condensed(names, condensed))
+        _same_tree(build_tree(names, condensed, 'nj'), reference)
+
+
+def test_upgma_is_average_linkage():
+    names = [f"t{i}" for i in range(12)]
+    condensed = _distances(12, seed=1)
+    tree = build_tree(names, condensed, 'upgma')
+    # Bio's upgma() updates distances WPGMA-style, so it only vouches for the topology here
+    reference = DistanceTreeConstructor().upgma(biopython_from_condensed(names, condensed))
+    assert _splits(tree).keys() == _splits(reference).keys()
+    # Each merge sits at half the mean distance between the two clusters it joins
+    square = condensed_to_square(condensed)
+    for clade in tree.get_nonterminals():
+        left, right = ([names.index(t.name) for t in child.get_terminals()] for child in clade.clades)
+        height = tree.distance(clade, clade.get_terminals()[0])
+        assert abs(height - square[np.ix_(left, right)].mean() / 2) < 1e-12
+
+
+def test_newick_matches_phylo_write():
+    names = ['a', 'b c', "d'e", 'f:g', 'h']
+    tree = build_tree(names, _distances(5, seed=2), 'nj')
+    # Short branches too, which a fixed number of decimals would round to 0
+    tree.root.clades[0].branch_length = 1.2345678912e-7
+    handle = io.StringIO()
+    Phylo.write(tree, handle, 'newick', format_branch_length='%1.8g')
+    assert to_newick(tree) == handle.getvalue().strip()
+    assert ':1.2345679e-07' in to_newick(tree)
+
+
+def test_inserted_tips_sit_at_their_distance():
+    names = [f"t{i}" for i in range(6)]
+    tree = build_tree(names, _distances(6, seed=3), 'nj')
+    edge = tree.find_any(name='t2').branch_length
+    insert_tips(tree, [('new', 't2', 0.05, edge / 2), ('newer', 'new', 0.01, 0.0)])
+    assert abs(tree.distance('new', 't2') - 0.05) < 1e-12
+    assert abs(tree.distance('newer', 'new') - 0.01) < 1e-12
+    # The rest of the tree is untouched
+    assert abs(tree.distance('t2', 't4') - build_tree(names, _distances(6, seed=3), 'nj').distance('t2', 't4')) < 1e-12
+    assert sorted(t.name for t in tree.get_terminals()) == sorted(names + ['new', 'newer'])
@@ -0,0 +1,29 @@
+"""tree_cache.py: keys and round trips through memory and disk."""
+import numpy as np
+
+from tree_cache import TreeCache, cache_key
+
+SEQUENCES = [{'title': 'a', 'sequence': 'ACGT'}, {'title': 'b', 'sequence': 'ACGA'}]
+
+
+def test_key_normalises_whitespace_and_case():
+    assert cache_key(SEQUENCES) == cache_key([{'title': ' a ', 'sequence': 'ac\ngt'},
+                                              {'title': 'b', 'sequence': 'ACGA '}])
+
+
+def test_key_depends_on_order_and_params():
+    # Entries keep the names and distances in submission order, so a reordered input is another entry
+    assert cache_key(SEQUENCES) != cache_key(SEQUENCES[::-1])
+    assert cache_key(SEQUENCES, method='muscle') != cache_key(SEQUENCES, method='simple')
+
+
+def test_entries_survive_the_disk(tmp_path):
+    cache = TreeCache(str(tmp_path))
+    key = cache_key(SEQUENCES)
+    cache.put(key, ['a', 'b'], np.array([0.25]), aligned_fasta='>a\nACGT\n>b\nACGA\n', newick='(a:0,b:0);',
+              info={'method': 'muscle', 'tips': ['a', 'b']})
+    entry = TreeCache(str(tmp_path)).get(key)
+    assert entry['names'] == ['a', 'b']
+    assert entry['condensed'].tolist() == [0.25]
+    assert entry['newick'] == '(a:0,b:0);'
+    assert entry['info'] == {'method': 'muscle', 'tips': ['a', 'b']}
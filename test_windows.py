@@ -0,0 +1,85 @@
+"""windows.py: windowed GC, skews and N runs against a per-base count."""
+import random
+import re
+
+import numpy as np
+import pytest
+
+import windows
+from composition import annotate_sequences
+from dataset_store import DatasetStore
+from windows import window_stats
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    rng = random.Random(0)
+    sequences = [
+        # Ends in Ns so the next sequence's runs start right after a run
+        ''.join(rng.choice('ACGTacgt') for _ in range(333)) + 'NNNN',
+        'nnNN' + ''.join(rng.choice('ACGTTTGGGN') for _ in range(1000)) + 'N' * 120 + 'GGCCRYACGT' * 30,
+        'ACGT',
+    ]
+    sequences = [{'title': f"s{i}", 'sequence': s} for i, s in enumerate(sequences)]
+    annotate_sequences(sequences)
+    store = DatasetStore(str(tmp_path))
+    return store.get(store.put(sequences))
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator else None
+
+
+def _naive(sequence, starts, ends):
+    rows = []
+    for start, end in zip(starts, ends):
+        window = sequence[start:end].upper()
+        a, c, g, t, n = (window.count(base) for base in 'ACGTN')
+        bases = a + c + g + t
+        rows.append((_ratio(100 * (g + c), bases), _ratio(g - c, g + c), _ratio(a - t, a + t), n / (end - start)))
+    return [list(series) for series in zip(*rows)]
+
+
+def _close(values, expected, decimals):
+    assert len(values) == len(expected)
+    for value, reference in zip(values, expected):
+        if reference is None:
+            assert value is None
+        else:
+            assert abs(value - reference) <= 0.6 * 10 ** -decimals
+
+
+@pytest.mark.parametrize('index, window, step', [(0, 50, 50), (0, 50, 20), (1, 100, 30), (1, 7, 3), (2, 10, 5)])
+def test_windows_match_a_per_base_count(dataset, monkeypatch, index, window, step):
+    # Small chunks so the block counts are split over several of them
+    monkeypatch.setattr(windows, 'CHUNK', 64)
+    stats = window_stats(dataset, index, window, step, points=windows.MAX_POINTS)
+    sequence = dataset.sequence(index)
+    assert stats['start'][0] == 0 and stats['end'][-1] == len(sequence)
+    assert all(end - start == min(window, len(sequence)) for start, end in zip(stats['start'], stats['end'][:-1]))
+    gc, gc_skew, at_skew, n_density = _naive(sequence, stats['start'], stats['end'])
+    _close(stats['gc'], gc, 2)
+    _close(stats['gc_skew'], gc_skew, 4)
+    _close(stats['at_skew'], at_skew, 4)
+    _close(stats['n_density'], n_density, 4)
+    _close(stats['cumulative_gc_skew'], np.cumsum([v or 0.0 for v in gc_skew]).tolist(), 4)
+
+
+def test_n_runs_are_merged_across_case(dataset):
+    stats = window_stats(dataset, 1, 100, 100)
+    sequence = dataset.sequence(1)
+    assert stats['n_bases'] == sequence.upper().count('N')
+    runs = [[m.start(), m.end()] for m in re.finditer('[Nn]+', sequence)]
+    assert stats['n_runs'] == runs and stats['n_runs_total'] == len(runs)
+
+
+def test_many_windows_are_averaged_down(dataset):
+    full = window_stats(dataset, 1, 10, 10, points=windows.MAX_POINTS)
+    reduced = window_stats(dataset, 1, 10, 10, points=20)
+    assert len(reduced['gc']) == 20 and reduced['windows'] == full['windows']
+    edges = np.linspace(0, full['windows'], 21).astype(int)
+    for k, (first, last) in enumerate(zip(edges[:-1], edges[1:])):
+        values = [v for v in full['gc_skew'][first:last] if v is not None]
+        _close([reduced['gc_skew'][k]], [sum(values) / len(values) if values else None], 3)
+        assert reduced['cumulative_gc_skew'][k] == full['cumulative_gc_skew'][last - 1]
+        assert reduced['start'][k] == full['start'][first] and reduced['end'][k] == full['end'][last - 1]
@@ -0,0 +1,336 @@
+"""Neighbour-joining and UPGMA on NumPy distance arrays.
+
+Works on a condensed or square matrix and returns a Bio.Phylo tree (same shape
+and inner node names as Bio's DistanceTreeConstructor) plus Newick text, so the
+drawing and caching code doesn't care which builder made the tree.
+
+Both builders keep the full matrix with inf on the diagonal and in merged rows,
+plus each row's minimum, so a merge is O(r) plus the rows whose minimum pointed
+at a merged node. UPGMA takes the smallest row minimum. NJ (for large n) does
+what RapidNJ does: every row is also kept sorted, and since Q(i, j) >=
+(r - 2) d(i, j) - u_i - max(u), only the rows and the sorted-row prefixes that
+can still beat the best Q found so far are looked at. Distances between nodes
+that are still alive never change, so the sorted rows stay valid; a new node
+gets its own sorted row and dead columns read as inf from the live matrix.
+"""
+import re
+
+import numpy as np
+from Bio.Phylo import BaseTree
+
+from distances import condensed_to_square
+
+TREE_METHODS = ('nj', 'upgma')
+
+# Below this many active nodes NJ just evaluates the whole Q matrix
+RAPID_NJ_MIN_NODES = 64
+# First sorted-row window looked at per candidate row, doubled while rows still need more
+RAPID_NJ_WINDOW = 8
+
+# Same rule as Bio's Newick writer: labels outside this pattern are single-quoted
+_UNQUOTED_LABEL = re.compile(r"[^\s\(\)\[\]\'\:\;\,]+")
+
+
+def _square(distances):
+    """Float64 square matrix with inf on the diagonal from a condensed or square array"""
+    distances = np.asarray(distances, dtype=np.float64)
+    matrix = condensed_to_square(distances) if distances.ndim == 1 else distances.copy()
+    if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1]:
+        raise ValueError(f"Expected a condensed or square distance matrix, got shape {distances.shape}")
+    np.fill_diagonal(matrix, np.inf)
+    return matrix
+
+
+def _row_minima(matrix, rows):
+    """(argmin, min) of the given rows"""
+    arg = np.argmin(matrix[rows], axis=1)
+    return arg, matrix[rows, arg]
+
+
+def _small_tree(names, matrix):
+    """Trees for 1 or 2 taxa, shaped like Bio's"""
+    clades = [BaseTree.Clade(None, name) for name in names]
+    if len(clades) == 1:
+        return BaseTree.Tree(clades[0], rooted=False)
+    inner = BaseTree.Clade(None, 'Inner')
+    clades[1].branch_length = matrix[1, 0] / 2.0
+    clades[0].branch_length = matrix[1, 0] - clades[1].branch_length
+    inner.clades.extend([clades[1], clades[0]])
+    return BaseTree.Tree(inner, rooted=False)
+
+
+def neighbor_joining(names, distances):
+    """Neighbour-joining tree (Bio.Phylo) from a condensed or square distance array"""
+    names = list(names)
+    n = len(names)
+    matrix = _square(distances)
+    if n < 3:
+        return _small_tree(names, matrix)
+
+    clades = [BaseTree.Clade(None, name) for name in names]
+    active = np.ones(n, dtype=bool)
+    sums = _row_sums(matrix)
+    row_arg, row_min = _row_minima(matrix, np.arange(n))
+    sorted_rows = _sorted_rows(matrix) if n >= RAPID_NJ_MIN_NODES else None
+    inner = None
+    inner_count = 0
+
+    for r in range(n, 2, -1):
+        # Once half the slots are retired, drop them so rows are only as wide as needed
+        if r >= RAPID_NJ_MIN_NODES and 2 * r < len(active):
+            keep = np.flatnonzero(active)
+            matrix = matrix[np.ix_(keep, keep)]
+            clades = [clades[k] for k in keep]
+            active = np.ones(r, dtype=bool)
+            # Also a good moment to drop the rounding drift of the incremental sums
+            sums = _row_sums(matrix)
+            row_arg, row_min = _row_minima(matrix, np.arange(r))
+            sorted_rows = _sorted_rows(matrix)
+        elif r < RAPID_NJ_MIN_NODES:
+            # Cheap at this size, and exact sums keep near-ties resolving like Bio's
+            sums = _row_sums(matrix)
+
+        i, j = _nj_pair(matrix, sums, row_min, active, r, sorted_rows)
+        d_ij = matrix[i, j]
+        # Same branch length formula as Bio (node_dist = row sum / (r - 2))
+        delta = (sums[i] - sums[j]) / (r - 2)
+        clades[i].branch_length = (d_ij + delta) / 2.0
+        clades[j].branch_length = d_ij - clades[i].branch_length
+        inner_count += 1
+        inner = BaseTree.Clade(None, f"Inner{inner_count}")
+        inner.clades.extend([clades[i], clades[j]])
+
+        # Like Bio, the new node takes the lower slot j and i is retired
+        new = (matrix[i] + matrix[j] - d_ij) / 2.0
+        active[i] = False
+        new[~active] = np.inf
+        new[j] = np.inf
+        live = np.isfinite(new)
+        sums[live] += new[live] - matrix[i, live] - matrix[j, live]
+        sums[j] = new[live].sum()
+        sums[i] = 0.0
+        matrix[i, :] = np.inf
+        matrix[:, i] = np.inf
+        matrix[j, :] = new
+        matrix[:, j] = new
+        clades[j], clades[i] = inner, None
+        _update_minima(matrix, row_arg, row_min, active, i, j, new)
+        if sorted_rows is not None:
+            order = np.argsort(new, kind='stable')
+            sorted_rows[0][j], sorted_rows[1][j] = new[order], order
+
+    # Two nodes left: hang the other one off the last inner node, like Bio
+    a, b = np.flatnonzero(active)
+    last, other = (a, b) if clades[a] is inner else (b, a)
+    clades[last].branch_length = 0
+    clades[other].branch_length = matrix[a, b]
+    clades[last].clades.append(clades[other])
+    return BaseTree.Tree(clades[last], rooted=False)
+
+
+def _row_sums(matrix):
+    """Row sums ignoring the inf entries (diagonal and retired nodes)"""
+    return np.where(np.isinf(matrix), 0.0, matrix).sum(axis=1)
+
+
+def _sorted_rows(matrix):
+    """(values, columns) of every row sorted by distance"""
+    order = np.argsort(matrix, axis=1, kind='stable')
+    return np.take_along_axis(matrix, order, axis=1), order
+
+
+def _nj_pair(matrix, sums, row_min, active, r, sorted_rows=None):
+    """Active pair (i, j) minimising Q(i, j) = (r - 2) d(i, j) - u_i - u_j; j keeps the new node"""
+    rows = np.flatnonzero(active)
+    if r < RAPID_NJ_MIN_NODES or sorted_rows is None:
+        # Whole lower triangle, scanned in the same order as Bio so ties go the same way
+        sub = matrix[np.ix_(rows, rows)]
+        node_dist = sums[rows] / (r - 2)
+        q = sub - node_dist[:, None] - node_dist[None, :]
+        q[np.triu_indices(len(rows))] = np.inf
+        a, b = np.unravel_index(np.argmin(q), q.shape)
+        if (a, b) == (1, 0):
+            # Bio's starting candidate, which it keeps unless something is strictly smaller
+            return rows[0], rows[1]
+        return rows[a], rows[b]
+
+    # Start from the full row with the lowest bound
+    max_sum = sums[rows].max()
+    bounds = (r - 2) * row_min[rows] - sums[rows] - max_sum
+    first = rows[np.argmin(bounds)]
+    q = (r - 2) * matrix[first] - sums[first] - sums
+    b = int(np.argmin(q))
+    best, best_pair = q[b], (first, b)
+
+    # Only rows whose bound beats that, and in them only the sorted prefix with
+    # (r - 2) d - u_i - max(u) < best, can hold a smaller Q
+    values, columns = sorted_rows
+    candidates = rows[bounds < best]
+    limits = (best + sums[candidates] + max_sum) / (r - 2)
+    found_rows, found_cols = [], []
+    start, width = 0, RAPID_NJ_WINDOW
+    while len(candidates) and start < values.shape[1]:
+        window = values[candidates, start:start + width]
+        hits = window < limits[:, None]
+        k, pos = np.nonzero(hits)
+        found_rows.append(candidates[k])
+        found_cols.append(columns[candidates[k], start + pos])
+        # Rows whose whole window was under the limit may have more below it
+        more = hits[:, -1]
+        candidates, limits = candidates[more], limits[more]
+        start += width
+        width *= 2
+
+    if found_rows:
+        cand_i = np.concatenate(found_rows)
+        cand_j = np.concatenate(found_cols)
+        # Real distances from the live matrix: dead columns are inf, reused slots current
+        q = (r - 2) * matrix[cand_i, cand_j] - sums[cand_i] - sums[cand_j]
+        if len(q):
+            k = int(np.argmin(q))
+            if q[k] < best:
+                best, best_pair = q[k], (cand_i[k], cand_j[k])
+    i, j = best_pair
+    return max(i, j), min(i, j)
+
+
+def _update_minima(matrix, row_arg, row_min, active, removed, merged, new):
+    """Refreshes the cached row minima after `removed` and `merged` were joined into `merged`"""
+    live = np.flatnonzero(active)
+    # Rows whose minimum pointed at a merged node need a full rescan
+    stale = live[np.isin(row_arg[live], (removed, merged))]
+    stale = np.union1d(stale, [merged])
+    # The others only have to compare against their new distance to the merged node
+    fresh = np.setdiff1d(live, stale, assume_unique=True)
+    closer = fresh[new[fresh] < row_min[fresh]]
+    row_arg[closer] = merged
+    row_min[closer] = new[closer]
+    if len(stale):
+        row_arg[stale], row_min[stale] = _row_minima(matrix, stale)
+    row_min[removed] = np.inf
+
+
+def upgma(names, distances):
+    """UPGMA (average linkage) tree (Bio.Phylo) from a condensed or square distance array"""
+    names = list(names)
+    n = len(names)
+    matrix = _square(distances)
+    if n < 3:
+        return _small_tree(names, matrix)
+
+    clades = [BaseTree.Clade(None, name) for name in names]
+    active = np.ones(n, dtype=bool)
+    sizes = np.ones(n, dtype=np.float64)
+    heights = np.zeros(n, dtype=np.float64)
+    row_arg, row_min = _row_minima(matrix, np.arange(n))
+    inner_count = 0
+
+    for _ in range(n - 1):
+        i = int(np.argmin(np.where(active, row_min, np.inf)))
+        j = int(row_arg[i])
+        # Keep the lower index for the merged node, the other slot is retired
+        i, j = max(i, j), min(i, j)
+        d_ij = matrix[i, j]
+        height = d_ij / 2.0
+        clades[i].branch_length = max(height - heights[i], 0.0)
+        clades[j].branch_length = max(height - heights[j], 0.0)
+        inner_count += 1
+        inner = BaseTree.Clade(None, f"Inner{inner_count}")
+        inner.clades.extend([clades[i], clades[j]])
+
+        new = (sizes[i] * matrix[i] + sizes[j] * matrix[j]) / (sizes[i] + sizes[j])
+        active[i] = False
+        new[~active] = np.inf
+        new[j] = np.inf
+        matrix[i, :] = np.inf
+        matrix[:, i] = np.inf
+        matrix[j, :] = new
+        matrix[:, j] = new
+        clades[j], clades[i] = inner, None
+        sizes[j] += sizes[i]
+        heights[j] = height
+        if active.sum() > 1:
+            _update_minima(matrix, row_arg, row_min, active, i, j, new)
+
+    root = clades[int(np.flatnonzero(active)[0])]
+    root.branch_length = 0
+    return BaseTree.Tree(root, rooted=True)
+
+
+def build_tree(names, distances, method='nj'):
+    """Tree from a condensed or square distance array with the given method ('nj' or 'upgma')"""
+    if method == 'nj':
+        return neighbor_joining(names, distances)
+    if method == 'upgma':
+        return upgma(names, distances)
+    raise ValueError(f"Unknown tree method '{method}', expected one of {TREE_METHODS}")
+
+
+def insert_tips(tree, placements):
+    """Adds tips to a Bio.Phylo tree in place, each one next to an existing tip.
+
+    placements are (name, sibling, distance, branch) tuples: the sibling tip's
+    pendant edge is split `branch` away from it (clipped to the edge and to
+    `distance`) and the new tip hangs from there, `distance` away from the
+    sibling. Siblings may be tips added earlier in the same call.
+    """
+    parents = {}
+    tips = {}
+    for clade in tree.find_clades(order='level'):
+        if clade.is_terminal():
+            tips.setdefault(clade.name, clade)
+        for child in clade.clades:
+            parents[id(child)] = clade
+    # New inner nodes continue the builders' Inner<k> numbering
+    numbers = (re.fullmatch(r'Inner(\d+)', clade.name or '') for clade in tree.get_nonterminals())
+    inner_count = max((int(match.group(1)) for match in numbers if match), default=0)
+
+    for name, sibling_name, distance, branch in placements:
+        sibling = tips[sibling_name]
+        parent = parents[id(sibling)]
+        edge = sibling.branch_length or 0.0
+        split = min(max(branch, 0.0), distance, edge)
+        inner_count += 1
+        inner = BaseTree.Clade(edge - split, f"Inner{inner_count}")
+        tip = BaseTree.Clade(max(distance - split, 0.0), name)
+        sibling.branch_length = split
+        parent.clades[parent.clades.index(sibling)] = inner
+        inner.clades.extend([sibling, tip])
+        parents[id(inner)], parents[id(sibling)], parents[id(tip)] = parent, inner, inner
+        tips.setdefault(name, tip)
+    return tree
+
+
+def _label(clade):
+    label = clade.name or ''
+    if label:
+        match = _UNQUOTED_LABEL.match(label)
+        if not match or match.end() < len(label):
+            label = "'%s'" % label.replace("'", "''")
+    return label + ':%1.8g' % (clade.branch_length or 0.0)
+
+
+def to_newick(tree):
+    """Newick string for a Bio.Phylo tree without recursion (deep trees with thousands of tips
+    would hit the recursion limit). Branch lengths are written with 8 significant digits
+    ('%1.8g'), so the output is Phylo.write's with format_branch_length='%1.8g', the default
+    of current Biopython (older releases default to '%1.5f', which rounds short branches to 0)."""
+    root = tree.root if isinstance(tree, BaseTree.Tree) else tree
+    parts = []
+    # Items are clades to open, or text (')label' / ',') to emit as is
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+        elif item.is_terminal():
+            parts.append(_label(item))
+        else:
+            parts.append('(')
+            stack.append(')' + _label(item))
+            children = item.clades
+            for k in range(len(children) - 1, -1, -1):
+                stack.append(children[k])
+                if k:
+                    stack.append(',')
+    return ''.join(parts) + ';'
@@ -0,0 +1,202 @@
+"""Content-addressed cache for alignments, distance matrices and trees.
+
+Entries are keyed by a hash of the normalised (title, sequence) list, in
+order, plus the method parameters, so resubmitting the same FASTA skips
+MUSCLE, the distance calculation and tree construction entirely. The order
+is part of the key because entries store names, distances and tips in the
+order of the sequences they were built from. There are two tiers: an in-memory
+LRU and .npz files on disk, both evicted by size.
+
+Entries may carry an `info` dict (stored as JSON): how the tree was built and
+the tip of each name, which is what growing a tree in place needs
+(phylogeny.extend_entry).
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+def cache_key(sequences, **params):
+    """SHA-256 of the normalised (title, sequence) pairs, in order, plus the method parameters"""
+    pairs = ((s['title'].strip(), ''.join(s['sequence'].split()).upper()) for s in sequences)
+    digest = hashlib.sha256()
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    for title, sequence in pairs:
+        digest.update(b'>' + title.encode('utf-8') + b'\n' + sequence.encode('utf-8') + b'\n')
+    return digest.hexdigest()
+
+
+def _entry_size(entry):
+    """Approximate memory footprint of an entry in bytes"""
+    return (entry['condensed'].nbytes + len(entry['aligned_fasta']) + len(entry['newick'])
+            + sum(len(name) for name in entry['names']) + sum(len(tip) for tip in entry['info'].get('tips', ())))
+
+
+def _encode(text):
+    """Strings go to disk as UTF-8 byte arrays (numpy str arrays are UTF-32)"""
+    return np.frombuffer(text.encode('utf-8'), dtype=np.uint8)
+
+
+def _decode(array):
+    return array.tobytes().decode('utf-8')
+
+
+class TreeCache:
+    """Two-tier (memory LRU + disk) cache of alignment/distance/tree results"""
+
+    def __init__(self, directory, max_memory_bytes=64 << 20, max_disk_bytes=512 << 20):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        """Returns the cached entry dict or None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+        if entry is not None:
+            metrics.inc('gf_cache_lookups_total', cache='tree', result='memory_hit')
+            return entry
+
+        entry = self._read_disk(key)
+        metrics.inc('gf_cache_lookups_total', cache='tree', result='disk_hit' if entry is not None else 'miss')
+        with self._lock:
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['disk_hits'] += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key, names, condensed, aligned_fasta='', newick='', info=None):
+        """Stores an entry in both tiers and returns it"""
+        entry = {
+            'names': list(names),
+            'condensed': np.asarray(condensed, dtype=np.float64),
+            'aligned_fasta': aligned_fasta or '',
+            'newick': newick or '',
+            'info': info or {},
+        }
+        self._write_disk(key, entry)
+        with self._lock:
+            self.counters['stores'] += 1
+            self._remember(key, entry)
+        return entry
+
+    def stats(self):
+        """Hit/miss counters and tier sizes"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        stats['disk_bytes'] = sum(size for _, size, _ in self._disk_files())
+        return stats
+
+    def clear(self):
+        """Drops every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        for path, _, _ in self._disk_files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _remember(self, key, entry):
+        """Adds to the memory tier, evicting least recently used entries (lock held)"""
+        size = _entry_size(entry)
+        if size > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= _entry_size(self._memory.pop(key))
+        self._memory[key] = entry
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= _entry_size(evicted)
+            self.counters['evictions'] += 1
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                names = _decode(data['names'])
+                entry = {
+                    'names': names.split('\x00') if names else [],
+                    'condensed': data['condensed'],
+                    'aligned_fasta': _decode(data['aligned_fasta']),
+                    'newick': _decode(data['newick']),
+                    # Entries written before `info` existed just can't be extended
+                    'info': json.loads(_decode(data['info'])) if 'info' in data.files else {},
+                }
+            os.utime(path)  # mtime doubles as the LRU clock for disk eviction
+            return entry
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+
+    def _write_disk(self, key, entry):
+        # Write to a temp file and rename so concurrent readers never see half an entry
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f,
+                                    names=_encode('\x00'.join(entry['names'])),
+                                    condensed=entry['condensed'],
+                                    aligned_fasta=_encode(entry['aligned_fasta']),
+                                    newick=_encode(entry['newick']),
+                                    info=_encode(json.dumps(entry['info'])))
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"WARNING: could not write cache entry {key}: {e}")
+            return
+        self._evict_disk()
+
+    def _disk_files(self):
+        files = []
+        try:
+            with os.scandir(self.directory) as it:
+                for item in it:
+                    if item.name.endswith('.npz'):
+                        try:
+                            stat = item.stat()
+                        except OSError:
+                            continue
+                        files.append((item.path, stat.st_size, stat.st_mtime))
+        except OSError:
+            pass
+        return files
+
+    def _evict_disk(self):
+        """Deletes the least recently used files until the disk tier fits its budget"""
+        files = self._disk_files()
+        total = sum(size for _, size, _ in files)
+        for path, size, _ in sorted(files, key=lambda f: f[2]):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                with self._lock:
+                    self.counters['evictions'] += 1
+            except OSError:
+                pass